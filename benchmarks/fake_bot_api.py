@@ -0,0 +1,302 @@
+"""Local stand-in for the Telegram Bot API, for offline load tests.
+
+Implements the methods the bot uses (getMe, getUpdates, sendMessage,
+deleteWebhook) with configurable latency, 429 RetryAfter injection, a
+Telegram-like rate limiter, 403 blocked chats and request accounting.
+
+Usage:
+    python -m benchmarks.fake_bot_api --port 8081 --latency lognormal:50:0.5 \\
+        --blocked-rate 0.02 --global-rps 30 --chat-rps 1
+
+Point the bot at it with TELEGRAM_API_URL=http://localhost:8081 (main.py,
+examples/trigger_events.py) or --bot-api for the benchmark. Counters are
+served at GET /stats and cleared with POST /stats/reset.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+import zlib
+from collections import Counter, defaultdict, deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+from aiohttp import web
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parse latency distribution (milliseconds) into a sampler returning seconds.
+
+    Formats:
+        const:50            - always 50 ms
+        uniform:20:80       - uniform between 20 and 80 ms
+        lognormal:50:0.5    - log-normal with median 50 ms and sigma 0.5
+        exp:50              - exponential with mean 50 ms
+    """
+    kind, *params = spec.split(":")
+    values = [float(param) for param in params]
+    if kind == "const":
+        return lambda rng: values[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(0, values[1]) * values[0] / 1000
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / values[0]) / 1000 if values[0] else 0.0
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class SlidingWindowLimiter:
+    """Allows `rate` requests per key in any one-second window."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self._hits: Dict[Any, Deque[float]] = defaultdict(deque)
+
+    def allow(self, key: Any, now: float) -> bool:
+        if self.rate <= 0:
+            return True
+        hits = self._hits[key]
+        while hits and hits[0] <= now - 1.0:
+            hits.popleft()
+        if len(hits) >= self.rate:
+            return False
+        hits.append(now)
+        return True
+
+
+class FakeBotAPI:
+    """
+    Bot API stand-in.
+
+    Blocked chats are chosen by a hash of the chat id, so a chat that is
+    blocked stays blocked across requests and runs.
+    """
+
+    def __init__(self, latency: str = "const:0", retry_after_rate: float = 0.0,
+                 retry_after: int = 1, blocked_rate: float = 0.0,
+                 blocked_chats: Optional[set] = None, global_rps: float = 0.0,
+                 chat_rps: float = 0.0, error_rate: float = 0.0, seed: int = 0):
+        self.sample_latency = parse_latency(latency)
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.blocked_rate = blocked_rate
+        self.blocked_chats = blocked_chats or set()
+        # Keyed by bot token: like Telegram's, the global limit is per bot
+        self.global_limiter = SlidingWindowLimiter(global_rps)
+        self.chat_limiter = SlidingWindowLimiter(chat_rps)
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.started_at = time.time()
+        self.requests: Counter = Counter()
+        self.responses: Counter = Counter()
+        self.messages_per_chat: Counter = Counter()
+        self.duplicates = 0
+        self._seen: set = set()
+        self._message_id = 0
+
+    def is_blocked(self, chat_id: int) -> bool:
+        if chat_id in self.blocked_chats:
+            return True
+        if self.blocked_rate <= 0:
+            return False
+        return zlib.crc32(str(chat_id).encode()) % 10000 < self.blocked_rate * 10000
+
+    def get_stats(self) -> Dict[str, Any]:
+        elapsed = time.time() - self.started_at
+        sent = self.responses["sendMessage:200"]
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "requests": dict(self.requests),
+            "responses": dict(self.responses),
+            "messages_sent": sent,
+            "messages_per_s": round(sent / elapsed, 1) if elapsed else 0.0,
+            "chats": len(self.messages_per_chat),
+            "max_messages_per_chat": max(self.messages_per_chat.values(), default=0),
+            "duplicates": self.duplicates,
+        }
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        app.router.add_get("/stats", self.handle_stats)
+        app.router.add_post("/stats/reset", self.handle_reset)
+        return app
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.get_stats())
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.reset_stats()
+        return web.json_response({"ok": True})
+
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        token = request.match_info["token"]
+        self.requests[method] += 1
+
+        params = await self._read_params(request)
+        handler = {
+            "getMe": self._get_me,
+            "getUpdates": self._get_updates,
+            "deleteWebhook": self._ok,
+            "sendMessage": self._send_message,
+        }.get(method)
+
+        if handler is None:
+            response = self._error(404, "Not Found: method not found")
+        else:
+            response = await handler(token, params)
+        self.responses[f"{method}:{response.status}"] += 1
+        return response
+
+    async def _read_params(self, request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post()) if request.can_read_body else dict(request.query)
+
+    async def _get_me(self, token: str, params: Dict[str, Any]) -> web.Response:
+        bot_id = int(token.split(":")[0]) if token.split(":")[0].isdigit() else 1
+        return self._result({
+            "id": bot_id,
+            "is_bot": True,
+            "first_name": "Fake Bot",
+            "username": "fake_bot",
+        })
+
+    async def _get_updates(self, token: str, params: Dict[str, Any]) -> web.Response:
+        # Long polling with no updates: wait out (part of) the timeout
+        timeout = min(float(params.get("timeout") or 0), 5.0)
+        if timeout:
+            await asyncio.sleep(timeout)
+        return self._result([])
+
+    async def _ok(self, token: str, params: Dict[str, Any]) -> web.Response:
+        return self._result(True)
+
+    async def _send_message(self, token: str, params: Dict[str, Any]) -> web.Response:
+        try:
+            chat_id = int(params["chat_id"])
+            text = str(params["text"])
+        except (KeyError, ValueError):
+            return self._error(400, "Bad Request: chat_id and text are required")
+
+        await asyncio.sleep(self.sample_latency(self.random))
+
+        now = time.monotonic()
+        if self.random.random() < self.retry_after_rate:
+            return self._retry_after(self.retry_after)
+        if not self.global_limiter.allow(token, now) or not self.chat_limiter.allow(chat_id, now):
+            return self._retry_after(self.retry_after)
+        if self.is_blocked(chat_id):
+            return self._error(403, "Forbidden: bot was blocked by the user")
+        if self.random.random() < self.error_rate:
+            return self._error(500, "Internal Server Error")
+        if not text:
+            return self._error(400, "Bad Request: message text is empty")
+
+        key = (chat_id, text)
+        if key in self._seen:
+            self.duplicates += 1
+        self._seen.add(key)
+        self.messages_per_chat[chat_id] += 1
+
+        self._message_id += 1
+        return self._result({
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        })
+
+    def _result(self, result: Any) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    def _error(self, code: int, description: str, **parameters) -> web.Response:
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        return web.json_response(body, status=code)
+
+    def _retry_after(self, seconds: int) -> web.Response:
+        return self._error(
+            429, f"Too Many Requests: retry after {seconds}", retry_after=seconds
+        )
+
+
+async def start_server(api: FakeBotAPI, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+    """
+    Start the stand-in server.
+
+    Returns:
+        Runner; call `await runner.cleanup()` to stop
+    """
+    runner = web.AppRunner(api.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Fake Bot API listening on http://{host}:{port}")
+    return runner
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", default="lognormal:50:0.5",
+                        help="const:MS | uniform:MIN:MAX | lognormal:MEDIAN:SIGMA | exp:MEAN")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0,
+                        help="Share of sendMessage calls answered with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after in 429 responses")
+    parser.add_argument("--global-rps", type=float, default=0.0,
+                        help="sendMessage limit per second per bot token (0: unlimited)")
+    parser.add_argument("--chat-rps", type=float, default=0.0,
+                        help="sendMessage limit per second per chat (0: unlimited)")
+    parser.add_argument("--blocked-rate", type=float, default=0.0,
+                        help="Share of chats that blocked the bot (403)")
+    parser.add_argument("--blocked-chats", default="", help="Comma-separated chat ids answering 403")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of 500 responses")
+    parser.add_argument("--stats-interval", type=float, default=10.0,
+                        help="Seconds between stats log lines (0: off)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args(argv)
+
+
+async def serve(args: argparse.Namespace):
+    api = FakeBotAPI(
+        latency=args.latency,
+        retry_after_rate=args.retry_after_rate,
+        retry_after=args.retry_after,
+        blocked_rate=args.blocked_rate,
+        blocked_chats={int(chat) for chat in args.blocked_chats.split(",") if chat},
+        global_rps=args.global_rps,
+        chat_rps=args.chat_rps,
+        error_rate=args.error_rate,
+        seed=args.seed
+    )
+    runner = await start_server(api, args.host, args.port)
+    try:
+        while True:
+            await asyncio.sleep(args.stats_interval or 3600)
+            if args.stats_interval:
+                logger.info(json.dumps(api.get_stats()))
+    finally:
+        await runner.cleanup()
+
+
+def main(argv=None):
+    try:
+        asyncio.run(serve(parse_args(argv)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
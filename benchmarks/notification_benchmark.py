@@ -0,0 +1,437 @@
+"""End-to-end throughput benchmark for NotificationService.
+
+Generates synthetic users, subscriptions with a realistic mix of conditions
+and events, then runs process_events() against a fake Bot with configurable
+latency and error rates, or over HTTP against a Bot API server
+(benchmarks/fake_bot_api.py) with --bot-api.
+
+Usage:
+    python -m benchmarks.notification_benchmark --subscribers 10000 --events 200
+    python -m benchmarks.notification_benchmark --subscribers 1000000 --events 20 --latency-ms 0
+    python -m benchmarks.notification_benchmark --json > baseline.json
+    python -m benchmarks.notification_benchmark --shards 4 --partition-by user
+    python -m benchmarks.notification_benchmark --bot-api http://localhost:8081
+    python -m benchmarks.notification_benchmark --rate 30 --tokens 4
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import statistics
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+
+from src.database.connection import ConnectionManager
+from src.database.db import Database
+from src.services.delivery import DeliveryPipeline
+from src.services.lanes import PRIORITIES
+from src.services.notification_service import NotificationService
+from src.services.retry import RetryPolicy
+from src.services.sharding import PARTITION_EVENT_TYPE, PARTITION_KEYS
+
+CATEGORIES = ["electronics", "books", "clothes", "toys", "food", "garden", "sport", "auto"]
+BRANDS = [f"brand{i}" for i in range(50)]
+
+# Every message is the event's sequence number, so the fake bot can tell
+# which event a message belongs to
+TEMPLATE = "{seq}"
+
+
+class FakeBot:
+    """
+    Stand-in for aiogram.Bot with simulated latency and failures.
+
+    Latency is log-normal around latency_ms (API calls have a long tail).
+    Failures are drawn independently per call: transient network errors,
+    blocked chats (403) and RetryAfter.
+    """
+
+    def __init__(self, latency_ms: float = 50.0, error_rate: float = 0.0,
+                 blocked_rate: float = 0.0, retry_after_rate: float = 0.0,
+                 seed: int = 0):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.blocked_rate = blocked_rate
+        self.retry_after_rate = retry_after_rate
+        self.random = random.Random(seed)
+
+        # (event seq, delivered at) for every successful send
+        self.deliveries: List[tuple] = []
+        self.calls = 0
+        self.errors = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.calls += 1
+        if self.latency > 0:
+            await asyncio.sleep(self.random.lognormvariate(0, 0.5) * self.latency)
+
+        roll = self.random.random()
+        if roll < self.blocked_rate:
+            self.errors += 1
+            raise TelegramForbiddenError(None, "Forbidden: bot was blocked by the user")
+        roll -= self.blocked_rate
+        if roll < self.error_rate:
+            self.errors += 1
+            raise TelegramNetworkError(None, "Simulated network error")
+        roll -= self.error_rate
+        if roll < self.retry_after_rate:
+            self.errors += 1
+            raise TelegramRetryAfter(None, "Too Many Requests", retry_after=1)
+
+        self.deliveries.append((int(text), time.perf_counter()))
+
+
+class HTTPBot(Bot):
+    """
+    aiogram.Bot talking to a Bot API server, with FakeBot's accounting.
+
+    Latency and failures come from the server (see benchmarks/fake_bot_api.py),
+    so the whole aiogram request path is part of the measurement.
+    """
+
+    def __init__(self, api_url: str, connections: int = 256, token: str = "123456:BENCHMARK"):
+        session = AiohttpSession(api=TelegramAPIServer.from_base(api_url))
+        # aiohttp's default of 100 connections would cap the delivery workers
+        session._connector_init["limit"] = connections
+        super().__init__(token=token, session=session)
+        self.deliveries: List[tuple] = []
+        self.calls = 0
+        self.errors = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.calls += 1
+        try:
+            message = await super().send_message(chat_id, text, **kwargs)
+        except Exception:
+            self.errors += 1
+            raise
+        self.deliveries.append((int(text), time.perf_counter()))
+        return message
+
+
+class TimedConnectionManager(ConnectionManager):
+    """ConnectionManager that accumulates time spent in read and write blocks."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.write_time = 0.0
+        self.read_time = 0.0
+        self.writes = 0
+        self.reads = 0
+
+    @asynccontextmanager
+    async def write(self):
+        started = time.perf_counter()
+        try:
+            async with super().write() as conn:
+                yield conn
+        finally:
+            self.write_time += time.perf_counter() - started
+            self.writes += 1
+
+    @asynccontextmanager
+    async def read(self):
+        started = time.perf_counter()
+        try:
+            async with super().read() as conn:
+                yield conn
+        finally:
+            self.read_time += time.perf_counter() - started
+            self.reads += 1
+
+
+class BenchmarkService(NotificationService):
+    """NotificationService that records when fan-out of each event starts and ends."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dispatched_at: Dict[int, float] = {}
+        self.fanout_durations: List[float] = []
+
+    async def _match_event(self, event: Dict[str, Any]):
+        self.dispatched_at[json.loads(event['data'])['seq']] = time.perf_counter()
+        return await super()._match_event(event)
+
+    async def _stream_fan_out(self, event: Dict[str, Any]):
+        self.dispatched_at[json.loads(event['data'])['seq']] = time.perf_counter()
+        await super()._stream_fan_out(event)
+
+    async def _fan_out(self, event: Dict[str, Any]):
+        started = time.perf_counter()
+        await super()._fan_out(event)
+        self.fanout_durations.append(time.perf_counter() - started)
+
+    async def _complete_event(self, event: Dict[str, Any], deliveries, started: float):
+        # Fan-out partitioned by user ends when the last shard's part is sent
+        await super()._complete_event(event, deliveries, started)
+        self.fanout_durations.append(time.perf_counter() - started)
+
+
+def random_condition(rng: random.Random) -> Optional[Dict]:
+    """Condition mix roughly like production: many unconditional, mostly simple rules."""
+    roll = rng.random()
+    if roll < 0.35:
+        return None
+    if roll < 0.60:
+        return {"operator": "and", "rules": [
+            {"field": "price", "operator": "<=", "value": rng.randint(10, 1000)}
+        ]}
+    if roll < 0.75:
+        return {"operator": "and", "rules": [
+            {"field": "category", "operator": "in", "value": rng.sample(CATEGORIES, 2)}
+        ]}
+    if roll < 0.85:
+        return {"operator": "and", "rules": [
+            {"field": "brand", "operator": "==", "value": rng.choice(BRANDS)},
+            {"field": "price", "operator": "<", "value": rng.randint(100, 1000)}
+        ]}
+    if roll < 0.95:
+        return {"operator": "or", "rules": [
+            {"field": "discount", "operator": ">=", "value": rng.randint(10, 60)},
+            {"field": "category", "operator": "==", "value": rng.choice(CATEGORIES)}
+        ]}
+    return {"operator": "and", "rules": [
+        {"field": "product.rating", "operator": ">=", "value": rng.randint(1, 5)},
+        {"operator": "or", "rules": [
+            {"field": "category", "operator": "in", "value": rng.sample(CATEGORIES, 3)},
+            {"field": "title", "operator": "contains", "value": "sale"}
+        ]}
+    ]}
+
+
+def random_event(rng: random.Random, seq: int) -> Dict[str, Any]:
+    return {
+        "seq": seq,
+        "price": rng.randint(1, 1200),
+        "category": rng.choice(CATEGORIES),
+        "brand": rng.choice(BRANDS),
+        "discount": rng.choice([0, 0, 5, 10, 20, 30, 50]),
+        "title": rng.choice(["new arrival", "big sale", "restock"]),
+        "product": {"rating": rng.randint(1, 5)},
+    }
+
+
+async def populate(db: Database, subscribers: int, seed: int) -> int:
+    """Insert users and subscriptions in bulk; returns the event type id."""
+    rng = random.Random(seed)
+    event_type_id = await db.add_event_type("benchmark", "Benchmark events", template=TEMPLATE)
+
+    chunk = 50000
+    for start in range(0, subscribers, chunk):
+        ids = range(start + 1, min(subscribers, start + chunk) + 1)
+        async with db.connections.write() as conn:
+            await conn.executemany(
+                "INSERT INTO users (user_id, telegram_id, first_name) VALUES (?, ?, ?)",
+                [(i, 10_000_000 + i, f"User {i}") for i in ids]
+            )
+            await conn.executemany(
+                "INSERT INTO user_subscriptions (user_id, event_type_id, conditions) VALUES (?, ?, ?)",
+                [
+                    (i, event_type_id, json.dumps(condition) if condition else None)
+                    for i in ids
+                    for condition in (random_condition(rng),)
+                ]
+            )
+    return event_type_id
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix="notification-bench-"), "bench.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+
+    db = Database(db_path, write_batch_size=args.write_batch_size)
+    db.connections = TimedConnectionManager(db_path, readers=args.read_pool_size)
+    await db.connect()
+
+    rss_start = rss_mb()
+    started = time.perf_counter()
+    event_type_id = await populate(db, args.subscribers, args.seed)
+    setup_s = time.perf_counter() - started
+
+    rng = random.Random(args.seed + 1)
+    await db.add_events([(event_type_id, random_event(rng, seq)) for seq in range(args.events)])
+
+    if args.bot_api:
+        bots = [
+            HTTPBot(args.bot_api, connections=args.workers, token=f"{123456 + i}:BENCHMARK")
+            for i in range(args.tokens)
+        ]
+    else:
+        bots = [
+            FakeBot(
+                latency_ms=args.latency_ms,
+                error_rate=args.error_rate,
+                blocked_rate=args.blocked_rate,
+                retry_after_rate=args.retry_after_rate,
+                seed=args.seed + i
+            )
+            for i in range(args.tokens)
+        ]
+    delivery = DeliveryPipeline(
+        bots[0],
+        workers=args.workers,
+        queue_size=args.queue_size,
+        global_rate=args.rate,
+        chat_interval=0,
+        # The benchmark event type is a broadcast whatever its lane
+        broadcast_bots=bots[1:],
+        broadcast_lanes=PRIORITIES
+    )
+    service = BenchmarkService(
+        db, bots[0],
+        delivery=delivery,
+        claim_batch_size=args.claim_batch_size,
+        stream_threshold=args.stream_threshold,
+        stream_chunk_size=args.stream_chunk_size,
+        shards=args.shards,
+        partition_by=args.partition_by,
+        # Retries are durable rows; keep them out of the measured run
+        retry_policy=RetryPolicy(base_delay=3600)
+    )
+
+    timed: TimedConnectionManager = db.connections
+    timed.write_time = timed.read_time = 0.0
+    timed.writes = timed.reads = 0
+
+    started = time.perf_counter()
+    await service.process_events()
+    await service.close()
+    await db.flush()
+    elapsed = time.perf_counter() - started
+    rss_end = rss_mb()
+
+    deliveries = [delivery for bot in bots for delivery in bot.deliveries]
+    latencies = [
+        delivered_at - service.dispatched_at[seq]
+        for seq, delivered_at in deliveries
+        if seq in service.dispatched_at
+    ]
+    write_stats = db.get_write_stats()
+    await db.close()
+    if args.bot_api:
+        for bot in bots:
+            await bot.session.close()
+
+    messages = len(deliveries)
+    return {
+        "subscribers": args.subscribers,
+        "events": args.events,
+        "tokens": args.tokens,
+        "setup_s": round(setup_s, 2),
+        "elapsed_s": round(elapsed, 3),
+        "events_per_s": round(args.events / elapsed, 1) if elapsed else 0.0,
+        "messages": messages,
+        "send_calls": sum(bot.calls for bot in bots),
+        "send_errors": sum(bot.errors for bot in bots),
+        "messages_per_s": round(messages / elapsed, 1) if elapsed else 0.0,
+        "message_latency_p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "message_latency_p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "fanout_p50_ms": round(percentile(service.fanout_durations, 50) * 1000, 2),
+        "fanout_p99_ms": round(percentile(service.fanout_durations, 99) * 1000, 2),
+        "db_write_s": round(timed.write_time, 3),
+        "db_writes": timed.writes,
+        "db_read_s": round(timed.read_time, 3),
+        "db_reads": timed.reads,
+        "db_flush_avg_ms": round(write_stats["avg_flush_ms"], 2),
+        "db_flush_max_ms": round(write_stats["max_flush_ms"], 2),
+        "rss_start_mb": round(rss_start, 1),
+        "rss_end_mb": round(rss_end, 1),
+        "rss_peak_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "db_path": db_path,
+    }
+
+
+def print_report(result: Dict[str, Any]):
+    print(f"\nNotificationService benchmark: {result['subscribers']} subscribers, "
+          f"{result['events']} events, {result['tokens']} bot tokens")
+    print("-" * 60)
+    rows = [
+        ("Setup", f"{result['setup_s']} s"),
+        ("Run time", f"{result['elapsed_s']} s"),
+        ("Throughput", f"{result['events_per_s']} events/s, {result['messages_per_s']} messages/s"),
+        ("Messages", f"{result['messages']} delivered, {result['send_errors']} failed sends "
+                     f"({result['send_calls']} calls)"),
+        ("Message latency", f"p50 {result['message_latency_p50_ms']} ms, "
+                            f"p99 {result['message_latency_p99_ms']} ms (from event dispatch)"),
+        ("Fan-out per event", f"p50 {result['fanout_p50_ms']} ms, p99 {result['fanout_p99_ms']} ms"),
+        ("DB writes", f"{result['db_write_s']} s incl. writer lock waits, {result['db_writes']} transactions "
+                      f"(flush avg {result['db_flush_avg_ms']} ms, max {result['db_flush_max_ms']} ms)"),
+        ("DB reads", f"{result['db_read_s']} s in {result['db_reads']} reads"),
+        ("Memory (RSS)", f"{result['rss_start_mb']} -> {result['rss_end_mb']} MB, "
+                         f"peak {result['rss_peak_mb']} MB"),
+    ]
+    for name, value in rows:
+        print(f"{name:<20}{value}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=10000, help="Users subscribed (1k-1M)")
+    parser.add_argument("--events", type=int, default=100, help="Events to process")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Median fake Bot API latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of transient send errors")
+    parser.add_argument("--blocked-rate", type=float, default=0.0, help="Share of 403 blocked errors")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="Share of RetryAfter errors")
+    parser.add_argument("--bot-api", help="Send over HTTP to this Bot API server instead of the "
+                                          "in-process fake (latency/error flags are then ignored)")
+    parser.add_argument("--rate", type=float, default=1_000_000, help="Send rate limit per bot token (msg/s)")
+    parser.add_argument("--tokens", type=int, default=1, help="Bot tokens the messages are spread over")
+    parser.add_argument("--workers", type=int, default=256, help="Delivery workers")
+    parser.add_argument("--queue-size", type=int, default=10000, help="Delivery queue size")
+    parser.add_argument("--stream-threshold", type=int, default=100000,
+                        help="Stream subscribers of larger audiences instead of caching them")
+    parser.add_argument("--stream-chunk-size", type=int, default=1000, help="Subscribers per streamed chunk")
+    parser.add_argument("--shards", type=int, default=1, help="Shard workers")
+    parser.add_argument("--partition-by", choices=PARTITION_KEYS, default=PARTITION_EVENT_TYPE,
+                        help="Split events between shards by event type or by recipient")
+    parser.add_argument("--claim-batch-size", type=int, default=100, help="Events claimed per page")
+    parser.add_argument("--write-batch-size", type=int, default=500, help="History rows per flush")
+    parser.add_argument("--read-pool-size", type=int, default=4, help="Read-only connections")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--db", help="Database file (default: a new temporary file)")
+    parser.add_argument("--json", action="store_true", help="Print result as JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    # Per-message logging would dominate the measurement
+    logging.disable(logging.CRITICAL)
+    result = asyncio.run(run_benchmark(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import os
 import json
 from dotenv import load_dotenv
 
-from src.database.db import Database
+from src.database.db import create_database
 
 load_dotenv()
 
@@ -13,7 +13,7 @@ async def main():
     """Example of adding subscription with conditions."""
     db_path = os.getenv("DATABASE_PATH", "bot_notifications.db")
 
-    db = Database(db_path)
+    db = create_database(os.getenv("DATABASE_URL") or db_path)
     await db.connect()
 
     try:
@@ -3,7 +3,7 @@ import asyncio
 import os
 from dotenv import load_dotenv
 
-from src.database.db import Database
+from src.database.db import create_database
 
 load_dotenv()
 
@@ -12,7 +12,7 @@ async def main():
     """Setup example event types."""
     db_path = os.getenv("DATABASE_PATH", "bot_notifications.db")
 
-    db = Database(db_path)
+    db = create_database(os.getenv("DATABASE_URL") or db_path)
     await db.connect()
 
     try:
@@ -20,7 +20,11 @@ async def main():
         event_types = [
             {
                 "name": "price_alert",
-                "description": "Уведомления об изменении цен на товары"
+                "description": "Уведомления об изменении цен на товары",
+                "template": (
+                    "<b>💰 {product}</b>\n\n"
+                    "{user.first_name}, новая цена: {price} {currency}"
+                )
             },
             {
                 "name": "order_status",
@@ -32,21 +36,32 @@ async def main():
             },
             {
                 "name": "weather_alert",
-                "description": "Предупреждения о погоде"
+                "description": "Предупреждения о погоде",
+                "priority": "urgent",
+                "ttl_seconds": 3600  # устаревшее предупреждение не отправляем
             },
             {
                 "name": "news_update",
-                "description": "Новости и обновления"
+                "description": "Новости и обновления",
+                "priority": "bulk",
+                "ttl_seconds": 86400
             },
             {
                 "name": "system_alert",
-                "description": "Системные уведомления"
+                "description": "Системные уведомления",
+                "priority": "urgent"
             }
         ]
 
         print("Creating event types...")
         for event_type in event_types:
-            await db.add_event_type(event_type["name"], event_type["description"])
+            await db.add_event_type(
+                event_type["name"],
+                event_type["description"],
+                template=event_type.get("template"),
+                priority=event_type.get("priority", "normal"),
+                ttl_seconds=event_type.get("ttl_seconds")
+            )
             print(f"✅ Created: {event_type['name']}")
 
         print("\n✅ All event types created successfully!")
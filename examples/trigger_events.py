@@ -4,7 +4,9 @@ import os
 from dotenv import load_dotenv
 
 from aiogram import Bot
-from src.database.db import Database
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from src.database.db import create_database
 from src.services.notification_service import NotificationService
 
 load_dotenv()
@@ -14,10 +16,14 @@ async def main():
     """Example of triggering events."""
     bot_token = os.getenv("BOT_TOKEN")
     db_path = os.getenv("DATABASE_PATH", "bot_notifications.db")
+    telegram_api_url = os.getenv("TELEGRAM_API_URL")
 
     # Initialize
-    bot = Bot(token=bot_token)
-    db = Database(db_path)
+    session = None
+    if telegram_api_url:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(telegram_api_url))
+    bot = Bot(token=bot_token, session=session)
+    db = create_database(os.getenv("DATABASE_URL") or db_path)
     await db.connect()
 
     notification_service = NotificationService(db, bot)
@@ -79,6 +85,8 @@ async def main():
         print("Users subscribed to these events will receive notifications.")
 
     finally:
+        # Wait for dispatched events to be delivered
+        await notification_service.close()
         await db.close()
         await bot.session.close()
 
@@ -1,11 +1,14 @@
 """Telegram bot handlers."""
 import json
+from typing import Optional
+
 from aiogram import Router, F
-from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command, ChatMemberUpdatedFilter, KICKED, MEMBER
+from aiogram.types import Message, CallbackQuery, ChatMemberUpdated
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from ..database.db import Database
+from ..services.quiet_hours import parse_quiet_hours, format_quiet_hours
 
 router = Router()
 
@@ -21,13 +24,18 @@ async def cmd_start(message: Message):
     db = await get_db(message)
 
     # Register user
-    await db.add_user(
+    user_id = await db.add_user(
         telegram_id=message.from_user.id,
         username=message.from_user.username,
         first_name=message.from_user.first_name,
         last_name=message.from_user.last_name
     )
 
+    # Returning user: resume notifications
+    user = await db.get_user(message.from_user.id)
+    if user and not user['is_active']:
+        await db.set_user_active(user_id, True)
+
     await message.answer(
         "👋 Привет! Я бот уведомлений.\n\n"
         "Я могу отправлять вам уведомления на основе событий и условий.\n\n"
@@ -35,6 +43,8 @@ async def cmd_start(message: Message):
         "/subscribe - Подписаться на события\n"
         "/unsubscribe - Отписаться от событий\n"
         "/my_subscriptions - Мои подписки\n"
+        "/digest - Получать уведомления сводкой\n"
+        "/quiet - Тихие часы\n"
         "/events - Доступные типы событий\n"
         "/history - История уведомлений"
     )
@@ -173,11 +183,126 @@ async def cmd_my_subscriptions(message: Message):
             text += f"\n  {sub['event_description']}"
         if sub['conditions']:
             text += f"\n  <i>С условиями</i>"
+        if sub['delivery_mode'] == 'digest':
+            text += f"\n  <i>📬 Сводкой</i>"
         text += "\n\n"
 
     await message.answer(text, parse_mode="HTML")
 
 
+@router.message(Command("digest"))
+async def cmd_digest(message: Message, telegram_id: int = None):
+    """Show delivery mode menu."""
+    db = await get_db(message)
+
+    # Get user (callbacks pass the id: message.from_user is the bot there)
+    user = await db.get_user(telegram_id or message.from_user.id)
+    if not user:
+        await message.answer("❌ Пожалуйста, сначала используйте /start")
+        return
+
+    subscriptions = await db.get_user_subscriptions(user['user_id'])
+    if not subscriptions:
+        await message.answer("📭 У вас пока нет активных подписок.\n\nИспользуйте /subscribe для подписки.")
+        return
+
+    builder = InlineKeyboardBuilder()
+    for sub in subscriptions:
+        is_digest = sub['delivery_mode'] == 'digest'
+        text = f"{'📬' if is_digest else '🔔'} {sub['event_name']}"
+        builder.button(text=text, callback_data=f"digest:{sub['event_type_id']}")
+
+    builder.adjust(1)
+
+    await message.answer(
+        "📬 <b>Режим доставки:</b>\n\n"
+        "🔔 — сразу, 📬 — сводкой раз в период.\n"
+        "Нажмите на подписку, чтобы переключить режим:",
+        reply_markup=builder.as_markup(),
+        parse_mode="HTML"
+    )
+
+
+@router.callback_query(F.data.startswith("digest:"))
+async def callback_digest(callback: CallbackQuery):
+    """Toggle subscription delivery mode."""
+    db = callback.bot.get("db")
+    event_type_id = int(callback.data.split(":")[1])
+
+    # Get user
+    user = await db.get_user(callback.from_user.id)
+    if not user:
+        await callback.answer("❌ Ошибка: пользователь не найден")
+        return
+
+    subscriptions = await db.get_user_subscriptions(user['user_id'])
+    sub = next((s for s in subscriptions if s['event_type_id'] == event_type_id), None)
+    if not sub:
+        await callback.answer("❌ Подписка не найдена")
+        return
+
+    delivery_mode = 'instant' if sub['delivery_mode'] == 'digest' else 'digest'
+    await db.set_subscription_delivery_mode(user['user_id'], event_type_id, delivery_mode)
+
+    if delivery_mode == 'digest':
+        await callback.answer(f"📬 '{sub['event_name']}': уведомления сводкой")
+    else:
+        await callback.answer(f"🔔 '{sub['event_name']}': уведомления сразу")
+
+    # Update keyboard
+    await cmd_digest(callback.message, telegram_id=callback.from_user.id)
+
+
+@router.message(Command("quiet"))
+async def cmd_quiet(message: Message):
+    """Show or set quiet hours: /quiet 22:00-08:00 Europe/Moscow, /quiet off."""
+    db = await get_db(message)
+
+    # Get user
+    user = await db.get_user(message.from_user.id)
+    if not user:
+        await message.answer("❌ Пожалуйста, сначала используйте /start")
+        return
+
+    args = (message.text or "").split()[1:]
+    if not args:
+        if user['quiet_start'] is None or user['quiet_end'] is None:
+            current = "не заданы"
+        else:
+            current = (
+                f"{format_quiet_hours(user['quiet_start'], user['quiet_end'])}"
+                f" ({user['timezone'] or 'UTC'})"
+            )
+        await message.answer(
+            f"🌙 <b>Тихие часы:</b> {current}\n\n"
+            "В это время уведомления копятся и приходят, когда тихие часы закончатся.\n"
+            "Задать: /quiet 22:00-08:00 Europe/Moscow\n"
+            "Отключить: /quiet off",
+            parse_mode="HTML"
+        )
+        return
+
+    if args[0] == "off":
+        await db.set_user_quiet_hours(user['user_id'], None, None, user['timezone'])
+        await message.answer("🔔 Тихие часы отключены")
+        return
+
+    try:
+        quiet_start, quiet_end = parse_quiet_hours(args[0])
+        timezone = args[1] if len(args) > 1 else user['timezone']
+        await db.set_user_quiet_hours(user['user_id'], quiet_start, quiet_end, timezone)
+    except ValueError:
+        await message.answer(
+            "❌ Формат: /quiet 22:00-08:00 Europe/Moscow\n"
+            "Часовой пояс — название из базы IANA, например Asia/Yekaterinburg."
+        )
+        return
+
+    await message.answer(
+        f"🌙 Тихие часы: {format_quiet_hours(quiet_start, quiet_end)} ({timezone or 'UTC'})"
+    )
+
+
 @router.message(Command("history"))
 async def cmd_history(message: Message):
     """Show notification history."""
@@ -198,8 +323,45 @@ async def cmd_history(message: Message):
 
     text = "📜 <b>История уведомлений:</b>\n\n"
     for notif in history:
-        status_emoji = "✅" if notif['status'] == 'sent' else "❌"
+        status_emoji = {"sent": "✅", "pending": "⏳"}.get(notif['status'], "❌")
         text += f"{status_emoji} <b>{notif['event_name']}</b>\n"
         text += f"  {notif['sent_at']}\n\n"
 
     await message.answer(text, parse_mode="HTML")
+
+
+def is_main_bot(event: ChatMemberUpdated, main_bot_id: Optional[int]) -> bool:
+    """
+    Check that a chat member update came from the main bot.
+
+    Broadcast pool bots are polled by the same dispatcher, but a user
+    blocking one of them can still be reached by the main bot, so only
+    the main bot's status changes turn notifications off or on.
+
+    Args:
+        event: Chat member update
+        main_bot_id: ID of the main bot (dispatcher data; None without a pool)
+    """
+    return main_bot_id is None or event.bot.id == main_bot_id
+
+
+@router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=KICKED))
+async def on_bot_blocked(event: ChatMemberUpdated, main_bot_id: Optional[int] = None):
+    """Stop notifying a user who blocked the bot."""
+    if not is_main_bot(event, main_bot_id):
+        return
+    db = event.bot.get("db")
+    user = await db.get_user(event.from_user.id)
+    if user:
+        await db.set_user_active(user['user_id'], False)
+
+
+@router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=MEMBER))
+async def on_bot_unblocked(event: ChatMemberUpdated, main_bot_id: Optional[int] = None):
+    """Resume notifications for a user who unblocked the bot."""
+    if not is_main_bot(event, main_bot_id):
+        return
+    db = event.bot.get("db")
+    user = await db.get_user(event.from_user.id)
+    if user:
+        await db.set_user_active(user['user_id'], True)
@@ -0,0 +1,140 @@
+"""Write-behind batching of high-volume database writes."""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ..services import metrics
+
+logger = logging.getLogger(__name__)
+
+# Notification history row: (user_id, event_id, message, status, error_message)
+NotificationRow = Tuple[int, int, str, str, Optional[str]]
+
+# Writes buffered rows and processed event ids in one transaction
+FlushCallback = Callable[[List[NotificationRow], List[int]], Awaitable[None]]
+
+
+class WriteBatcher:
+    """
+    Buffer notification history rows and processed-event marks.
+
+    Buffers are flushed when they reach batch_size, every flush_interval
+    seconds, or explicitly via flush(). A failed flush puts the rows back
+    so they are retried with the next one.
+    """
+
+    def __init__(self, flush_callback: FlushCallback, batch_size: int = 500,
+                 flush_interval: float = 0.5, max_pending: int = None):
+        self.flush_callback = flush_callback
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending or batch_size * 20
+
+        self._notifications: List[NotificationRow] = []
+        self._processed: List[int] = []
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.stats: Dict[str, float] = {
+            "flushes": 0,
+            "flush_errors": 0,
+            "rows_flushed": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    @property
+    def depth(self) -> int:
+        """Number of buffered writes."""
+        return len(self._notifications) + len(self._processed)
+
+    def start(self):
+        """Start periodic flushing."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(), name="write-batcher")
+
+    async def close(self):
+        """Stop periodic flushing and flush what is left."""
+        if self._task is not None:
+            # Never cancel a flush midway: its rows are already taken off the buffers
+            async with self._lock:
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def add_notification(self, row: NotificationRow):
+        """Buffer notification history row."""
+        self._notifications.append(row)
+        await self._on_added()
+
+    async def mark_processed(self, event_id: int):
+        """Buffer processed mark for an event."""
+        self._processed.append(event_id)
+        await self._on_added()
+
+    async def flush(self):
+        """Write all buffered rows in one transaction."""
+        async with self._lock:
+            if not self._notifications and not self._processed:
+                return
+
+            notifications, self._notifications = self._notifications, []
+            processed, self._processed = self._processed, []
+
+            started = time.perf_counter()
+            try:
+                await self.flush_callback(notifications, processed)
+            except Exception as e:
+                self._notifications[:0] = notifications
+                self._processed[:0] = processed
+                self.stats["flush_errors"] += 1
+                logger.error(f"Failed to flush {len(notifications) + len(processed)} writes: {e}")
+                raise
+
+            elapsed = time.perf_counter() - started
+            metrics.db_flush_duration.observe(elapsed)
+            metrics.db_flush_rows.observe(len(notifications) + len(processed))
+
+            elapsed_ms = elapsed * 1000
+            self.stats["flushes"] += 1
+            self.stats["rows_flushed"] += len(notifications) + len(processed)
+            self.stats["last_flush_ms"] = elapsed_ms
+            self.stats["total_flush_ms"] += elapsed_ms
+            self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], elapsed_ms)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth and flush counters."""
+        flushes = self.stats["flushes"]
+        return {
+            **self.stats,
+            "queue_depth": self.depth,
+            "pending_notifications": len(self._notifications),
+            "pending_processed": len(self._processed),
+            "avg_flush_ms": self.stats["total_flush_ms"] / flushes if flushes else 0.0,
+        }
+
+    async def _on_added(self):
+        depth = self.depth
+        if depth >= self.max_pending:
+            # Flushing can't keep up (or keeps failing): apply backpressure
+            await self.flush()
+        elif depth >= self.batch_size:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception:
+                # Already logged; rows stay buffered for the next attempt
+                await asyncio.sleep(self.flush_interval)
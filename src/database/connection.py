@@ -0,0 +1,120 @@
+"""SQLite connection management: one serialized writer and a pool of readers."""
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+
+import aiosqlite
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionManager:
+    """
+    WAL-mode SQLite connections.
+
+    All writes go through a single connection guarded by a lock, so each
+    write() block is exactly one transaction. Reads use a small pool of
+    read-only connections; in WAL mode they never wait for the writer,
+    so bot commands stay responsive during a large broadcast.
+    """
+
+    def __init__(self, db_path: str, readers: int = 4,
+                 synchronous: str = "NORMAL",
+                 cache_size_kb: int = 16384,
+                 mmap_size_mb: int = 128,
+                 busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.reader_count = readers
+        self.synchronous = synchronous
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size_mb = mmap_size_mb
+        self.busy_timeout_ms = busy_timeout_ms
+
+        self.writer: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._idle_readers: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+
+    @property
+    def is_memory(self) -> bool:
+        return self.db_path == ":memory:" or self.db_path.startswith("file::memory:")
+
+    async def open_writer(self) -> aiosqlite.Connection:
+        """Open writer connection and switch the database to WAL mode."""
+        # IMMEDIATE: write transactions take the write lock up front instead of
+        # upgrading a read lock, which deadlocks between concurrent processes
+        self.writer = await aiosqlite.connect(self.db_path, isolation_level="IMMEDIATE")
+        self.writer.row_factory = aiosqlite.Row
+
+        if not self.is_memory:
+            # Only takes effect for a new database file; lets the retention
+            # job return freed pages with incremental_vacuum
+            await self.writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            cursor = await self.writer.execute("PRAGMA journal_mode=WAL")
+            mode = (await cursor.fetchone())[0]
+            if mode.lower() != "wal":
+                logger.warning(f"Could not enable WAL mode (journal_mode={mode})")
+        await self._apply_pragmas(self.writer)
+        await self.writer.execute(f"PRAGMA synchronous={self.synchronous}")
+        return self.writer
+
+    async def open_readers(self):
+        """Open read-only connection pool (after the schema exists)."""
+        self._idle_readers = asyncio.Queue()
+        if self.is_memory:
+            # A private in-memory database is only visible to the writer
+            return
+
+        uri = Path(self.db_path).resolve().as_uri() + "?mode=ro"
+        for _ in range(self.reader_count):
+            reader = await aiosqlite.connect(uri, uri=True)
+            reader.row_factory = aiosqlite.Row
+            await self._apply_pragmas(reader)
+            self._readers.append(reader)
+            self._idle_readers.put_nowait(reader)
+
+    async def close(self):
+        """Close all connections."""
+        for reader in self._readers:
+            await reader.close()
+        self._readers = []
+        if self.writer is not None:
+            await self.writer.close()
+            self.writer = None
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """
+        Run one write transaction on the writer connection.
+
+        Commits on exit, rolls back on error. Blocks are serialized, so
+        concurrent coroutines never interleave statements in one transaction.
+        """
+        async with self._write_lock:
+            try:
+                yield self.writer
+                await self.writer.commit()
+            except BaseException:
+                await self.writer.rollback()
+                raise
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a read-only connection from the pool."""
+        if not self._readers:
+            yield self.writer
+            return
+
+        reader = await self._idle_readers.get()
+        try:
+            yield reader
+        finally:
+            self._idle_readers.put_nowait(reader)
+
+    async def _apply_pragmas(self, connection: aiosqlite.Connection):
+        await connection.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        await connection.execute(f"PRAGMA cache_size=-{self.cache_size_kb}")
+        await connection.execute(f"PRAGMA mmap_size={self.mmap_size_mb * 1024 * 1024}")
+        await connection.execute("PRAGMA temp_store=MEMORY")
@@ -1,28 +1,192 @@
 """Database manager for bot notifications."""
 import aiosqlite
 import json
+import logging
+import time
 from pathlib import Path
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, AsyncIterator, Callable, Tuple, Union
 from datetime import datetime
 
+from .batcher import WriteBatcher
+from .connection import ConnectionManager
+from ..services.condition_checker import ConditionCache, ConditionChecker, CompiledCondition
+from ..services.lanes import priority_rank, DEFAULT_PRIORITY
+from ..services.quiet_hours import get_window, validate_timezone
+from ..services.subscription_index import SubscriptionIndex, EventTypeIndex, Subscriber
+
+logger = logging.getLogger(__name__)
+
+# Columns added after the initial schema: (table, column, definition)
+SCHEMA_MIGRATIONS = [
+    ("events", "claimed_by", "TEXT"),
+    ("events", "lease_expires_at", "REAL"),
+    ("event_types", "template", "TEXT"),
+    ("user_subscriptions", "delivery_mode", "TEXT DEFAULT 'instant'"),
+    ("event_types", "priority", "INTEGER NOT NULL DEFAULT 1"),
+    ("event_types", "ttl_seconds", "REAL"),
+    ("events", "priority", "INTEGER NOT NULL DEFAULT 1"),
+    ("events", "expires_at", "REAL"),
+    ("users", "timezone", "TEXT"),
+    ("users", "quiet_start", "INTEGER"),
+    ("users", "quiet_end", "INTEGER"),
+    ("events", "idempotency_key", "TEXT"),
+    ("events", "attempts", "INTEGER NOT NULL DEFAULT 0"),
+]
+
+# Indexes and triggers on migrated columns, created once the columns exist
+SCHEMA_MIGRATION_STATEMENTS = [
+    "CREATE INDEX IF NOT EXISTS idx_events_lane ON events(priority, id) WHERE processed = 0",
+    """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_events_idempotency ON events(idempotency_key)
+    WHERE idempotency_key IS NOT NULL
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_users_quiet_hours_update
+    AFTER UPDATE OF timezone, quiet_start, quiet_end ON users
+    BEGIN
+        UPDATE cache_versions SET version = version + 1 WHERE name = 'subscriptions';
+    END
+    """,
+]
+
+# Unique (event_id, user_id) index of notification_history
+HISTORY_UNIQUE_INDEX = "idx_notification_history_event_user"
+
+# Moves all but the earliest history row of each (event, user) pair into
+# notification_history_duplicates, before HISTORY_UNIQUE_INDEX is created
+MOVE_HISTORY_DUPLICATES = [
+    """
+    INSERT INTO notification_history_duplicates
+    (id, user_id, event_id, message, sent_at, status, error_message)
+    SELECT id, user_id, event_id, message, sent_at, status, error_message
+    FROM (
+        SELECT *, ROW_NUMBER() OVER (
+            PARTITION BY event_id, user_id ORDER BY sent_at, id
+        ) AS position
+        FROM notification_history
+    ) ranked
+    WHERE position > 1
+    ON CONFLICT (id) DO NOTHING
+    """,
+    """
+    DELETE FROM notification_history
+    WHERE id IN (SELECT id FROM notification_history_duplicates)
+    """,
+]
+
+# Subscription delivery modes: send each match right away or batch them
+# into a periodic digest
+DELIVERY_MODES = ("instant", "digest")
+
+# CURRENT_TIMESTAMP with milliseconds, so dispatch lag can be measured
+EVENT_CREATED_AT = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+
+def log_moved_duplicates(moved: int):
+    """Report history rows moved to notification_history_duplicates."""
+    if moved > 0:
+        logger.warning(
+            f"Moved {moved} duplicate notification history rows to"
+            f" notification_history_duplicates (the earliest row of each"
+            f" event and user is kept)"
+        )
+
+
+def create_database(url: str, **kwargs) -> "Database":
+    """
+    Create database manager for a DATABASE_URL or SQLite file path.
+
+    Args:
+        url: postgresql://... (needs asyncpg) or a path to an SQLite file
+        **kwargs: Options of Database or PostgresDatabase
+
+    Returns:
+        Database (not connected yet)
+    """
+    if url.startswith(("postgres://", "postgresql://")):
+        from .postgres import PostgresDatabase
+        return PostgresDatabase(url, **kwargs)
+    return Database(url, **kwargs)
+
 
 class Database:
     """Async SQLite database manager."""
 
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, index_refresh_interval: float = 1.0,
+                 write_batch_size: int = 500, write_flush_interval: float = 0.5,
+                 read_pool_size: int = 4, connections=None):
         self.db_path = db_path
         self.connection: Optional[aiosqlite.Connection] = None
 
+        # WAL mode: one serialized writer plus read-only connections for
+        # handlers and fan-out reads; other backends pass their own manager
+        # with the same write()/read() interface
+        if connections is None:
+            connections = ConnectionManager(db_path, readers=read_pool_size)
+        self.connections = connections
+
+        # History rows and processed marks are written behind in batches
+        self.write_batcher = WriteBatcher(
+            self._write_batch,
+            batch_size=write_batch_size,
+            flush_interval=write_flush_interval
+        )
+        self.condition_cache = ConditionCache()
+        self.subscription_index = SubscriptionIndex()
+
+        # Subscription changes made by other processes are detected through
+        # the trigger-maintained cache_versions row, checked at most this often
+        self.index_refresh_interval = index_refresh_interval
+        self._subscriptions_version: Optional[int] = None
+        self._version_checked_at = 0.0
+
     async def connect(self):
-        """Establish database connection."""
-        self.connection = await aiosqlite.connect(self.db_path)
-        self.connection.row_factory = aiosqlite.Row
+        """Establish database connections."""
+        self.connection = await self.connections.open_writer()
         await self._init_schema()
+        await self.connections.open_readers()
+        self.write_batcher.start()
 
     async def close(self):
-        """Close database connection."""
+        """Flush buffered writes and close database connections."""
         if self.connection:
-            await self.connection.close()
+            await self.write_batcher.close()
+            await self.connections.close()
+            self.connection = None
+
+    async def flush(self):
+        """Write buffered history rows and processed marks now."""
+        await self.write_batcher.flush()
+
+    def get_write_stats(self) -> Dict[str, Any]:
+        """Get write-behind queue depth and flush latency counters."""
+        return self.write_batcher.get_stats()
+
+    async def _write_batch(self, notifications: List[tuple], processed: List[int]):
+        """Write a batch of history rows and processed marks in one transaction."""
+        async with self.connections.write() as conn:
+            if notifications:
+                # A reserved pair (status 'pending') gets its outcome; a pair
+                # already logged otherwise is kept as is
+                await conn.executemany(
+                    """
+                    INSERT INTO notification_history
+                    (user_id, event_id, message, status, error_message)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (event_id, user_id) DO UPDATE SET
+                        message = excluded.message,
+                        status = excluded.status,
+                        error_message = excluded.error_message,
+                        sent_at = excluded.sent_at
+                    WHERE notification_history.status = 'pending'
+                    """,
+                    notifications
+                )
+            if processed:
+                await conn.executemany(
+                    "UPDATE events SET processed = 1 WHERE id = ?",
+                    [(event_id,) for event_id in processed]
+                )
 
     async def _init_schema(self):
         """Initialize database schema."""
@@ -32,84 +196,297 @@ class Database:
 
         await self.connection.executescript(schema)
         await self.connection.commit()
+        await self._migrate_schema()
+
+    async def _migrate_schema(self):
+        """Add columns missing from databases created by older versions."""
+        columns: Dict[str, set] = {}
+        for table, column, definition in SCHEMA_MIGRATIONS:
+            if table not in columns:
+                cursor = await self.connection.execute(f"PRAGMA table_info({table})")
+                columns[table] = {row['name'] for row in await cursor.fetchall()}
+            if column not in columns[table]:
+                await self.connection.execute(
+                    f"ALTER TABLE {table} ADD COLUMN {column} {definition}"
+                )
+                columns[table].add(column)
+        for statement in SCHEMA_MIGRATION_STATEMENTS:
+            await self.connection.execute(statement)
+
+        # At most one delivery log row per (event, user); duplicates logged
+        # by older versions are moved aside once, before the index is created
+        cursor = await self.connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?",
+            (HISTORY_UNIQUE_INDEX,)
+        )
+        if await cursor.fetchone() is None:
+            move, delete = MOVE_HISTORY_DUPLICATES
+            await self.connection.execute(move)
+            cursor = await self.connection.execute(delete)
+            log_moved_duplicates(cursor.rowcount)
+            await self.connection.execute(
+                f"CREATE UNIQUE INDEX {HISTORY_UNIQUE_INDEX} ON notification_history(event_id, user_id)"
+            )
+        await self.connection.commit()
 
     # User methods
     async def add_user(self, telegram_id: int, username: str = None,
                        first_name: str = None, last_name: str = None) -> int:
         """Add or update user."""
-        cursor = await self.connection.execute(
-            """
-            INSERT INTO users (telegram_id, username, first_name, last_name)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(telegram_id) DO UPDATE SET
-                username = excluded.username,
-                first_name = excluded.first_name,
-                last_name = excluded.last_name
-            RETURNING user_id
-            """,
-            (telegram_id, username, first_name, last_name)
-        )
-        result = await cursor.fetchone()
-        await self.connection.commit()
-        return result['user_id']
+        async with self.connections.write() as conn:
+            # Only touch the row when the profile changed: profile updates
+            # refresh roster records (used by {user.*} template placeholders)
+            rows = await conn.execute_fetchall(
+                """
+                INSERT INTO users (telegram_id, username, first_name, last_name)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(telegram_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name
+                WHERE users.username IS NOT excluded.username
+                   OR users.first_name IS NOT excluded.first_name
+                   OR users.last_name IS NOT excluded.last_name
+                RETURNING user_id
+                """,
+                (telegram_id, username, first_name, last_name)
+            )
+            if not rows:
+                return (await conn.execute_fetchall(
+                    "SELECT user_id FROM users WHERE telegram_id = ?",
+                    (telegram_id,)
+                ))[0]['user_id']
+            version = await self._read_subscriptions_version(conn)
+
+        user_id = rows[0]['user_id']
+        if self._apply_subscriptions_version(version):
+            for event_type_id, subscriber in await self._fetch_subscribers(
+                "us.user_id = ?", (user_id,)
+            ):
+                self.subscription_index.upsert(event_type_id, subscriber)
+        return user_id
 
     async def get_user(self, telegram_id: int) -> Optional[Dict]:
         """Get user by telegram_id."""
-        cursor = await self.connection.execute(
-            "SELECT * FROM users WHERE telegram_id = ?",
-            (telegram_id,)
-        )
-        row = await cursor.fetchone()
+        async with self.connections.read() as conn:
+            cursor = await conn.execute(
+                "SELECT * FROM users WHERE telegram_id = ?",
+                (telegram_id,)
+            )
+            row = await cursor.fetchone()
         return dict(row) if row else None
 
+    async def set_user_active(self, user_id: int, is_active: bool):
+        """
+        Activate or deactivate user (e.g. after they blocked the bot).
+
+        Deactivated users are evicted from the subscriber roster right away;
+        reactivated users are put back into loaded event types.
+        """
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                UPDATE users SET is_active = ?
+                WHERE user_id = ? AND is_active != ?
+                RETURNING user_id
+                """,
+                (int(is_active), user_id, int(is_active))
+            )
+            version = await self._read_subscriptions_version(conn)
+
+        if not self._apply_subscriptions_version(version) or not rows:
+            return
+
+        if not is_active:
+            self.subscription_index.remove_user(user_id)
+            return
+
+        for event_type_id, subscriber in await self._fetch_subscribers(
+            "us.user_id = ?", (user_id,)
+        ):
+            self.subscription_index.upsert(event_type_id, subscriber)
+
+    async def deactivate_users(self, user_ids: List[int]) -> List[int]:
+        """
+        Deactivate users whose chats are unreachable, in one transaction.
+
+        They are evicted from the subscriber roster. Their pending digest
+        and deferred items are dropped and queued retries dead-lettered,
+        since none can be delivered.
+
+        Args:
+            user_ids: User IDs
+
+        Returns:
+            IDs of users that were active until now
+        """
+        if not user_ids:
+            return []
+        placeholders = ",".join("?" * len(user_ids))
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                f"""
+                UPDATE users SET is_active = 0
+                WHERE user_id IN ({placeholders}) AND is_active != 0
+                RETURNING user_id
+                """,
+                user_ids
+            )
+            await conn.execute(
+                f"DELETE FROM digest_pending WHERE user_id IN ({placeholders})",
+                user_ids
+            )
+            await conn.execute(
+                f"DELETE FROM deferred_notifications WHERE user_id IN ({placeholders})",
+                user_ids
+            )
+            await conn.execute(
+                f"""
+                UPDATE notification_retries
+                SET status = 'dead', last_error = 'chat unreachable'
+                WHERE status = 'pending' AND user_id IN ({placeholders})
+                """,
+                user_ids
+            )
+            version = await self._read_subscriptions_version(conn)
+
+        deactivated = [row['user_id'] for row in rows]
+        if self._apply_subscriptions_version(version, changes=len(deactivated)):
+            for user_id in deactivated:
+                self.subscription_index.remove_user(user_id)
+        return deactivated
+
+    async def set_user_quiet_hours(self, user_id: int, quiet_start: Optional[int],
+                                   quiet_end: Optional[int], timezone: Optional[str] = None):
+        """
+        Set quiet hours of a user; notifications due in them are deferred.
+
+        Args:
+            user_id: User ID
+            quiet_start: Start, minutes after local midnight (None to turn off)
+            quiet_end: End, minutes after local midnight (None to turn off)
+            timezone: IANA timezone name (None for UTC)
+
+        Raises:
+            ValueError: If the timezone is unknown
+        """
+        if timezone is not None:
+            validate_timezone(timezone)
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                UPDATE users SET timezone = ?, quiet_start = ?, quiet_end = ?
+                WHERE user_id = ?
+                  AND (timezone IS NOT ? OR quiet_start IS NOT ? OR quiet_end IS NOT ?)
+                RETURNING user_id
+                """,
+                (timezone, quiet_start, quiet_end, user_id, timezone, quiet_start, quiet_end)
+            )
+            version = await self._read_subscriptions_version(conn)
+
+        if rows and self._apply_subscriptions_version(version):
+            for event_type_id, subscriber in await self._fetch_subscribers(
+                "us.user_id = ?", (user_id,)
+            ):
+                self.subscription_index.upsert(event_type_id, subscriber)
+
     async def get_all_active_users(self) -> List[Dict]:
         """Get all active users."""
-        cursor = await self.connection.execute(
-            "SELECT * FROM users WHERE is_active = 1"
-        )
-        rows = await cursor.fetchall()
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT * FROM users WHERE is_active = 1"
+            )
         return [dict(row) for row in rows]
 
     # Event type methods
-    async def add_event_type(self, name: str, description: str = None) -> int:
-        """Add event type."""
-        cursor = await self.connection.execute(
-            """
-            INSERT OR IGNORE INTO event_types (name, description)
-            VALUES (?, ?)
-            RETURNING id
-            """,
-            (name, description)
-        )
-        result = await cursor.fetchone()
-        await self.connection.commit()
+    async def add_event_type(self, name: str, description: str = None,
+                             template: str = None, priority: str = DEFAULT_PRIORITY,
+                             ttl_seconds: Optional[float] = None) -> int:
+        """
+        Add event type (an existing one is left as is).
 
-        if result:
-            return result['id']
+        Args:
+            name: Event type name
+            description: Description
+            template: Message template (see services/templates.py)
+            priority: Lane of its events: urgent, normal or bulk
+            ttl_seconds: Events older than this are dropped unsent (None: never)
 
-        # If already exists, get the id
-        cursor = await self.connection.execute(
-            "SELECT id FROM event_types WHERE name = ?",
-            (name,)
-        )
-        result = await cursor.fetchone()
+        Returns:
+            Event type ID
+        """
+        rank = priority_rank(priority)
+        async with self.connections.write() as conn:
+            cursor = await conn.execute(
+                """
+                INSERT OR IGNORE INTO event_types (name, description, template, priority, ttl_seconds)
+                VALUES (?, ?, ?, ?, ?)
+                RETURNING id
+                """,
+                (name, description, template, rank, ttl_seconds)
+            )
+            result = await cursor.fetchone()
+            await cursor.close()
+
+            if result:
+                return result['id']
+
+            # If already exists, get the id
+            cursor = await conn.execute(
+                "SELECT id FROM event_types WHERE name = ?",
+                (name,)
+            )
+            result = await cursor.fetchone()
+            await cursor.close()
         return result['id']
 
+    async def set_event_type_template(self, event_type_id: int, template: Optional[str]):
+        """
+        Set message template of an event type.
+
+        Args:
+            event_type_id: Event type ID
+            template: Template text (see services/templates.py) or None for
+                the default formatting
+        """
+        async with self.connections.write() as conn:
+            await conn.execute(
+                "UPDATE event_types SET template = ? WHERE id = ?",
+                (template, event_type_id)
+            )
+
+    async def set_event_type_priority(self, event_type_id: int, priority: str,
+                                      ttl_seconds: Optional[float] = None):
+        """
+        Set lane and TTL of an event type; events created from now on use them.
+
+        Args:
+            event_type_id: Event type ID
+            priority: urgent, normal or bulk
+            ttl_seconds: Events older than this are dropped unsent (None: never)
+        """
+        async with self.connections.write() as conn:
+            await conn.execute(
+                "UPDATE event_types SET priority = ?, ttl_seconds = ? WHERE id = ?",
+                (priority_rank(priority), ttl_seconds, event_type_id)
+            )
+
     async def get_event_type(self, name: str) -> Optional[Dict]:
         """Get event type by name."""
-        cursor = await self.connection.execute(
-            "SELECT * FROM event_types WHERE name = ?",
-            (name,)
-        )
-        row = await cursor.fetchone()
+        async with self.connections.read() as conn:
+            cursor = await conn.execute(
+                "SELECT * FROM event_types WHERE name = ?",
+                (name,)
+            )
+            row = await cursor.fetchone()
         return dict(row) if row else None
 
     async def get_all_event_types(self) -> List[Dict]:
         """Get all event types."""
-        cursor = await self.connection.execute(
-            "SELECT * FROM event_types ORDER BY name"
-        )
-        rows = await cursor.fetchall()
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT * FROM event_types ORDER BY name"
+            )
         return [dict(row) for row in rows]
 
     # Subscription methods
@@ -117,130 +494,1175 @@ class Database:
                                conditions: Dict = None) -> int:
         """Add or update user subscription."""
         conditions_json = json.dumps(conditions) if conditions else None
-        cursor = await self.connection.execute(
-            """
-            INSERT INTO user_subscriptions (user_id, event_type_id, conditions)
-            VALUES (?, ?, ?)
-            ON CONFLICT(user_id, event_type_id) DO UPDATE SET
-                conditions = excluded.conditions,
-                is_active = 1
-            RETURNING id
-            """,
-            (user_id, event_type_id, conditions_json)
-        )
-        result = await cursor.fetchone()
-        await self.connection.commit()
-        return result['id']
+        async with self.connections.write() as conn:
+            cursor = await conn.execute(
+                """
+                INSERT INTO user_subscriptions (user_id, event_type_id, conditions)
+                VALUES (?, ?, ?)
+                ON CONFLICT(user_id, event_type_id) DO UPDATE SET
+                    conditions = excluded.conditions,
+                    is_active = 1
+                RETURNING id
+                """,
+                (user_id, event_type_id, conditions_json)
+            )
+            result = await cursor.fetchone()
+            await cursor.close()
+            version = await self._read_subscriptions_version(conn)
+
+        subscription_id = result['id']
+        self.condition_cache.invalidate(subscription_id)
+        if self._apply_subscriptions_version(version):
+            subscribers = await self._fetch_subscribers("us.id = ?", (subscription_id,))
+            if subscribers:
+                self.subscription_index.upsert(event_type_id, subscribers[0][1])
+            else:
+                self.subscription_index.remove(event_type_id, subscription_id)
+        return subscription_id
 
     async def remove_subscription(self, user_id: int, event_type_id: int):
         """Remove user subscription."""
-        await self.connection.execute(
-            """
-            UPDATE user_subscriptions
-            SET is_active = 0
-            WHERE user_id = ? AND event_type_id = ?
-            """,
-            (user_id, event_type_id)
-        )
-        await self.connection.commit()
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                UPDATE user_subscriptions
+                SET is_active = 0
+                WHERE user_id = ? AND event_type_id = ?
+                RETURNING id
+                """,
+                (user_id, event_type_id)
+            )
+            version = await self._read_subscriptions_version(conn)
+
+        in_sync = self._apply_subscriptions_version(version)
+        for row in rows:
+            self.condition_cache.invalidate(row['id'])
+            if in_sync:
+                self.subscription_index.remove(event_type_id, row['id'])
+
+    async def set_subscription_delivery_mode(self, user_id: int, event_type_id: int,
+                                             delivery_mode: str):
+        """
+        Switch subscription between instant and digest delivery.
+
+        Args:
+            user_id: User ID
+            event_type_id: Event type ID
+            delivery_mode: One of DELIVERY_MODES
+        """
+        if delivery_mode not in DELIVERY_MODES:
+            raise ValueError(f"Unknown delivery mode: {delivery_mode}")
+
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                UPDATE user_subscriptions
+                SET delivery_mode = ?
+                WHERE user_id = ? AND event_type_id = ? AND delivery_mode IS NOT ?
+                RETURNING id
+                """,
+                (delivery_mode, user_id, event_type_id, delivery_mode)
+            )
+            if not rows:
+                return
+            version = await self._read_subscriptions_version(conn)
+
+        if self._apply_subscriptions_version(version):
+            for _, subscriber in await self._fetch_subscribers("us.id = ?", (rows[0]['id'],)):
+                self.subscription_index.upsert(event_type_id, subscriber)
 
     async def get_user_subscriptions(self, user_id: int) -> List[Dict]:
         """Get all active subscriptions for a user."""
-        cursor = await self.connection.execute(
-            """
-            SELECT us.*, et.name as event_name, et.description as event_description
-            FROM user_subscriptions us
-            JOIN event_types et ON us.event_type_id = et.id
-            WHERE us.user_id = ? AND us.is_active = 1
-            """,
-            (user_id,)
-        )
-        rows = await cursor.fetchall()
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                SELECT us.*, et.name as event_name, et.description as event_description
+                FROM user_subscriptions us
+                JOIN event_types et ON us.event_type_id = et.id
+                WHERE us.user_id = ? AND us.is_active = 1
+                """,
+                (user_id,)
+            )
         return [dict(row) for row in rows]
 
     async def get_subscribers_for_event(self, event_type_id: int) -> List[Dict]:
         """Get all users subscribed to an event type."""
-        cursor = await self.connection.execute(
-            """
-            SELECT u.*, us.conditions
-            FROM users u
-            JOIN user_subscriptions us ON u.user_id = us.user_id
-            WHERE us.event_type_id = ? AND us.is_active = 1 AND u.is_active = 1
-            """,
-            (event_type_id,)
-        )
-        rows = await cursor.fetchall()
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                SELECT u.*, us.id as subscription_id, us.conditions
+                FROM users u
+                JOIN user_subscriptions us ON u.user_id = us.user_id
+                WHERE us.event_type_id = ? AND us.is_active = 1 AND u.is_active = 1
+                """,
+                (event_type_id,)
+            )
         return [dict(row) for row in rows]
 
+    async def get_subscription_index(self, event_type_id: int) -> EventTypeIndex:
+        """
+        Get roster of active subscribers for an event type.
+
+        The roster (with its predicate index) is loaded on first use and
+        then kept up to date by add_subscription, remove_subscription and
+        set_user_active, so fan-out for a hot event type does not query
+        SQLite. Changes committed by other processes drop all rosters, so
+        they are reloaded on next use.
+
+        Args:
+            event_type_id: Event type ID
+
+        Returns:
+            Subscription index
+        """
+        now = time.monotonic()
+        if now - self._version_checked_at >= self.index_refresh_interval:
+            self._version_checked_at = now
+            version = await self._read_subscriptions_version()
+            if version != self._subscriptions_version:
+                self.subscription_index.clear()
+                self._subscriptions_version = version
+
+        index = self.subscription_index.get(event_type_id)
+        while index is None:
+            version = self._subscriptions_version
+            subscribers = await self._fetch_subscribers("us.event_type_id = ?", (event_type_id,))
+            if version != self._subscriptions_version:
+                # Subscriptions changed while loading: the snapshot may be stale
+                continue
+            index = self.subscription_index.build(
+                event_type_id, [subscriber for _, subscriber in subscribers]
+            )
+        return index
+
+    async def count_subscribers(self, event_type_id: int) -> int:
+        """Get number of active subscriptions of an event type (inactive users included)."""
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT COUNT(*) FROM user_subscriptions WHERE event_type_id = ? AND is_active = 1",
+                (event_type_id,)
+            )
+        return rows[0][0]
+
+    async def iter_subscribers(self, event_type_id: int, after_id: int = 0,
+                               chunk_size: int = 1000) -> AsyncIterator[List[Subscriber]]:
+        """
+        Walk active subscribers of an event type in chunks.
+
+        Unlike get_subscription_index nothing is cached: chunks are read
+        with a keyset cursor on subscription id, so memory stays bounded by
+        chunk_size whatever the audience size.
+
+        Args:
+            event_type_id: Event type ID
+            after_id: Start after this subscription ID
+            chunk_size: Subscribers per chunk
+
+        Yields:
+            Chunks of subscribers ordered by subscription ID
+        """
+        # Conditions are compiled once per distinct text for this walk
+        # (most large audiences share a handful of conditions)
+        programs: Dict[Any, CompiledCondition] = {}
+
+        def get_condition(subscription_id: int, conditions: Optional[str]) -> CompiledCondition:
+            compiled = programs.get(conditions)
+            if compiled is None:
+                # Bounded like the chunk itself when conditions are all distinct
+                if len(programs) >= chunk_size:
+                    programs.clear()
+                compiled = programs[conditions] = ConditionChecker.compile(conditions)
+            return compiled
+
+        while True:
+            rows = await self._fetch_subscribers(
+                "us.event_type_id = ? AND us.id > ?", (event_type_id, after_id),
+                limit=chunk_size, get_condition=get_condition
+            )
+            if not rows:
+                return
+            after_id = rows[-1][1].subscription_id
+            yield [subscriber for _, subscriber in rows]
+
+    async def _fetch_subscribers(self, where: str, params: tuple, limit: Optional[int] = None,
+                                 get_condition: Optional[Callable] = None) -> List[tuple]:
+        """
+        Load active subscriptions as compact roster records.
+
+        Args:
+            where: Filter on user_subscriptions us / users u
+            params: Filter parameters
+            limit: Return the first `limit` subscriptions by id (all if None)
+            get_condition: Compiles conditions (default: the shared ConditionCache)
+
+        Returns:
+            (event_type_id, Subscriber) pairs
+        """
+        page = "ORDER BY us.id LIMIT ?" if limit is not None else ""
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                f"""
+                SELECT us.id, us.event_type_id, us.conditions, u.user_id, u.telegram_id,
+                       u.first_name, u.last_name, u.username, us.delivery_mode,
+                       u.timezone, u.quiet_start, u.quiet_end
+                FROM user_subscriptions us
+                JOIN users u ON u.user_id = us.user_id
+                WHERE {where} AND us.is_active = 1 AND u.is_active = 1
+                {page}
+                """,
+                (*params, limit) if limit is not None else params
+            )
+        get_condition = get_condition or self.condition_cache.get
+        return [
+            (row[1], Subscriber(
+                row[0], row[3], row[4], get_condition(row[0], row[2]),
+                first_name=row[5], last_name=row[6], username=row[7],
+                digest=row[8] == "digest",
+                window=get_window(row[9], row[10], row[11])
+            ))
+            for row in rows
+        ]
+
+    async def _read_subscriptions_version(self, conn: aiosqlite.Connection = None) -> int:
+        """
+        Read subscription change counter maintained by triggers.
+
+        Args:
+            conn: Connection of an open write transaction, to read the
+                version including its own changes; a reader otherwise
+        """
+        if conn is not None:
+            rows = await conn.execute_fetchall(
+                "SELECT version FROM cache_versions WHERE name = 'subscriptions'"
+            )
+        else:
+            async with self.connections.read() as reader:
+                rows = await reader.execute_fetchall(
+                    "SELECT version FROM cache_versions WHERE name = 'subscriptions'"
+                )
+        return rows[0]['version'] if rows else 0
+
+    def _apply_subscriptions_version(self, version: int, changes: int = 1) -> bool:
+        """
+        Record version after our own subscription write.
+
+        Args:
+            version: Version read inside the write transaction
+            changes: Number of version bumps the write made itself
+
+        Returns:
+            True if loaded indexes can be updated incrementally, False if
+            another process changed subscriptions meanwhile (indexes dropped)
+        """
+        expected = self._subscriptions_version
+        self._subscriptions_version = version
+        if expected is not None and version - expected <= changes:
+            return True
+        self.subscription_index.clear()
+        return False
+
     # Event methods
-    async def add_event(self, event_type_id: int, data: Dict) -> int:
-        """Add new event."""
-        data_json = json.dumps(data)
-        cursor = await self.connection.execute(
-            """
-            INSERT INTO events (event_type_id, data)
-            VALUES (?, ?)
-            RETURNING id
-            """,
-            (event_type_id, data_json)
-        )
-        result = await cursor.fetchone()
-        await self.connection.commit()
-        return result['id']
+    async def add_event(self, event_type_id: int, data: Dict,
+                        idempotency_key: Optional[str] = None) -> int:
+        """
+        Add new event with the lane and expiry of its event type.
+
+        Args:
+            event_type_id: Event type ID
+            data: Event data
+            idempotency_key: Producer-chosen key; adding an event with a key
+                that is already used returns the existing event instead
+
+        Returns:
+            Event ID
+
+        Raises:
+            ValueError: If the event type does not exist
+        """
+        return (await self.add_events([(event_type_id, data, idempotency_key)]))[0]
+
+    async def add_events(self, events: List[tuple]) -> List[int]:
+        """
+        Add many events in one transaction.
+
+        Each event takes the lane and TTL of its event type. Events whose
+        idempotency key is already used are not added again.
+
+        Args:
+            events: (event_type_id, data) pairs or
+                (event_type_id, data, idempotency_key) tuples
+
+        Returns:
+            Event IDs in input order (existing IDs for reused keys)
+
+        Raises:
+            ValueError: If an event type does not exist (nothing is added)
+        """
+        event_ids = []
+        now = time.time()
+        async with self.connections.write() as conn:
+            for event_type_id, data, *key in events:
+                idempotency_key = key[0] if key else None
+                rows = await conn.execute_fetchall(
+                    f"""
+                    INSERT INTO events
+                    (event_type_id, data, created_at, priority, expires_at, idempotency_key)
+                    SELECT id, ?, {EVENT_CREATED_AT}, priority, ? + ttl_seconds, ?
+                    FROM event_types WHERE id = ?
+                    ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+                    RETURNING id
+                    """,
+                    (json.dumps(data), now, idempotency_key, event_type_id)
+                )
+                if not rows and idempotency_key is not None:
+                    rows = await conn.execute_fetchall(
+                        "SELECT id FROM events WHERE idempotency_key = ?",
+                        (idempotency_key,)
+                    )
+                if not rows:
+                    raise ValueError(f"Unknown event type: {event_type_id}")
+                event_ids.append(rows[0]['id'])
+        return event_ids
 
     async def get_unprocessed_events(self) -> List[Dict]:
         """Get all unprocessed events."""
-        cursor = await self.connection.execute(
-            """
-            SELECT e.*, et.name as event_name
+        # Buffered processed marks must be visible before selecting
+        await self.flush()
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                SELECT e.*, et.name as event_name, et.template as event_template
+                FROM events e
+                JOIN event_types et ON e.event_type_id = et.id
+                WHERE e.processed = 0
+                ORDER BY e.created_at
+                """
+            )
+        return [dict(row) for row in rows]
+
+    async def count_pending_events(self) -> int:
+        """Get number of unprocessed events."""
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT COUNT(*) FROM events WHERE processed = 0"
+            )
+        return rows[0][0]
+
+    async def has_pending_events(self, event_type_ids: Optional[List[int]] = None) -> bool:
+        """
+        Check whether any event can be claimed right now.
+
+        A cheap read for idle polling: unlike claim_events it takes no
+        write lock.
+
+        Args:
+            event_type_ids: Only look at events of these types (None for all)
+        """
+        if event_type_ids is not None and not event_type_ids:
+            return False
+        type_filter, type_params = self._event_type_filter(event_type_ids)
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                f"""
+                SELECT 1 FROM events
+                WHERE processed = 0
+                  AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                  {type_filter}
+                LIMIT 1
+                """,
+                (time.time(), *type_params)
+            )
+        return bool(rows)
+
+    async def listen_events(self, callback: Callable[[], None]) -> bool:
+        """
+        Call back whenever any process adds events.
+
+        SQLite cannot notify other processes, so workers there rely on
+        polling.
+
+        Returns:
+            Whether notifications are supported
+        """
+        return False
+
+    async def claim_events(self, owner: str, limit: int = 100,
+                           lease_seconds: float = 300, after_id: int = 0,
+                           event_type_ids: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Atomically claim pending events for a worker.
+
+        Claims events that are unprocessed and either unclaimed or whose
+        lease has expired (the previous owner died or stalled), so several
+        workers can share one database without sending an event twice.
+
+        Args:
+            owner: Worker identifier
+            limit: Maximum number of events to claim
+            lease_seconds: How long the claim is valid without renewal
+            after_id: Only claim events with a greater id
+            event_type_ids: Only claim events of these types (None for all)
+
+        Returns:
+            Claimed events, most urgent lane first, then by id
+        """
+        if event_type_ids is not None and not event_type_ids:
+            return []
+        type_filter, type_params = self._event_type_filter(event_type_ids)
+        now = time.time()
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                f"""
+                UPDATE events
+                SET claimed_by = ?, lease_expires_at = ?, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM events
+                    WHERE processed = 0
+                      AND id > ?
+                      AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                      {type_filter}
+                    ORDER BY priority, id
+                    LIMIT ?
+                )
+                RETURNING id
+                """,
+                (owner, now + lease_seconds, after_id, now, *type_params, limit)
+            )
+            return await self._fetch_events(conn, [row['id'] for row in rows])
+
+    async def claim_events_by_id(self, owner: str, event_ids: List[int],
+                                 lease_seconds: float = 300,
+                                 event_type_ids: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Atomically claim specific events for a worker.
+
+        Events that are already processed or leased by another worker are
+        skipped.
+
+        Args:
+            owner: Worker identifier
+            event_ids: Event IDs to claim
+            lease_seconds: How long the claim is valid without renewal
+            event_type_ids: Only claim events of these types (None for all)
+
+        Returns:
+            Claimed events, most urgent lane first, then by id
+        """
+        if not event_ids or (event_type_ids is not None and not event_type_ids):
+            return []
+        type_filter, type_params = self._event_type_filter(event_type_ids)
+        now = time.time()
+        placeholders = ",".join("?" * len(event_ids))
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                f"""
+                UPDATE events
+                SET claimed_by = ?, lease_expires_at = ?, attempts = attempts + 1
+                WHERE id IN ({placeholders})
+                  AND processed = 0
+                  AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+                  {type_filter}
+                RETURNING id
+                """,
+                (owner, now + lease_seconds, *event_ids, now, *type_params)
+            )
+            return await self._fetch_events(conn, [row['id'] for row in rows])
+
+    @staticmethod
+    def _event_type_filter(event_type_ids: Optional[List[int]]) -> Tuple[str, List[int]]:
+        """Build `AND event_type_id IN (...)` clause (empty for all types)."""
+        if event_type_ids is None:
+            return "", []
+        return f"AND event_type_id IN ({','.join('?' * len(event_type_ids))})", list(event_type_ids)
+
+    async def _fetch_events(self, conn: aiosqlite.Connection,
+                            event_ids: List[int]) -> List[Dict]:
+        """Load events with their type name, most urgent lane first, then by id."""
+        if not event_ids:
+            return []
+        placeholders = ",".join("?" * len(event_ids))
+        rows = await conn.execute_fetchall(
+            f"""
+            SELECT e.*, et.name as event_name, et.template as event_template
             FROM events e
             JOIN event_types et ON e.event_type_id = et.id
-            WHERE e.processed = 0
-            ORDER BY e.created_at
-            """
+            WHERE e.id IN ({placeholders})
+            ORDER BY e.priority, e.id
+            """,
+            event_ids
         )
-        rows = await cursor.fetchall()
         return [dict(row) for row in rows]
 
+    async def iter_pending_events(self, owner: str,
+                                  batch_size: Union[int, Callable[[], int]] = 100,
+                                  lease_seconds: float = 300,
+                                  event_type_ids: Optional[List[int]] = None
+                                  ) -> AsyncIterator[List[Dict]]:
+        """
+        Claim pending events page by page.
+
+        Memory stays bounded by batch_size no matter how large the backlog
+        is. Each page is claimed afresh from all pending events rather than
+        after the previous page, so urgent events created mid-pass are
+        claimed ahead of the rest of a bulk backlog; events already leased
+        are not claimed again.
+
+        Args:
+            owner: Worker identifier
+            batch_size: Events per page, or a callable giving the size of the next page
+            lease_seconds: Lease duration of claimed events
+            event_type_ids: Only claim events of these types (None for all)
+
+        Yields:
+            Pages of claimed events, most urgent lane first
+        """
+        while True:
+            events = await self.claim_events(
+                owner, limit=batch_size() if callable(batch_size) else batch_size,
+                lease_seconds=lease_seconds, event_type_ids=event_type_ids
+            )
+            if not events:
+                return
+            yield events
+
+    async def extend_leases(self, event_ids: List[int], owner: str,
+                            lease_seconds: float = 300) -> List[int]:
+        """
+        Renew leases of events still being processed by owner.
+
+        Returns:
+            IDs of the events owner still holds (others were processed or
+            re-claimed by another worker after the lease ran out)
+        """
+        if not event_ids:
+            return []
+        placeholders = ",".join("?" * len(event_ids))
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                f"""
+                UPDATE events SET lease_expires_at = ?
+                WHERE claimed_by = ? AND processed = 0 AND id IN ({placeholders})
+                RETURNING id
+                """,
+                (time.time() + lease_seconds, owner, *event_ids)
+            )
+        return [row['id'] for row in rows]
+
+    async def release_events(self, event_ids: List[int], owner: str):
+        """Give up leases of unstarted events so other workers can claim them right away."""
+        if not event_ids:
+            return
+        placeholders = ",".join("?" * len(event_ids))
+        async with self.connections.write() as conn:
+            await conn.execute(
+                f"""
+                UPDATE events
+                SET claimed_by = NULL, lease_expires_at = NULL, attempts = attempts - 1
+                WHERE claimed_by = ? AND processed = 0 AND id IN ({placeholders})
+                """,
+                (owner, *event_ids)
+            )
+
     async def mark_event_processed(self, event_id: int):
-        """Mark event as processed."""
-        await self.connection.execute(
-            "UPDATE events SET processed = 1 WHERE id = ?",
-            (event_id,)
-        )
-        await self.connection.commit()
+        """Mark event as processed (buffered, written with the next flush)."""
+        await self.write_batcher.mark_processed(event_id)
+
+    # Fan-out checkpoint methods
+    async def get_fanout_checkpoint(self, event_id: int) -> int:
+        """
+        Get progress of a streamed fan-out.
+
+        Returns:
+            Last subscription ID already handled, 0 if none
+        """
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT last_subscription_id FROM fanout_checkpoints WHERE event_id = ?",
+                (event_id,)
+            )
+        return rows[0][0] if rows else 0
+
+    async def save_fanout_checkpoint(self, event_id: int, subscription_id: int):
+        """Record that a streamed fan-out got through subscription_id."""
+        async with self.connections.write() as conn:
+            await conn.execute(
+                """
+                INSERT INTO fanout_checkpoints (event_id, last_subscription_id)
+                VALUES (?, ?)
+                ON CONFLICT(event_id) DO UPDATE SET
+                    last_subscription_id = excluded.last_subscription_id,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (event_id, subscription_id)
+            )
+
+    async def prune_fanout_checkpoints(self, keep_days: int, batch_size: int = 500) -> int:
+        """
+        Delete one batch of checkpoints of processed events.
+
+        keep_days is accepted for HistoryRetention; a processed event is
+        never resumed, so its checkpoint goes right away.
+
+        Returns:
+            Number of rows deleted
+        """
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                DELETE FROM fanout_checkpoints
+                WHERE event_id IN (
+                    SELECT c.event_id FROM fanout_checkpoints c
+                    JOIN events e ON e.id = c.event_id
+                    WHERE e.processed = 1
+                    LIMIT ?
+                )
+                RETURNING event_id
+                """,
+                (batch_size,)
+            )
+        return len(rows)
+
+    # Worker membership methods
+    async def heartbeat_worker(self, worker_id: str, ttl: float = 30) -> List[str]:
+        """
+        Record that a worker is alive and get all live workers.
+
+        Workers without a heartbeat for ttl seconds are removed.
+
+        Args:
+            worker_id: Worker identifier
+            ttl: Seconds after which a silent worker counts as gone
+
+        Returns:
+            Live worker IDs, sorted
+        """
+        now = time.time()
+        async with self.connections.write() as conn:
+            await conn.execute(
+                """
+                INSERT INTO notification_workers (worker_id, heartbeat_at)
+                VALUES (?, ?)
+                ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+                """,
+                (worker_id, now)
+            )
+            await conn.execute(
+                "DELETE FROM notification_workers WHERE heartbeat_at < ?",
+                (now - ttl,)
+            )
+            rows = await conn.execute_fetchall(
+                "SELECT worker_id FROM notification_workers ORDER BY worker_id"
+            )
+        return [row['worker_id'] for row in rows]
+
+    async def remove_worker(self, worker_id: str):
+        """Remove worker from the live set (on clean shutdown)."""
+        async with self.connections.write() as conn:
+            await conn.execute(
+                "DELETE FROM notification_workers WHERE worker_id = ?",
+                (worker_id,)
+            )
+
+    # Retention methods
+    async def rollup_history(self, keep_days: int, batch_size: int = 500) -> int:
+        """
+        Roll one batch of old history rows up into daily counts.
+
+        Rows older than keep_days are added to notification_daily_stats
+        and deleted in the same short transaction.
+
+        Args:
+            keep_days: Days of detailed history to keep
+            batch_size: Max rows per call
+
+        Returns:
+            Number of rows rolled up (0 when nothing is left)
+        """
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                SELECT id FROM notification_history
+                WHERE sent_at < datetime('now', ?)
+                ORDER BY sent_at
+                LIMIT ?
+                """,
+                (f"-{keep_days} days", batch_size)
+            )
+            if not rows:
+                return 0
+
+            history_ids = [row['id'] for row in rows]
+            placeholders = ",".join("?" * len(history_ids))
+            await conn.execute(
+                f"""
+                INSERT INTO notification_daily_stats
+                (day, user_id, event_type_id, status, count)
+                SELECT date(nh.sent_at), nh.user_id, COALESCE(e.event_type_id, 0),
+                       COALESCE(nh.status, 'sent'), COUNT(*)
+                FROM notification_history nh
+                LEFT JOIN events e ON e.id = nh.event_id
+                WHERE nh.id IN ({placeholders})
+                GROUP BY 1, 2, 3, 4
+                ON CONFLICT(day, user_id, event_type_id, status)
+                DO UPDATE SET count = count + excluded.count
+                """,
+                history_ids
+            )
+            await conn.execute(
+                f"DELETE FROM notification_history WHERE id IN ({placeholders})",
+                history_ids
+            )
+        return len(history_ids)
+
+    async def prune_dead_retries(self, keep_days: int, batch_size: int = 500) -> int:
+        """
+        Delete one batch of dead-lettered retries older than keep_days.
+
+        Returns:
+            Number of rows deleted
+        """
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                DELETE FROM notification_retries
+                WHERE id IN (
+                    SELECT id FROM notification_retries
+                    WHERE status = 'dead' AND created_at < datetime('now', ?)
+                    LIMIT ?
+                )
+                RETURNING id
+                """,
+                (f"-{keep_days} days", batch_size)
+            )
+        return len(rows)
+
+    async def incremental_vacuum(self, pages: int = 1000) -> Optional[int]:
+        """
+        Return up to `pages` free pages to the file system.
+
+        Returns:
+            Free pages left, or None if the database was not created with
+            auto_vacuum=INCREMENTAL (see enable_incremental_vacuum)
+        """
+        async with self.connections.write() as conn:
+            mode = (await conn.execute_fetchall("PRAGMA auto_vacuum"))[0][0]
+            if mode != 2:
+                return None
+            # executescript steps the pragma to completion (execute frees one page)
+            await conn.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+            return (await conn.execute_fetchall("PRAGMA freelist_count"))[0][0]
+
+    async def enable_incremental_vacuum(self):
+        """
+        Switch an existing database to auto_vacuum=INCREMENTAL.
+
+        Rewrites the whole file with VACUUM, so run it during maintenance.
+        """
+        async with self.connections.write() as conn:
+            await conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # VACUUM can't run inside a transaction
+            await conn.commit()
+            await conn.execute("VACUUM")
+
+    async def get_notification_stats(self, user_id: int, days: int = 30) -> List[Dict]:
+        """
+        Get per-day notification counts of a user by event type and status.
+
+        Combines rolled-up counts with the detailed history.
+        """
+        await self.flush()
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                SELECT day, event_type_id, status, SUM(count) AS count
+                FROM (
+                    SELECT day, event_type_id, status, count
+                    FROM notification_daily_stats
+                    WHERE user_id = ? AND day >= date('now', ?)
+                    UNION ALL
+                    SELECT date(nh.sent_at), e.event_type_id, nh.status, 1
+                    FROM notification_history nh
+                    JOIN events e ON e.id = nh.event_id
+                    WHERE nh.user_id = ? AND nh.sent_at >= date('now', ?)
+                )
+                GROUP BY day, event_type_id, status
+                ORDER BY day DESC
+                """,
+                (user_id, f"-{days} days", user_id, f"-{days} days")
+            )
+        return [dict(row) for row in rows]
+
+    # Digest methods
+    async def add_digest_items(self, items: List[Tuple[int, int, str]]) -> List[int]:
+        """
+        Persist notifications held back for digests.
+
+        Args:
+            items: (user_id, event_id, message) tuples
+
+        Returns:
+            Item IDs in input order
+        """
+        item_ids = []
+        async with self.connections.write() as conn:
+            for user_id, event_id, message in items:
+                rows = await conn.execute_fetchall(
+                    """
+                    INSERT INTO digest_pending (user_id, event_id, message)
+                    VALUES (?, ?, ?)
+                    RETURNING id
+                    """,
+                    (user_id, event_id, message)
+                )
+                item_ids.append(rows[0]['id'])
+        return item_ids
+
+    async def get_digest_items(self) -> List[Dict]:
+        """Get all pending digest items of active users, ordered by id."""
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                SELECT dp.id, dp.user_id, dp.event_id, dp.message, u.telegram_id
+                FROM digest_pending dp
+                JOIN users u ON u.user_id = dp.user_id
+                WHERE u.is_active = 1
+                ORDER BY dp.id
+                """
+            )
+        return [dict(row) for row in rows]
+
+    async def claim_digest_items(self, item_ids: List[int]) -> List[int]:
+        """
+        Atomically take pending digest items for sending.
+
+        Items already taken by another worker are skipped.
+
+        Returns:
+            IDs of the items taken
+        """
+        claimed = []
+        async with self.connections.write() as conn:
+            # Chunked to stay below SQLite's bound parameter limit
+            for start in range(0, len(item_ids), 500):
+                chunk = item_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = await conn.execute_fetchall(
+                    f"DELETE FROM digest_pending WHERE id IN ({placeholders}) RETURNING id",
+                    chunk
+                )
+                claimed.extend(row['id'] for row in rows)
+        return claimed
+
+    # Deferred notification methods
+    async def add_deferred_notifications(self, items: List[Tuple[int, int, int, str, float]]
+                                         ) -> List[int]:
+        """
+        Persist notifications held until quiet hours end.
+
+        Args:
+            items: (user_id, event_id, chat_id, message, release_at) tuples
+
+        Returns:
+            Item IDs in input order
+        """
+        item_ids = []
+        async with self.connections.write() as conn:
+            for item in items:
+                rows = await conn.execute_fetchall(
+                    """
+                    INSERT INTO deferred_notifications
+                    (user_id, event_id, chat_id, message, release_at)
+                    VALUES (?, ?, ?, ?, ?)
+                    RETURNING id
+                    """,
+                    item
+                )
+                item_ids.append(rows[0]['id'])
+        return item_ids
+
+    async def get_deferred_schedule(self) -> List[Tuple[int, float]]:
+        """Get (item ID, release time) of all deferred notifications."""
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT id, release_at FROM deferred_notifications"
+            )
+        return [(row['id'], row['release_at']) for row in rows]
+
+    async def claim_deferred_notifications(self, item_ids: List[int]) -> List[Dict]:
+        """
+        Atomically take deferred notifications for sending.
+
+        Items already taken by another worker are skipped.
+
+        Returns:
+            Rows of the items taken
+        """
+        claimed = []
+        async with self.connections.write() as conn:
+            # Chunked to stay below SQLite's bound parameter limit
+            for start in range(0, len(item_ids), 500):
+                chunk = item_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = await conn.execute_fetchall(
+                    f"DELETE FROM deferred_notifications WHERE id IN ({placeholders}) RETURNING *",
+                    chunk
+                )
+                claimed.extend(dict(row) for row in rows)
+        return claimed
+
+    async def claim_due_deferred_notifications(self, limit: int = 500) -> List[Dict]:
+        """
+        Atomically take deferred notifications whose release time has passed.
+
+        Picks up items scheduled by workers that are gone (an index range
+        on release_at, not a table scan).
+
+        Returns:
+            Rows of the items taken, earliest first
+        """
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                DELETE FROM deferred_notifications
+                WHERE id IN (
+                    SELECT id FROM deferred_notifications
+                    WHERE release_at <= ?
+                    ORDER BY release_at
+                    LIMIT ?
+                )
+                RETURNING *
+                """,
+                (time.time(), limit)
+            )
+        return sorted((dict(row) for row in rows), key=lambda row: row['release_at'])
+
+    # Retry queue methods
+    async def add_retry(self, user_id: int, event_id: int, chat_id: int,
+                        message: str, next_attempt_at: float, error: str = None) -> int:
+        """
+        Queue failed notification for another attempt.
+
+        Args:
+            user_id: User ID
+            event_id: Event ID
+            chat_id: Telegram chat ID
+            message: Message text
+            next_attempt_at: Unix time of the next attempt
+            error: Error of the failed send
+
+        Returns:
+            Retry ID
+        """
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                INSERT INTO notification_retries
+                (user_id, event_id, chat_id, message, next_attempt_at, last_error)
+                VALUES (?, ?, ?, ?, ?, ?)
+                RETURNING id
+                """,
+                (user_id, event_id, chat_id, message, next_attempt_at, error)
+            )
+        return rows[0]['id']
+
+    async def claim_retries(self, limit: int = 200, lease_seconds: float = 300) -> List[Dict]:
+        """
+        Atomically take due retries, earliest first.
+
+        Claimed retries are pushed lease_seconds into the future, so other
+        workers skip them and they come back if this worker dies.
+
+        Returns:
+            Claimed retry rows
+        """
+        now = time.time()
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                UPDATE notification_retries
+                SET next_attempt_at = ?
+                WHERE id IN (
+                    SELECT id FROM notification_retries
+                    WHERE status = 'pending' AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at
+                    LIMIT ?
+                )
+                RETURNING *
+                """,
+                (now + lease_seconds, now, limit)
+            )
+        return [dict(row) for row in rows]
+
+    async def complete_retry(self, retry_id: int):
+        """Remove retry after a successful send."""
+        async with self.connections.write() as conn:
+            await conn.execute("DELETE FROM notification_retries WHERE id = ?", (retry_id,))
+
+    async def reschedule_retry(self, retry_id: int, attempts: int,
+                               next_attempt_at: Optional[float], error: str = None):
+        """
+        Record another failed attempt.
+
+        Args:
+            retry_id: Retry ID
+            attempts: Failed sends so far
+            next_attempt_at: Unix time of the next attempt, or None to
+                dead-letter the notification
+            error: Error of the failed send
+        """
+        async with self.connections.write() as conn:
+            await conn.execute(
+                """
+                UPDATE notification_retries
+                SET attempts = ?, last_error = ?,
+                    status = CASE WHEN ? IS NULL THEN 'dead' ELSE 'pending' END,
+                    next_attempt_at = COALESCE(?, next_attempt_at)
+                WHERE id = ?
+                """,
+                (attempts, error, next_attempt_at, next_attempt_at, retry_id)
+            )
+
+    async def get_retry_counts(self) -> Dict[str, int]:
+        """Get number of retries by status (pending, dead)."""
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                "SELECT status, COUNT(*) AS count FROM notification_retries GROUP BY status"
+            )
+        return {row['status']: row['count'] for row in rows}
 
     # Notification history methods
     async def add_notification(self, user_id: int, event_id: int,
                                message: str, status: str = 'sent',
                                error_message: str = None) -> int:
-        """Add notification to history."""
-        cursor = await self.connection.execute(
-            """
-            INSERT INTO notification_history
-            (user_id, event_id, message, status, error_message)
-            VALUES (?, ?, ?, ?, ?)
-            RETURNING id
-            """,
+        """
+        Add notification to history right away.
+
+        For callers that need the row; delivery logs through
+        queue_notification(), which batches writes.
+
+        Returns:
+            History row ID (of the existing row if the pair is already logged;
+            a reserved row gets this outcome)
+        """
+        async with self.connections.write() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                INSERT INTO notification_history
+                (user_id, event_id, message, status, error_message)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (event_id, user_id) DO UPDATE SET
+                    message = excluded.message,
+                    status = excluded.status,
+                    error_message = excluded.error_message,
+                    sent_at = excluded.sent_at
+                WHERE notification_history.status = 'pending'
+                RETURNING id
+                """,
+                (user_id, event_id, message, status, error_message)
+            )
+            if not rows:
+                rows = await conn.execute_fetchall(
+                    "SELECT id FROM notification_history WHERE event_id = ? AND user_id = ?",
+                    (event_id, user_id)
+                )
+        return rows[0]['id']
+
+    async def queue_notification(self, user_id: int, event_id: int,
+                                 message: str, status: str = 'sent',
+                                 error_message: str = None):
+        """Add notification to history (buffered, written with the next flush)."""
+        await self.write_batcher.add_notification(
             (user_id, event_id, message, status, error_message)
         )
-        result = await cursor.fetchone()
-        await self.connection.commit()
-        return result['id']
+
+    async def get_notified_users(self, event_id: int, user_ids: List[int]) -> set:
+        """
+        Get users an event was already delivered to or queued for.
+
+        Covers the delivery log and notifications waiting as digest items,
+        deferred past quiet hours or in the retry queue, so an event
+        processed again after a crash skips them.
+
+        Args:
+            event_id: Event ID
+            user_ids: Candidate recipients
+
+        Returns:
+            IDs of the users among user_ids to skip
+        """
+        await self.flush()
+        notified = set()
+        async with self.connections.read() as conn:
+            # Chunked to stay below SQLite's bound parameter limit
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = await conn.execute_fetchall(
+                    f"""
+                    SELECT user_id FROM notification_history
+                    WHERE event_id = ? AND user_id IN ({placeholders})
+                    UNION
+                    SELECT user_id FROM digest_pending
+                    WHERE event_id = ? AND user_id IN ({placeholders})
+                    UNION
+                    SELECT user_id FROM deferred_notifications
+                    WHERE event_id = ? AND user_id IN ({placeholders})
+                    UNION
+                    SELECT user_id FROM notification_retries
+                    WHERE event_id = ? AND user_id IN ({placeholders})
+                    """,
+                    (event_id, *chunk) * 4
+                )
+                notified.update(row['user_id'] for row in rows)
+        return notified
+
+    async def reserve_notifications(self, event_id: int, user_ids: List[int]) -> set:
+        """
+        Reserve the history rows of an event's recipients before sending.
+
+        Inserts a 'pending' row per user; the delivery outcome later fills
+        it in. A user whose row already exists was reserved by another
+        attempt at the event (which sends it or already did), so only one
+        worker ever sends an event to a user.
+
+        Args:
+            event_id: Event ID
+            user_ids: Recipients about to be notified
+
+        Returns:
+            IDs of the users reserved by this call
+        """
+        reserved = set()
+        async with self.connections.write() as conn:
+            # Chunked to stay below SQLite's bound parameter limit
+            for start in range(0, len(user_ids), 500):
+                chunk = user_ids[start:start + 500]
+                rows = await conn.execute_fetchall(
+                    f"""
+                    INSERT INTO notification_history (user_id, event_id, message, status)
+                    VALUES {",".join(["(?, ?, '', 'pending')"] * len(chunk))}
+                    ON CONFLICT (event_id, user_id) DO NOTHING
+                    RETURNING user_id
+                    """,
+                    [value for user_id in chunk for value in (user_id, event_id)]
+                )
+                reserved.update(row['user_id'] for row in rows)
+        return reserved
 
     async def get_user_notifications(self, user_id: int, limit: int = 50) -> List[Dict]:
         """Get user notification history."""
-        cursor = await self.connection.execute(
-            """
-            SELECT nh.*, e.data as event_data, et.name as event_name
-            FROM notification_history nh
-            JOIN events e ON nh.event_id = e.id
-            JOIN event_types et ON e.event_type_id = et.id
-            WHERE nh.user_id = ?
-            ORDER BY nh.sent_at DESC
-            LIMIT ?
-            """,
-            (user_id, limit)
-        )
-        rows = await cursor.fetchall()
+        await self.flush()
+        async with self.connections.read() as conn:
+            rows = await conn.execute_fetchall(
+                """
+                SELECT nh.*, e.data as event_data, et.name as event_name
+                FROM notification_history nh
+                JOIN events e ON nh.event_id = e.id
+                JOIN event_types et ON e.event_type_id = et.id
+                WHERE nh.user_id = ?
+                ORDER BY nh.sent_at DESC
+                LIMIT ?
+                """,
+                (user_id, limit)
+            )
         return [dict(row) for row in rows]
@@ -0,0 +1,1204 @@
+"""PostgreSQL backend for the notification database (asyncpg)."""
+import json
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Optional, List, Dict, AsyncIterator, Callable, Tuple
+
+import asyncpg
+
+from .db import (
+    Database,
+    DELIVERY_MODES,
+    HISTORY_UNIQUE_INDEX,
+    MOVE_HISTORY_DUPLICATES,
+    log_moved_duplicates,
+)
+from ..services.lanes import priority_rank, DEFAULT_PRIORITY
+from ..services.quiet_hours import get_window, validate_timezone
+from ..services.subscription_index import Subscriber
+
+# Timestamps are stored in UTC without time zone, like CURRENT_TIMESTAMP in SQLite
+UTC_NOW = "(now() AT TIME ZONE 'utc')"
+
+# Serializes schema creation when several nodes start at once
+SCHEMA_LOCK_ID = 0x6e6f7469
+
+# NOTIFY channel of the events insert trigger (schema_postgres.sql)
+EVENTS_CHANNEL = "notification_events"
+
+
+def to_numbered(sql: str) -> str:
+    """Convert qmark placeholders (?) to asyncpg's numbered ones ($1, $2, ...)."""
+    parts = sql.split("?")
+    return "".join(
+        part + (f"${i}" if i < len(parts) else "")
+        for i, part in enumerate(parts, start=1)
+    )
+
+
+class PostgresConnectionManager:
+    """
+    asyncpg connection pool with the ConnectionManager interface.
+
+    Unlike SQLite there is no single writer: every write() block is its
+    own transaction on a pooled connection, and concurrent writers (in
+    this process or on other nodes) only wait for the rows they share.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 2, max_size: int = 10):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool: Optional[asyncpg.Pool] = None
+
+    async def open(self) -> asyncpg.Pool:
+        """Open connection pool."""
+        self.pool = await asyncpg.create_pool(
+            self.dsn, min_size=self.min_size, max_size=self.max_size
+        )
+        return self.pool
+
+    async def close(self):
+        """Close all connections."""
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[asyncpg.Connection]:
+        """Run one transaction on a pooled connection (commits on exit)."""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                yield conn
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[asyncpg.Connection]:
+        """Borrow a pooled connection for reads."""
+        async with self.pool.acquire() as conn:
+            yield conn
+
+
+class PostgresDatabase(Database):
+    """
+    Async PostgreSQL database manager with the same API as Database.
+
+    Several bot processes can share one database: events and retries are
+    claimed with FOR UPDATE SKIP LOCKED, so workers never wait on each
+    other's claims, and history rows are written with COPY. Subscription
+    rosters are cached per process exactly as with SQLite, invalidated
+    through the trigger-maintained cache_versions row.
+    """
+
+    def __init__(self, dsn: str, index_refresh_interval: float = 1.0,
+                 write_batch_size: int = 500, write_flush_interval: float = 0.5,
+                 pool_size: int = 10):
+        super().__init__(
+            dsn,
+            index_refresh_interval=index_refresh_interval,
+            write_batch_size=write_batch_size,
+            write_flush_interval=write_flush_interval,
+            connections=PostgresConnectionManager(dsn, max_size=pool_size)
+        )
+        # Dedicated connection for LISTEN (pooled connections are shared)
+        self._listener: Optional[asyncpg.Connection] = None
+        self._event_callbacks: List[Callable[[], None]] = []
+
+    async def connect(self):
+        """Open connection pool and create the schema."""
+        self.connection = await self.connections.open()
+        await self._init_schema()
+        self.write_batcher.start()
+
+    async def close(self):
+        """Stop listening for new events, flush buffered writes and close the pool."""
+        if self._listener is not None:
+            await self._listener.close()
+            self._listener = None
+        self._event_callbacks = []
+        await super().close()
+
+    async def _init_schema(self):
+        """Initialize database schema."""
+        schema_path = Path(__file__).parent / "schema_postgres.sql"
+        with open(schema_path, 'r') as f:
+            schema = f.read()
+
+        async with self.connections.write() as conn:
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK_ID)
+            await conn.execute(schema)
+
+            # At most one delivery log row per (event, user); duplicates logged
+            # by older versions are moved aside once, before the index is created
+            if await conn.fetchval("SELECT to_regclass($1)", HISTORY_UNIQUE_INDEX) is None:
+                move, delete = MOVE_HISTORY_DUPLICATES
+                await conn.execute(move)
+                status = await conn.execute(delete)
+                log_moved_duplicates(int(status.split()[-1]))
+                await conn.execute(
+                    f"CREATE UNIQUE INDEX {HISTORY_UNIQUE_INDEX} ON notification_history(event_id, user_id)"
+                )
+
+    async def _write_batch(self, notifications: List[tuple], processed: List[int]):
+        """Write a batch of history rows and processed marks in one transaction."""
+        async with self.connections.write() as conn:
+            if notifications:
+                # One statement for the batch, which may touch a pair only once;
+                # a reserved pair (status 'pending') gets its outcome, a pair
+                # already logged otherwise is kept as is
+                unique = {}
+                for row in notifications:
+                    unique.setdefault((row[0], row[1]), row)
+                await conn.execute(
+                    """
+                    INSERT INTO notification_history
+                    (user_id, event_id, message, status, error_message)
+                    SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::text[], $4::text[], $5::text[])
+                    ON CONFLICT (event_id, user_id) DO UPDATE SET
+                        message = excluded.message,
+                        status = excluded.status,
+                        error_message = excluded.error_message,
+                        sent_at = excluded.sent_at
+                    WHERE notification_history.status = 'pending'
+                    """,
+                    *zip(*unique.values())
+                )
+            if processed:
+                await conn.execute(
+                    "UPDATE events SET processed = TRUE WHERE id = ANY($1::bigint[])",
+                    processed
+                )
+
+    # User methods
+    async def add_user(self, telegram_id: int, username: str = None,
+                       first_name: str = None, last_name: str = None) -> int:
+        """Add or update user."""
+        async with self.connections.write() as conn:
+            user_id = await conn.fetchval(
+                """
+                INSERT INTO users (telegram_id, username, first_name, last_name)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (telegram_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name
+                WHERE users.username IS DISTINCT FROM excluded.username
+                   OR users.first_name IS DISTINCT FROM excluded.first_name
+                   OR users.last_name IS DISTINCT FROM excluded.last_name
+                RETURNING user_id
+                """,
+                telegram_id, username, first_name, last_name
+            )
+            if user_id is None:
+                return await conn.fetchval(
+                    "SELECT user_id FROM users WHERE telegram_id = $1",
+                    telegram_id
+                )
+            version = await self._read_subscriptions_version(conn)
+
+        if self._apply_subscriptions_version(version):
+            for event_type_id, subscriber in await self._fetch_subscribers(
+                "us.user_id = ?", (user_id,)
+            ):
+                self.subscription_index.upsert(event_type_id, subscriber)
+        return user_id
+
+    async def get_user(self, telegram_id: int) -> Optional[Dict]:
+        """Get user by telegram_id."""
+        async with self.connections.read() as conn:
+            row = await conn.fetchrow(
+                "SELECT * FROM users WHERE telegram_id = $1",
+                telegram_id
+            )
+        return dict(row) if row else None
+
+    async def set_user_active(self, user_id: int, is_active: bool):
+        """Activate or deactivate user (see Database.set_user_active)."""
+        async with self.connections.write() as conn:
+            changed = await conn.fetchval(
+                """
+                UPDATE users SET is_active = $1
+                WHERE user_id = $2 AND is_active IS DISTINCT FROM $1
+                RETURNING user_id
+                """,
+                bool(is_active), user_id
+            )
+            version = await self._read_subscriptions_version(conn)
+
+        if not self._apply_subscriptions_version(version) or changed is None:
+            return
+
+        if not is_active:
+            self.subscription_index.remove_user(user_id)
+            return
+
+        for event_type_id, subscriber in await self._fetch_subscribers(
+            "us.user_id = ?", (user_id,)
+        ):
+            self.subscription_index.upsert(event_type_id, subscriber)
+
+    async def deactivate_users(self, user_ids: List[int]) -> List[int]:
+        """Deactivate users whose chats are unreachable (see Database.deactivate_users)."""
+        if not user_ids:
+            return []
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE users SET is_active = FALSE
+                WHERE user_id = ANY($1::bigint[]) AND is_active
+                RETURNING user_id
+                """,
+                user_ids
+            )
+            await conn.execute(
+                "DELETE FROM digest_pending WHERE user_id = ANY($1::bigint[])",
+                user_ids
+            )
+            await conn.execute(
+                "DELETE FROM deferred_notifications WHERE user_id = ANY($1::bigint[])",
+                user_ids
+            )
+            await conn.execute(
+                """
+                UPDATE notification_retries
+                SET status = 'dead', last_error = 'chat unreachable'
+                WHERE status = 'pending' AND user_id = ANY($1::bigint[])
+                """,
+                user_ids
+            )
+            version = await self._read_subscriptions_version(conn)
+
+        deactivated = [row['user_id'] for row in rows]
+        if self._apply_subscriptions_version(version, changes=len(deactivated)):
+            for user_id in deactivated:
+                self.subscription_index.remove_user(user_id)
+        return deactivated
+
+    async def set_user_quiet_hours(self, user_id: int, quiet_start: Optional[int],
+                                   quiet_end: Optional[int], timezone: Optional[str] = None):
+        """Set quiet hours of a user (see Database.set_user_quiet_hours)."""
+        if timezone is not None:
+            validate_timezone(timezone)
+        async with self.connections.write() as conn:
+            changed = await conn.fetchval(
+                """
+                UPDATE users SET timezone = $1, quiet_start = $2, quiet_end = $3
+                WHERE user_id = $4
+                  AND (timezone IS DISTINCT FROM $1 OR quiet_start IS DISTINCT FROM $2
+                       OR quiet_end IS DISTINCT FROM $3)
+                RETURNING user_id
+                """,
+                timezone, quiet_start, quiet_end, user_id
+            )
+            version = await self._read_subscriptions_version(conn)
+
+        if changed is not None and self._apply_subscriptions_version(version):
+            for event_type_id, subscriber in await self._fetch_subscribers(
+                "us.user_id = ?", (user_id,)
+            ):
+                self.subscription_index.upsert(event_type_id, subscriber)
+
+    async def get_all_active_users(self) -> List[Dict]:
+        """Get all active users."""
+        async with self.connections.read() as conn:
+            rows = await conn.fetch("SELECT * FROM users WHERE is_active")
+        return [dict(row) for row in rows]
+
+    # Event type methods
+    async def add_event_type(self, name: str, description: str = None,
+                             template: str = None, priority: str = DEFAULT_PRIORITY,
+                             ttl_seconds: Optional[float] = None) -> int:
+        """Add event type (see Database.add_event_type)."""
+        rank = priority_rank(priority)
+        async with self.connections.write() as conn:
+            event_type_id = await conn.fetchval(
+                """
+                INSERT INTO event_types (name, description, template, priority, ttl_seconds)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (name) DO NOTHING
+                RETURNING id
+                """,
+                name, description, template, rank, ttl_seconds
+            )
+            if event_type_id is None:
+                # If already exists, get the id
+                event_type_id = await conn.fetchval(
+                    "SELECT id FROM event_types WHERE name = $1",
+                    name
+                )
+        return event_type_id
+
+    async def set_event_type_template(self, event_type_id: int, template: Optional[str]):
+        """Set message template of an event type (None for the default formatting)."""
+        async with self.connections.write() as conn:
+            await conn.execute(
+                "UPDATE event_types SET template = $1 WHERE id = $2",
+                template, event_type_id
+            )
+
+    async def set_event_type_priority(self, event_type_id: int, priority: str,
+                                      ttl_seconds: Optional[float] = None):
+        """Set lane and TTL of an event type (see Database.set_event_type_priority)."""
+        async with self.connections.write() as conn:
+            await conn.execute(
+                "UPDATE event_types SET priority = $1, ttl_seconds = $2 WHERE id = $3",
+                priority_rank(priority), ttl_seconds, event_type_id
+            )
+
+    async def get_event_type(self, name: str) -> Optional[Dict]:
+        """Get event type by name."""
+        async with self.connections.read() as conn:
+            row = await conn.fetchrow("SELECT * FROM event_types WHERE name = $1", name)
+        return dict(row) if row else None
+
+    async def get_all_event_types(self) -> List[Dict]:
+        """Get all event types."""
+        async with self.connections.read() as conn:
+            rows = await conn.fetch("SELECT * FROM event_types ORDER BY name")
+        return [dict(row) for row in rows]
+
+    # Subscription methods
+    async def add_subscription(self, user_id: int, event_type_id: int,
+                               conditions: Dict = None) -> int:
+        """Add or update user subscription."""
+        conditions_json = json.dumps(conditions) if conditions else None
+        async with self.connections.write() as conn:
+            subscription_id = await conn.fetchval(
+                """
+                INSERT INTO user_subscriptions (user_id, event_type_id, conditions)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (user_id, event_type_id) DO UPDATE SET
+                    conditions = excluded.conditions,
+                    is_active = TRUE
+                RETURNING id
+                """,
+                user_id, event_type_id, conditions_json
+            )
+            version = await self._read_subscriptions_version(conn)
+
+        self.condition_cache.invalidate(subscription_id)
+        if self._apply_subscriptions_version(version):
+            subscribers = await self._fetch_subscribers("us.id = ?", (subscription_id,))
+            if subscribers:
+                self.subscription_index.upsert(event_type_id, subscribers[0][1])
+            else:
+                self.subscription_index.remove(event_type_id, subscription_id)
+        return subscription_id
+
+    async def remove_subscription(self, user_id: int, event_type_id: int):
+        """Remove user subscription."""
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE user_subscriptions
+                SET is_active = FALSE
+                WHERE user_id = $1 AND event_type_id = $2
+                RETURNING id
+                """,
+                user_id, event_type_id
+            )
+            version = await self._read_subscriptions_version(conn)
+
+        in_sync = self._apply_subscriptions_version(version)
+        for row in rows:
+            self.condition_cache.invalidate(row['id'])
+            if in_sync:
+                self.subscription_index.remove(event_type_id, row['id'])
+
+    async def set_subscription_delivery_mode(self, user_id: int, event_type_id: int,
+                                             delivery_mode: str):
+        """Switch subscription between instant and digest delivery."""
+        if delivery_mode not in DELIVERY_MODES:
+            raise ValueError(f"Unknown delivery mode: {delivery_mode}")
+
+        async with self.connections.write() as conn:
+            subscription_id = await conn.fetchval(
+                """
+                UPDATE user_subscriptions
+                SET delivery_mode = $1
+                WHERE user_id = $2 AND event_type_id = $3
+                  AND delivery_mode IS DISTINCT FROM $1
+                RETURNING id
+                """,
+                delivery_mode, user_id, event_type_id
+            )
+            if subscription_id is None:
+                return
+            version = await self._read_subscriptions_version(conn)
+
+        if self._apply_subscriptions_version(version):
+            for _, subscriber in await self._fetch_subscribers("us.id = ?", (subscription_id,)):
+                self.subscription_index.upsert(event_type_id, subscriber)
+
+    async def get_user_subscriptions(self, user_id: int) -> List[Dict]:
+        """Get all active subscriptions for a user."""
+        async with self.connections.read() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT us.*, et.name as event_name, et.description as event_description
+                FROM user_subscriptions us
+                JOIN event_types et ON us.event_type_id = et.id
+                WHERE us.user_id = $1 AND us.is_active
+                """,
+                user_id
+            )
+        return [dict(row) for row in rows]
+
+    async def get_subscribers_for_event(self, event_type_id: int) -> List[Dict]:
+        """Get all users subscribed to an event type."""
+        async with self.connections.read() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT u.*, us.id as subscription_id, us.conditions
+                FROM users u
+                JOIN user_subscriptions us ON u.user_id = us.user_id
+                WHERE us.event_type_id = $1 AND us.is_active AND u.is_active
+                """,
+                event_type_id
+            )
+        return [dict(row) for row in rows]
+
+    async def count_subscribers(self, event_type_id: int) -> int:
+        """Get number of active subscriptions of an event type (inactive users included)."""
+        async with self.connections.read() as conn:
+            return await conn.fetchval(
+                "SELECT COUNT(*) FROM user_subscriptions WHERE event_type_id = $1 AND is_active",
+                event_type_id
+            )
+
+    async def _fetch_subscribers(self, where: str, params: tuple, limit: Optional[int] = None,
+                                 get_condition: Optional[Callable] = None) -> List[tuple]:
+        """
+        Load active subscriptions as compact roster records.
+
+        Args:
+            where: Filter with qmark placeholders, as for Database
+            params: Filter parameters
+            limit: Return the first `limit` subscriptions by id (all if None)
+            get_condition: Compiles conditions (default: the shared ConditionCache)
+
+        Returns:
+            (event_type_id, Subscriber) pairs
+        """
+        page = "ORDER BY us.id LIMIT ?" if limit is not None else ""
+        async with self.connections.read() as conn:
+            rows = await conn.fetch(
+                to_numbered(f"""
+                SELECT us.id, us.event_type_id, us.conditions, u.user_id, u.telegram_id,
+                       u.first_name, u.last_name, u.username, us.delivery_mode,
+                       u.timezone, u.quiet_start, u.quiet_end
+                FROM user_subscriptions us
+                JOIN users u ON u.user_id = us.user_id
+                WHERE {where} AND us.is_active AND u.is_active
+                {page}
+                """),
+                *params, *([limit] if limit is not None else [])
+            )
+        get_condition = get_condition or self.condition_cache.get
+        return [
+            (row[1], Subscriber(
+                row[0], row[3], row[4], get_condition(row[0], row[2]),
+                first_name=row[5], last_name=row[6], username=row[7],
+                digest=row[8] == "digest",
+                window=get_window(row[9], row[10], row[11])
+            ))
+            for row in rows
+        ]
+
+    async def _read_subscriptions_version(self, conn: asyncpg.Connection = None) -> int:
+        """Read subscription change counter maintained by triggers."""
+        query = "SELECT version FROM cache_versions WHERE name = 'subscriptions'"
+        if conn is not None:
+            version = await conn.fetchval(query)
+        else:
+            async with self.connections.read() as reader:
+                version = await reader.fetchval(query)
+        return version or 0
+
+    # Event methods
+    async def add_event(self, event_type_id: int, data: Dict,
+                        idempotency_key: Optional[str] = None) -> int:
+        """Add new event (see Database.add_event)."""
+        return (await self.add_events([(event_type_id, data, idempotency_key)]))[0]
+
+    async def add_events(self, events: List[tuple]) -> List[int]:
+        """
+        Add many events with one statement (see Database.add_events).
+
+        Args:
+            events: (event_type_id, data) pairs or
+                (event_type_id, data, idempotency_key) tuples
+
+        Returns:
+            Event IDs in input order (existing IDs for reused keys)
+
+        Raises:
+            ValueError: If an event type does not exist (nothing is added)
+        """
+        if not events:
+            return []
+        type_ids = [event[0] for event in events]
+        keys = [event[2] if len(event) > 2 else None for event in events]
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                INSERT INTO events (event_type_id, data, priority, expires_at, idempotency_key)
+                SELECT e.event_type_id, e.data, et.priority, $4 + et.ttl_seconds, e.idempotency_key
+                FROM unnest($1::bigint[], $2::text[], $3::text[])
+                     WITH ORDINALITY AS e(event_type_id, data, idempotency_key, n)
+                JOIN event_types et ON et.id = e.event_type_id
+                ORDER BY e.n
+                ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+                RETURNING id, idempotency_key
+                """,
+                type_ids, [json.dumps(event[1]) for event in events], keys, time.time()
+            )
+            # Ids come from a sequence in insertion order; keyed events are
+            # matched by key, including those that already existed
+            unkeyed = sorted(row['id'] for row in rows if row['idempotency_key'] is None)
+            by_key = {row['idempotency_key']: row['id'] for row in rows if row['idempotency_key']}
+            missing = [key for key in keys if key is not None and key not in by_key]
+            if missing:
+                by_key.update(
+                    (row['idempotency_key'], row['id']) for row in await conn.fetch(
+                        "SELECT id, idempotency_key FROM events WHERE idempotency_key = ANY($1::text[])",
+                        missing
+                    )
+                )
+            if len(unkeyed) != keys.count(None) or any(
+                key is not None and key not in by_key for key in keys
+            ):
+                # Raising rolls back the whole batch
+                raise ValueError(f"Unknown event type in {sorted(set(type_ids))}")
+        unkeyed.reverse()
+        return [unkeyed.pop() if key is None else by_key[key] for key in keys]
+
+    async def get_unprocessed_events(self) -> List[Dict]:
+        """Get all unprocessed events."""
+        # Buffered processed marks must be visible before selecting
+        await self.flush()
+        async with self.connections.read() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT e.*, et.name as event_name, et.template as event_template
+                FROM events e
+                JOIN event_types et ON e.event_type_id = et.id
+                WHERE NOT e.processed
+                ORDER BY e.created_at
+                """
+            )
+        return [dict(row) for row in rows]
+
+    async def count_pending_events(self) -> int:
+        """Get number of unprocessed events."""
+        async with self.connections.read() as conn:
+            return await conn.fetchval("SELECT COUNT(*) FROM events WHERE NOT processed")
+
+    async def has_pending_events(self, event_type_ids: Optional[List[int]] = None) -> bool:
+        """Check whether any event can be claimed right now."""
+        if event_type_ids is not None and not event_type_ids:
+            return False
+        async with self.connections.read() as conn:
+            return await conn.fetchval(
+                """
+                SELECT EXISTS (
+                    SELECT 1 FROM events
+                    WHERE NOT processed
+                      AND (lease_expires_at IS NULL OR lease_expires_at < $1)
+                      AND ($2::bigint[] IS NULL OR event_type_id = ANY($2::bigint[]))
+                )
+                """,
+                time.time(), event_type_ids
+            )
+
+    async def listen_events(self, callback: Callable[[], None]) -> bool:
+        """
+        Call back whenever any process adds events.
+
+        Inserts into events fire NOTIFY once per statement; the callback
+        runs on the event loop and should only wake the dispatcher.
+
+        Returns:
+            Whether notifications are supported (always True)
+        """
+        self._event_callbacks.append(callback)
+        if self._listener is None:
+            self._listener = await asyncpg.connect(self.connections.dsn)
+            await self._listener.add_listener(EVENTS_CHANNEL, self._on_events_notify)
+        return True
+
+    def _on_events_notify(self, connection, pid, channel, payload):
+        for callback in self._event_callbacks:
+            callback()
+
+    async def claim_events(self, owner: str, limit: int = 100,
+                           lease_seconds: float = 300, after_id: int = 0,
+                           event_type_ids: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Atomically claim pending events for a worker.
+
+        Rows being claimed by a concurrent transaction are skipped rather
+        than waited for (FOR UPDATE SKIP LOCKED), so workers on several
+        nodes page through the backlog side by side.
+
+        Args:
+            owner: Worker identifier
+            limit: Maximum number of events to claim
+            lease_seconds: How long the claim is valid without renewal
+            after_id: Only claim events with a greater id
+            event_type_ids: Only claim events of these types (None for all)
+
+        Returns:
+            Claimed events, most urgent lane first, then by id
+        """
+        if event_type_ids is not None and not event_type_ids:
+            return []
+        now = time.time()
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                WITH claimed AS (
+                    UPDATE events
+                    SET claimed_by = $1, lease_expires_at = $2, attempts = attempts + 1
+                    WHERE id IN (
+                        SELECT id FROM events
+                        WHERE NOT processed
+                          AND id > $3
+                          AND (lease_expires_at IS NULL OR lease_expires_at < $4)
+                          AND ($6::bigint[] IS NULL OR event_type_id = ANY($6::bigint[]))
+                        ORDER BY priority, id
+                        LIMIT $5
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING *
+                )
+                SELECT c.*, et.name as event_name, et.template as event_template
+                FROM claimed c
+                JOIN event_types et ON c.event_type_id = et.id
+                ORDER BY c.priority, c.id
+                """,
+                owner, now + lease_seconds, after_id, now, limit, event_type_ids
+            )
+        return [dict(row) for row in rows]
+
+    async def claim_events_by_id(self, owner: str, event_ids: List[int],
+                                 lease_seconds: float = 300,
+                                 event_type_ids: Optional[List[int]] = None) -> List[Dict]:
+        """
+        Atomically claim specific events for a worker.
+
+        Events that are already processed, leased by another worker or
+        being claimed right now are skipped, as are events of other types
+        than event_type_ids (if given).
+
+        Returns:
+            Claimed events, most urgent lane first, then by id
+        """
+        if not event_ids or (event_type_ids is not None and not event_type_ids):
+            return []
+        now = time.time()
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                WITH claimed AS (
+                    UPDATE events
+                    SET claimed_by = $1, lease_expires_at = $2, attempts = attempts + 1
+                    WHERE id IN (
+                        SELECT id FROM events
+                        WHERE id = ANY($3::bigint[])
+                          AND NOT processed
+                          AND (lease_expires_at IS NULL OR lease_expires_at < $4)
+                          AND ($5::bigint[] IS NULL OR event_type_id = ANY($5::bigint[]))
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING *
+                )
+                SELECT c.*, et.name as event_name, et.template as event_template
+                FROM claimed c
+                JOIN event_types et ON c.event_type_id = et.id
+                ORDER BY c.priority, c.id
+                """,
+                owner, now + lease_seconds, event_ids, now, event_type_ids
+            )
+        return [dict(row) for row in rows]
+
+    async def extend_leases(self, event_ids: List[int], owner: str,
+                            lease_seconds: float = 300) -> List[int]:
+        """
+        Renew leases of events still being processed by owner.
+
+        Returns:
+            IDs of the events owner still holds
+        """
+        if not event_ids:
+            return []
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE events SET lease_expires_at = $1
+                WHERE claimed_by = $2 AND NOT processed AND id = ANY($3::bigint[])
+                RETURNING id
+                """,
+                time.time() + lease_seconds, owner, event_ids
+            )
+        return [row['id'] for row in rows]
+
+    async def release_events(self, event_ids: List[int], owner: str):
+        """Give up leases of unstarted events so other workers can claim them right away."""
+        if not event_ids:
+            return
+        async with self.connections.write() as conn:
+            await conn.execute(
+                """
+                UPDATE events
+                SET claimed_by = NULL, lease_expires_at = NULL, attempts = attempts - 1
+                WHERE claimed_by = $1 AND NOT processed AND id = ANY($2::bigint[])
+                """,
+                owner, event_ids
+            )
+
+    # Fan-out checkpoint methods
+    async def get_fanout_checkpoint(self, event_id: int) -> int:
+        """Get last subscription ID a streamed fan-out handled (0 if none)."""
+        async with self.connections.read() as conn:
+            return await conn.fetchval(
+                "SELECT last_subscription_id FROM fanout_checkpoints WHERE event_id = $1",
+                event_id
+            ) or 0
+
+    async def save_fanout_checkpoint(self, event_id: int, subscription_id: int):
+        """Record that a streamed fan-out got through subscription_id."""
+        async with self.connections.write() as conn:
+            await conn.execute(
+                f"""
+                INSERT INTO fanout_checkpoints (event_id, last_subscription_id)
+                VALUES ($1, $2)
+                ON CONFLICT (event_id) DO UPDATE SET
+                    last_subscription_id = excluded.last_subscription_id,
+                    updated_at = {UTC_NOW}
+                """,
+                event_id, subscription_id
+            )
+
+    async def prune_fanout_checkpoints(self, keep_days: int, batch_size: int = 500) -> int:
+        """Delete one batch of checkpoints of processed events (see Database)."""
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                DELETE FROM fanout_checkpoints
+                WHERE event_id IN (
+                    SELECT c.event_id FROM fanout_checkpoints c
+                    JOIN events e ON e.id = c.event_id
+                    WHERE e.processed
+                    LIMIT $1
+                )
+                RETURNING event_id
+                """,
+                batch_size
+            )
+        return len(rows)
+
+    # Worker membership methods
+    async def heartbeat_worker(self, worker_id: str, ttl: float = 30) -> List[str]:
+        """Record that a worker is alive and get all live workers, sorted."""
+        now = time.time()
+        async with self.connections.write() as conn:
+            await conn.execute(
+                """
+                INSERT INTO notification_workers (worker_id, heartbeat_at)
+                VALUES ($1, $2)
+                ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+                """,
+                worker_id, now
+            )
+            await conn.execute(
+                "DELETE FROM notification_workers WHERE heartbeat_at < $1",
+                now - ttl
+            )
+            rows = await conn.fetch(
+                "SELECT worker_id FROM notification_workers ORDER BY worker_id"
+            )
+        return [row['worker_id'] for row in rows]
+
+    async def remove_worker(self, worker_id: str):
+        """Remove worker from the live set (on clean shutdown)."""
+        async with self.connections.write() as conn:
+            await conn.execute(
+                "DELETE FROM notification_workers WHERE worker_id = $1",
+                worker_id
+            )
+
+    # Retention methods
+    async def rollup_history(self, keep_days: int, batch_size: int = 500) -> int:
+        """
+        Roll one batch of old history rows up into daily counts.
+
+        Returns:
+            Number of rows rolled up (0 when nothing is left)
+        """
+        async with self.connections.write() as conn:
+            return await conn.fetchval(
+                f"""
+                WITH old AS (
+                    DELETE FROM notification_history
+                    WHERE id IN (
+                        SELECT id FROM notification_history
+                        WHERE sent_at < {UTC_NOW} - make_interval(days => $1)
+                        ORDER BY sent_at
+                        LIMIT $2
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING user_id, event_id, status, sent_at
+                ), rolled_up AS (
+                    INSERT INTO notification_daily_stats
+                    (day, user_id, event_type_id, status, count)
+                    SELECT old.sent_at::date, old.user_id, COALESCE(e.event_type_id, 0),
+                           COALESCE(old.status, 'sent'), COUNT(*)
+                    FROM old
+                    LEFT JOIN events e ON e.id = old.event_id
+                    GROUP BY 1, 2, 3, 4
+                    ON CONFLICT (day, user_id, event_type_id, status)
+                    DO UPDATE SET count = notification_daily_stats.count + excluded.count
+                )
+                SELECT COUNT(*) FROM old
+                """,
+                keep_days, batch_size
+            )
+
+    async def prune_dead_retries(self, keep_days: int, batch_size: int = 500) -> int:
+        """
+        Delete one batch of dead-lettered retries older than keep_days.
+
+        Returns:
+            Number of rows deleted
+        """
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                f"""
+                DELETE FROM notification_retries
+                WHERE id IN (
+                    SELECT id FROM notification_retries
+                    WHERE status = 'dead' AND created_at < {UTC_NOW} - make_interval(days => $1)
+                    LIMIT $2
+                )
+                RETURNING id
+                """,
+                keep_days, batch_size
+            )
+        return len(rows)
+
+    async def incremental_vacuum(self, pages: int = 1000) -> Optional[int]:
+        """
+        Nothing to do: autovacuum reclaims deleted rows in PostgreSQL.
+
+        Returns:
+            0 (no free pages left to return)
+        """
+        return 0
+
+    async def enable_incremental_vacuum(self):
+        """Nothing to do: autovacuum is on by default in PostgreSQL."""
+
+    async def get_notification_stats(self, user_id: int, days: int = 30) -> List[Dict]:
+        """Get per-day notification counts of a user by event type and status."""
+        await self.flush()
+        async with self.connections.read() as conn:
+            rows = await conn.fetch(
+                f"""
+                SELECT day::text AS day, event_type_id, status, SUM(count) AS count
+                FROM (
+                    SELECT day, event_type_id, status, count
+                    FROM notification_daily_stats
+                    WHERE user_id = $1 AND day >= {UTC_NOW}::date - $2::int
+                    UNION ALL
+                    SELECT nh.sent_at::date, e.event_type_id, nh.status, 1
+                    FROM notification_history nh
+                    JOIN events e ON e.id = nh.event_id
+                    WHERE nh.user_id = $1 AND nh.sent_at >= {UTC_NOW}::date - $2::int
+                ) stats
+                GROUP BY stats.day, event_type_id, status
+                ORDER BY stats.day DESC
+                """,
+                user_id, days
+            )
+        return [dict(row) for row in rows]
+
+    # Digest methods
+    async def add_digest_items(self, items: List[Tuple[int, int, str]]) -> List[int]:
+        """
+        Persist notifications held back for digests.
+
+        Args:
+            items: (user_id, event_id, message) tuples
+
+        Returns:
+            Item IDs in input order
+        """
+        if not items:
+            return []
+        user_ids, event_ids, messages = zip(*items)
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                INSERT INTO digest_pending (user_id, event_id, message)
+                SELECT user_id, event_id, message
+                FROM unnest($1::bigint[], $2::bigint[], $3::text[])
+                     WITH ORDINALITY AS d(user_id, event_id, message, n)
+                ORDER BY n
+                RETURNING id
+                """,
+                user_ids, event_ids, messages
+            )
+        # Ids come from a sequence in insertion order
+        return sorted(row['id'] for row in rows)
+
+    async def get_digest_items(self) -> List[Dict]:
+        """Get all pending digest items of active users, ordered by id."""
+        async with self.connections.read() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT dp.id, dp.user_id, dp.event_id, dp.message, u.telegram_id
+                FROM digest_pending dp
+                JOIN users u ON u.user_id = dp.user_id
+                WHERE u.is_active
+                ORDER BY dp.id
+                """
+            )
+        return [dict(row) for row in rows]
+
+    async def claim_digest_items(self, item_ids: List[int]) -> List[int]:
+        """
+        Atomically take pending digest items for sending.
+
+        Items already taken by another worker are skipped.
+
+        Returns:
+            IDs of the items taken
+        """
+        if not item_ids:
+            return []
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                "DELETE FROM digest_pending WHERE id = ANY($1::bigint[]) RETURNING id",
+                item_ids
+            )
+        return [row['id'] for row in rows]
+
+    # Deferred notification methods
+    async def add_deferred_notifications(self, items: List[Tuple[int, int, int, str, float]]
+                                         ) -> List[int]:
+        """Persist notifications held until quiet hours end (see Database)."""
+        if not items:
+            return []
+        user_ids, event_ids, chat_ids, messages, release_ats = zip(*items)
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                INSERT INTO deferred_notifications (user_id, event_id, chat_id, message, release_at)
+                SELECT user_id, event_id, chat_id, message, release_at
+                FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::text[],
+                            $5::double precision[])
+                     WITH ORDINALITY AS d(user_id, event_id, chat_id, message, release_at, n)
+                ORDER BY n
+                RETURNING id
+                """,
+                user_ids, event_ids, chat_ids, messages, release_ats
+            )
+        # Ids come from a sequence in insertion order
+        return sorted(row['id'] for row in rows)
+
+    async def get_deferred_schedule(self) -> List[Tuple[int, float]]:
+        """Get (item ID, release time) of all deferred notifications."""
+        async with self.connections.read() as conn:
+            rows = await conn.fetch("SELECT id, release_at FROM deferred_notifications")
+        return [(row['id'], row['release_at']) for row in rows]
+
+    async def claim_deferred_notifications(self, item_ids: List[int]) -> List[Dict]:
+        """Atomically take deferred notifications for sending (see Database)."""
+        if not item_ids:
+            return []
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                "DELETE FROM deferred_notifications WHERE id = ANY($1::bigint[]) RETURNING *",
+                item_ids
+            )
+        return [dict(row) for row in rows]
+
+    async def claim_due_deferred_notifications(self, limit: int = 500) -> List[Dict]:
+        """Atomically take deferred notifications that are due (see Database)."""
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                DELETE FROM deferred_notifications
+                WHERE id IN (
+                    SELECT id FROM deferred_notifications
+                    WHERE release_at <= $1
+                    ORDER BY release_at
+                    LIMIT $2
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING *
+                """,
+                time.time(), limit
+            )
+        return sorted((dict(row) for row in rows), key=lambda row: row['release_at'])
+
+    # Retry queue methods
+    async def add_retry(self, user_id: int, event_id: int, chat_id: int,
+                        message: str, next_attempt_at: float, error: str = None) -> int:
+        """Queue failed notification for another attempt."""
+        async with self.connections.write() as conn:
+            return await conn.fetchval(
+                """
+                INSERT INTO notification_retries
+                (user_id, event_id, chat_id, message, next_attempt_at, last_error)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                RETURNING id
+                """,
+                user_id, event_id, chat_id, message, next_attempt_at, error
+            )
+
+    async def claim_retries(self, limit: int = 200, lease_seconds: float = 300) -> List[Dict]:
+        """
+        Atomically take due retries, earliest first.
+
+        Claimed retries are pushed lease_seconds into the future; rows being
+        claimed by another worker right now are skipped.
+
+        Returns:
+            Claimed retry rows
+        """
+        now = time.time()
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                UPDATE notification_retries
+                SET next_attempt_at = $1
+                WHERE id IN (
+                    SELECT id FROM notification_retries
+                    WHERE status = 'pending' AND next_attempt_at <= $2
+                    ORDER BY next_attempt_at
+                    LIMIT $3
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING *
+                """,
+                now + lease_seconds, now, limit
+            )
+        return [dict(row) for row in rows]
+
+    async def complete_retry(self, retry_id: int):
+        """Remove retry after a successful send."""
+        async with self.connections.write() as conn:
+            await conn.execute("DELETE FROM notification_retries WHERE id = $1", retry_id)
+
+    async def reschedule_retry(self, retry_id: int, attempts: int,
+                               next_attempt_at: Optional[float], error: str = None):
+        """Record another failed attempt (next_attempt_at None dead-letters it)."""
+        async with self.connections.write() as conn:
+            await conn.execute(
+                """
+                UPDATE notification_retries
+                SET attempts = $1, last_error = $2,
+                    status = CASE WHEN $3::float8 IS NULL THEN 'dead' ELSE 'pending' END,
+                    next_attempt_at = COALESCE($3::float8, next_attempt_at)
+                WHERE id = $4
+                """,
+                attempts, error, next_attempt_at, retry_id
+            )
+
+    async def get_retry_counts(self) -> Dict[str, int]:
+        """Get number of retries by status (pending, dead)."""
+        async with self.connections.read() as conn:
+            rows = await conn.fetch(
+                "SELECT status, COUNT(*) AS count FROM notification_retries GROUP BY status"
+            )
+        return {row['status']: row['count'] for row in rows}
+
+    # Notification history methods
+    async def add_notification(self, user_id: int, event_id: int,
+                               message: str, status: str = 'sent',
+                               error_message: str = None) -> int:
+        """
+        Add notification to history right away.
+
+        Returns:
+            History row ID (of the existing row if the pair is already logged;
+            a reserved row gets this outcome)
+        """
+        async with self.connections.write() as conn:
+            row_id = await conn.fetchval(
+                """
+                INSERT INTO notification_history
+                (user_id, event_id, message, status, error_message)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (event_id, user_id) DO UPDATE SET
+                    message = excluded.message,
+                    status = excluded.status,
+                    error_message = excluded.error_message,
+                    sent_at = excluded.sent_at
+                WHERE notification_history.status = 'pending'
+                RETURNING id
+                """,
+                user_id, event_id, message, status, error_message
+            )
+            if row_id is None:
+                row_id = await conn.fetchval(
+                    "SELECT id FROM notification_history WHERE event_id = $1 AND user_id = $2",
+                    event_id, user_id
+                )
+        return row_id
+
+    async def get_notified_users(self, event_id: int, user_ids: List[int]) -> set:
+        """Get users an event was already delivered to or queued for (see Database)."""
+        await self.flush()
+        async with self.connections.read() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT user_id FROM notification_history
+                WHERE event_id = $1 AND user_id = ANY($2::bigint[])
+                UNION
+                SELECT user_id FROM digest_pending
+                WHERE event_id = $1 AND user_id = ANY($2::bigint[])
+                UNION
+                SELECT user_id FROM deferred_notifications
+                WHERE event_id = $1 AND user_id = ANY($2::bigint[])
+                UNION
+                SELECT user_id FROM notification_retries
+                WHERE event_id = $1 AND user_id = ANY($2::bigint[])
+                """,
+                event_id, user_ids
+            )
+        return {row['user_id'] for row in rows}
+
+    async def reserve_notifications(self, event_id: int, user_ids: List[int]) -> set:
+        """Reserve the history rows of an event's recipients before sending (see Database)."""
+        async with self.connections.write() as conn:
+            rows = await conn.fetch(
+                """
+                INSERT INTO notification_history (user_id, event_id, message, status)
+                SELECT user_id, $1, '', 'pending' FROM unnest($2::bigint[]) AS user_id
+                ON CONFLICT (event_id, user_id) DO NOTHING
+                RETURNING user_id
+                """,
+                event_id, user_ids
+            )
+        return {row['user_id'] for row in rows}
+
+    async def get_user_notifications(self, user_id: int, limit: int = 50) -> List[Dict]:
+        """Get user notification history."""
+        await self.flush()
+        async with self.connections.read() as conn:
+            rows = await conn.fetch(
+                """
+                SELECT nh.*, e.data as event_data, et.name as event_name
+                FROM notification_history nh
+                JOIN events e ON nh.event_id = e.id
+                JOIN event_types et ON e.event_type_id = et.id
+                WHERE nh.user_id = $1
+                ORDER BY nh.sent_at DESC
+                LIMIT $2
+                """,
+                user_id, limit
+            )
+        return [dict(row) for row in rows]
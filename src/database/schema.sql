@@ -6,6 +6,9 @@ CREATE TABLE IF NOT EXISTS users (
     first_name TEXT,
     last_name TEXT,
     is_active BOOLEAN DEFAULT 1,
+    timezone TEXT, -- часовой пояс IANA, например Europe/Moscow (NULL - UTC)
+    quiet_start INTEGER, -- начало тихих часов, минут от местной полуночи
+    quiet_end INTEGER, -- конец тихих часов (NULL - без тихих часов)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -14,6 +17,9 @@ CREATE TABLE IF NOT EXISTS event_types (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     name TEXT UNIQUE NOT NULL,
     description TEXT,
+    template TEXT, -- шаблон сообщения, см. services/templates.py
+    priority INTEGER NOT NULL DEFAULT 1, -- полоса: 0 urgent, 1 normal, 2 bulk (services/lanes.py)
+    ttl_seconds REAL, -- через сколько секунд событие устаревает (NULL - никогда)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -24,6 +30,7 @@ CREATE TABLE IF NOT EXISTS user_subscriptions (
     event_type_id INTEGER NOT NULL,
     is_active BOOLEAN DEFAULT 1,
     conditions TEXT, -- JSON с условиями
+    delivery_mode TEXT DEFAULT 'instant', -- instant, digest
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users(user_id),
     FOREIGN KEY (event_type_id) REFERENCES event_types(id),
@@ -37,6 +44,12 @@ CREATE TABLE IF NOT EXISTS events (
     data TEXT NOT NULL, -- JSON с данными события
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     processed BOOLEAN DEFAULT 0,
+    claimed_by TEXT, -- воркер, взявший событие в обработку
+    lease_expires_at REAL, -- unix time окончания аренды
+    priority INTEGER NOT NULL DEFAULT 1, -- полоса типа события на момент создания
+    expires_at REAL, -- unix time, после которого событие не рассылается
+    idempotency_key TEXT, -- ключ продюсера, повтор с тем же ключом не создаёт событие
+    attempts INTEGER NOT NULL DEFAULT 0, -- сколько раз событие брали в обработку
     FOREIGN KEY (event_type_id) REFERENCES event_types(id)
 );
 
@@ -53,9 +66,126 @@ CREATE TABLE IF NOT EXISTS notification_history (
     FOREIGN KEY (event_id) REFERENCES events(id)
 );
 
+-- Дубликаты истории, записанные версиями до уникального индекса (событие, пользователь):
+-- переносятся сюда один раз при его создании, в истории остаётся самая ранняя запись
+CREATE TABLE IF NOT EXISTS notification_history_duplicates (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    event_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    sent_at TIMESTAMP,
+    status TEXT,
+    error_message TEXT,
+    moved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Дневные счётчики уведомлений, свёрнутые из старой истории
+CREATE TABLE IF NOT EXISTS notification_daily_stats (
+    day TEXT NOT NULL, -- YYYY-MM-DD (UTC)
+    user_id INTEGER NOT NULL,
+    event_type_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, user_id, event_type_id, status)
+) WITHOUT ROWID;
+
+-- Отложенные уведомления подписок в режиме дайджеста
+CREATE TABLE IF NOT EXISTS digest_pending (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    event_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id),
+    FOREIGN KEY (event_id) REFERENCES events(id)
+);
+
+-- Очередь повторных отправок неудавшихся уведомлений
+CREATE TABLE IF NOT EXISTS notification_retries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    event_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1, -- число неудачных отправок
+    next_attempt_at REAL NOT NULL, -- unix time следующей попытки
+    status TEXT DEFAULT 'pending', -- pending, dead
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id),
+    FOREIGN KEY (event_id) REFERENCES events(id)
+);
+
+-- Уведомления, отложенные до конца тихих часов пользователя
+-- (расписание выпуска держится в памяти, см. services/quiet_hours.py)
+CREATE TABLE IF NOT EXISTS deferred_notifications (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    event_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    message TEXT NOT NULL,
+    release_at REAL NOT NULL, -- unix time окончания тихих часов
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users(user_id),
+    FOREIGN KEY (event_id) REFERENCES events(id)
+);
+
+-- Прогресс потоковой рассылки события по большой аудитории: подписки с id
+-- не больше last_subscription_id уже обработаны (см. NotificationService._stream_fan_out)
+CREATE TABLE IF NOT EXISTS fanout_checkpoints (
+    event_id INTEGER PRIMARY KEY,
+    last_subscription_id INTEGER NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Живые процессы-воркеры, между которыми делятся типы событий
+CREATE TABLE IF NOT EXISTS notification_workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat_at REAL NOT NULL -- unix time последнего heartbeat
+);
+
 -- Индексы для оптимизации
 CREATE INDEX IF NOT EXISTS idx_events_processed ON events(processed);
 CREATE INDEX IF NOT EXISTS idx_events_type ON events(event_type_id);
+CREATE INDEX IF NOT EXISTS idx_events_pending ON events(id) WHERE processed = 0;
 CREATE INDEX IF NOT EXISTS idx_subscriptions_user ON user_subscriptions(user_id);
 CREATE INDEX IF NOT EXISTS idx_subscriptions_active ON user_subscriptions(is_active);
 CREATE INDEX IF NOT EXISTS idx_notification_history_user ON notification_history(user_id);
+CREATE INDEX IF NOT EXISTS idx_notification_history_user_sent ON notification_history(user_id, sent_at);
+CREATE INDEX IF NOT EXISTS idx_notification_history_sent ON notification_history(sent_at);
+CREATE INDEX IF NOT EXISTS idx_daily_stats_user ON notification_daily_stats(user_id, day);
+CREATE INDEX IF NOT EXISTS idx_retries_due ON notification_retries(next_attempt_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_deferred_release ON deferred_notifications(release_at);
+CREATE INDEX IF NOT EXISTS idx_deferred_user ON deferred_notifications(user_id);
+
+-- Счётчики версий для инвалидации in-memory кэшей
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('subscriptions', 0);
+
+CREATE TRIGGER IF NOT EXISTS trg_subscriptions_insert
+AFTER INSERT ON user_subscriptions
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'subscriptions';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_subscriptions_update
+AFTER UPDATE ON user_subscriptions
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'subscriptions';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_users_active_update
+AFTER UPDATE OF is_active ON users
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'subscriptions';
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_users_profile_update
+AFTER UPDATE OF username, first_name, last_name ON users
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'subscriptions';
+END;
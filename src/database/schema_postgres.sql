@@ -0,0 +1,214 @@
+-- Схема PostgreSQL (см. postgres.py); таблицы и столбцы те же, что в schema.sql.
+-- Время хранится в UTC без часового пояса, как CURRENT_TIMESTAMP в SQLite.
+
+-- Таблица пользователей
+CREATE TABLE IF NOT EXISTS users (
+    user_id BIGSERIAL PRIMARY KEY,
+    telegram_id BIGINT UNIQUE NOT NULL,
+    username TEXT,
+    first_name TEXT,
+    last_name TEXT,
+    is_active BOOLEAN NOT NULL DEFAULT TRUE,
+    timezone TEXT, -- часовой пояс IANA, например Europe/Moscow (NULL - UTC)
+    quiet_start INTEGER, -- начало тихих часов, минут от местной полуночи
+    quiet_end INTEGER, -- конец тихих часов (NULL - без тихих часов)
+    created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+-- Таблица типов событий
+CREATE TABLE IF NOT EXISTS event_types (
+    id BIGSERIAL PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    description TEXT,
+    template TEXT, -- шаблон сообщения, см. services/templates.py
+    priority SMALLINT NOT NULL DEFAULT 1, -- полоса: 0 urgent, 1 normal, 2 bulk (services/lanes.py)
+    ttl_seconds DOUBLE PRECISION, -- через сколько секунд событие устаревает (NULL - никогда)
+    created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+-- Таблица подписок пользователей на события
+CREATE TABLE IF NOT EXISTS user_subscriptions (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(user_id),
+    event_type_id BIGINT NOT NULL REFERENCES event_types(id),
+    is_active BOOLEAN NOT NULL DEFAULT TRUE,
+    conditions TEXT, -- JSON с условиями
+    delivery_mode TEXT DEFAULT 'instant', -- instant, digest
+    created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+    UNIQUE(user_id, event_type_id)
+);
+
+-- Таблица событий
+CREATE TABLE IF NOT EXISTS events (
+    id BIGSERIAL PRIMARY KEY,
+    event_type_id BIGINT NOT NULL REFERENCES event_types(id),
+    data TEXT NOT NULL, -- JSON с данными события
+    created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+    processed BOOLEAN NOT NULL DEFAULT FALSE,
+    claimed_by TEXT, -- воркер, взявший событие в обработку
+    lease_expires_at DOUBLE PRECISION, -- unix time окончания аренды
+    priority SMALLINT NOT NULL DEFAULT 1, -- полоса типа события на момент создания
+    expires_at DOUBLE PRECISION, -- unix time, после которого событие не рассылается
+    idempotency_key TEXT, -- ключ продюсера, повтор с тем же ключом не создаёт событие
+    attempts INTEGER NOT NULL DEFAULT 0 -- сколько раз событие брали в обработку
+);
+
+-- Столбцы, добавленные после первой версии схемы
+ALTER TABLE event_types ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 1;
+ALTER TABLE event_types ADD COLUMN IF NOT EXISTS ttl_seconds DOUBLE PRECISION;
+ALTER TABLE events ADD COLUMN IF NOT EXISTS priority SMALLINT NOT NULL DEFAULT 1;
+ALTER TABLE events ADD COLUMN IF NOT EXISTS expires_at DOUBLE PRECISION;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS timezone TEXT;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS quiet_start INTEGER;
+ALTER TABLE users ADD COLUMN IF NOT EXISTS quiet_end INTEGER;
+ALTER TABLE events ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+ALTER TABLE events ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+
+-- Таблица истории уведомлений (без внешних ключей: пишется пачками одним запросом)
+CREATE TABLE IF NOT EXISTS notification_history (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    event_id BIGINT NOT NULL,
+    message TEXT NOT NULL,
+    sent_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc'),
+    status TEXT DEFAULT 'sent', -- sent, failed, pending
+    error_message TEXT
+);
+
+-- Дубликаты истории, записанные версиями до уникального индекса (событие, пользователь):
+-- переносятся сюда один раз при его создании, в истории остаётся самая ранняя запись
+CREATE TABLE IF NOT EXISTS notification_history_duplicates (
+    id BIGINT PRIMARY KEY,
+    user_id BIGINT NOT NULL,
+    event_id BIGINT NOT NULL,
+    message TEXT NOT NULL,
+    sent_at TIMESTAMP,
+    status TEXT,
+    error_message TEXT,
+    moved_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+-- Дневные счётчики уведомлений, свёрнутые из старой истории
+CREATE TABLE IF NOT EXISTS notification_daily_stats (
+    day DATE NOT NULL, -- UTC
+    user_id BIGINT NOT NULL,
+    event_type_id BIGINT NOT NULL,
+    status TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, user_id, event_type_id, status)
+);
+
+-- Отложенные уведомления подписок в режиме дайджеста
+CREATE TABLE IF NOT EXISTS digest_pending (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(user_id),
+    event_id BIGINT NOT NULL REFERENCES events(id),
+    message TEXT NOT NULL,
+    created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+-- Очередь повторных отправок неудавшихся уведомлений
+CREATE TABLE IF NOT EXISTS notification_retries (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(user_id),
+    event_id BIGINT NOT NULL REFERENCES events(id),
+    chat_id BIGINT NOT NULL,
+    message TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 1, -- число неудачных отправок
+    next_attempt_at DOUBLE PRECISION NOT NULL, -- unix time следующей попытки
+    status TEXT DEFAULT 'pending', -- pending, dead
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+-- Уведомления, отложенные до конца тихих часов пользователя
+-- (расписание выпуска держится в памяти, см. services/quiet_hours.py)
+CREATE TABLE IF NOT EXISTS deferred_notifications (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users(user_id),
+    event_id BIGINT NOT NULL REFERENCES events(id),
+    chat_id BIGINT NOT NULL,
+    message TEXT NOT NULL,
+    release_at DOUBLE PRECISION NOT NULL, -- unix time окончания тихих часов
+    created_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+-- Прогресс потоковой рассылки события по большой аудитории: подписки с id
+-- не больше last_subscription_id уже обработаны (см. NotificationService._stream_fan_out)
+CREATE TABLE IF NOT EXISTS fanout_checkpoints (
+    event_id BIGINT PRIMARY KEY,
+    last_subscription_id BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT (now() AT TIME ZONE 'utc')
+);
+
+-- Живые процессы-воркеры, между которыми делятся типы событий
+CREATE TABLE IF NOT EXISTS notification_workers (
+    worker_id TEXT PRIMARY KEY,
+    heartbeat_at DOUBLE PRECISION NOT NULL -- unix time последнего heartbeat
+);
+
+-- Индексы для оптимизации
+CREATE INDEX IF NOT EXISTS idx_events_type ON events(event_type_id);
+CREATE INDEX IF NOT EXISTS idx_events_pending ON events(id) WHERE NOT processed;
+CREATE INDEX IF NOT EXISTS idx_events_lane ON events(priority, id) WHERE NOT processed;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_events_idempotency ON events(idempotency_key)
+WHERE idempotency_key IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_subscriptions_type ON user_subscriptions(event_type_id) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_notification_history_user_sent ON notification_history(user_id, sent_at);
+CREATE INDEX IF NOT EXISTS idx_notification_history_sent ON notification_history(sent_at);
+-- Уникальный индекс (событие, пользователь) создаётся в PostgresDatabase._init_schema,
+-- после переноса дубликатов в notification_history_duplicates
+CREATE INDEX IF NOT EXISTS idx_daily_stats_user ON notification_daily_stats(user_id, day);
+CREATE INDEX IF NOT EXISTS idx_digest_pending_user ON digest_pending(user_id);
+CREATE INDEX IF NOT EXISTS idx_retries_due ON notification_retries(next_attempt_at) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_retries_user ON notification_retries(user_id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS idx_deferred_release ON deferred_notifications(release_at);
+CREATE INDEX IF NOT EXISTS idx_deferred_user ON deferred_notifications(user_id);
+
+-- Счётчики версий для инвалидации in-memory кэшей
+CREATE TABLE IF NOT EXISTS cache_versions (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO cache_versions (name, version) VALUES ('subscriptions', 0)
+ON CONFLICT (name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_subscriptions_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE cache_versions SET version = version + 1 WHERE name = 'subscriptions';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_subscriptions_insert
+AFTER INSERT ON user_subscriptions
+FOR EACH ROW EXECUTE FUNCTION bump_subscriptions_version();
+
+CREATE OR REPLACE TRIGGER trg_subscriptions_update
+AFTER UPDATE ON user_subscriptions
+FOR EACH ROW EXECUTE FUNCTION bump_subscriptions_version();
+
+CREATE OR REPLACE TRIGGER trg_users_active_update
+AFTER UPDATE OF is_active ON users
+FOR EACH ROW EXECUTE FUNCTION bump_subscriptions_version();
+
+CREATE OR REPLACE TRIGGER trg_users_profile_update
+AFTER UPDATE OF username, first_name, last_name ON users
+FOR EACH ROW EXECUTE FUNCTION bump_subscriptions_version();
+
+CREATE OR REPLACE TRIGGER trg_users_quiet_hours_update
+AFTER UPDATE OF timezone, quiet_start, quiet_end ON users
+FOR EACH ROW EXECUTE FUNCTION bump_subscriptions_version();
+
+-- Уведомление воркеров о новых событиях (LISTEN notification_events), один раз на оператор
+CREATE OR REPLACE FUNCTION notify_new_events() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('notification_events', '');
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE TRIGGER trg_events_notify
+AFTER INSERT ON events
+FOR EACH STATEMENT EXECUTE FUNCTION notify_new_events();
@@ -1,6 +1,40 @@
 """Condition checker for notifications."""
 import json
-from typing import Dict, Any, Optional
+import operator as op
+from typing import Dict, Any, Optional, Callable, List, Union
+
+# Compiled condition program: takes event data, returns match result
+ConditionProgram = Callable[[Dict[str, Any]], bool]
+
+_NUMERIC_OPERATORS = {
+    ">": op.gt,
+    ">=": op.ge,
+    "<": op.lt,
+    "<=": op.le,
+}
+
+
+def _always_true(data: Dict[str, Any]) -> bool:
+    return True
+
+
+def _always_false(actual: Any) -> bool:
+    return False
+
+
+class CompiledCondition:
+    """Condition compiled once into a callable program."""
+
+    __slots__ = ("source", "tree", "evaluate")
+
+    def __init__(self, source: Any, tree: Optional[Dict[str, Any]],
+                 evaluate: ConditionProgram):
+        self.source = source
+        self.tree = tree
+        self.evaluate = evaluate
+
+    def __call__(self, data: Dict[str, Any]) -> bool:
+        return self.evaluate(data)
 
 
 class ConditionChecker:
@@ -28,101 +62,222 @@ class ConditionChecker:
             ]
         }
         """
+        return ConditionChecker.compile(conditions).evaluate(event_data)
+
+    @staticmethod
+    def compile(conditions: Union[str, Dict[str, Any], None]) -> CompiledCondition:
+        """
+        Compile conditions into a reusable program.
+
+        JSON is parsed once, field paths are split into accessors and
+        numeric operands are coerced up front, so evaluation only walks
+        prebuilt closures.
+
+        Args:
+            conditions: JSON string, parsed dict or None
+
+        Returns:
+            Compiled condition
+        """
         if not conditions:
-            return True
+            return CompiledCondition(conditions, None, _always_true)
 
         try:
             condition_dict = json.loads(conditions) if isinstance(conditions, str) else conditions
         except (json.JSONDecodeError, TypeError):
-            return True
+            return CompiledCondition(conditions, None, _always_true)
+
+        if not isinstance(condition_dict, dict):
+            return CompiledCondition(conditions, None, _always_true)
 
-        return ConditionChecker._evaluate_condition(event_data, condition_dict)
+        return CompiledCondition(
+            conditions,
+            condition_dict,
+            ConditionChecker._compile_condition(condition_dict)
+        )
 
     @staticmethod
-    def _evaluate_condition(data: Dict[str, Any], condition: Dict[str, Any]) -> bool:
-        """Recursively evaluate condition."""
+    def _compile_condition(condition: Dict[str, Any]) -> ConditionProgram:
+        """Recursively compile condition group into a short-circuiting program."""
         operator = condition.get("operator", "and")
         rules = condition.get("rules", [])
 
-        if not rules:
-            return True
+        if not rules or operator not in ("and", "or"):
+            return _always_true
 
-        results = []
+        programs: List[ConditionProgram] = []
         for rule in rules:
             # Nested condition
             if "rules" in rule:
-                results.append(ConditionChecker._evaluate_condition(data, rule))
+                programs.append(ConditionChecker._compile_condition(rule))
             # Simple rule
             else:
-                results.append(ConditionChecker._evaluate_rule(data, rule))
+                programs.append(ConditionChecker._compile_rule(rule))
 
-        # Combine results based on operator
+        if len(programs) == 1:
+            return programs[0]
+
+        programs = tuple(programs)
         if operator == "and":
-            return all(results)
-        elif operator == "or":
-            return any(results)
-        else:
-            return True
+            def evaluate_and(data: Dict[str, Any]) -> bool:
+                for program in programs:
+                    if not program(data):
+                        return False
+                return True
+            return evaluate_and
+
+        def evaluate_or(data: Dict[str, Any]) -> bool:
+            for program in programs:
+                if program(data):
+                    return True
+            return False
+        return evaluate_or
 
     @staticmethod
-    def _evaluate_rule(data: Dict[str, Any], rule: Dict[str, Any]) -> bool:
-        """Evaluate single rule."""
+    def _compile_rule(rule: Dict[str, Any]) -> ConditionProgram:
+        """Compile single rule."""
         field = rule.get("field")
         operator = rule.get("operator")
         expected = rule.get("value")
 
         if not field or not operator:
-            return True
+            return _always_true
+
+        getter = ConditionChecker._compile_getter(field)
+        test = ConditionChecker._compile_test(operator, expected)
+
+        # Result when the field is missing from event data
+        if_missing = operator in ("!=", "not_in") if expected is not None else True
 
-        # Get actual value from data (support nested fields with dot notation)
-        actual = ConditionChecker._get_nested_value(data, field)
+        def evaluate_rule(data: Dict[str, Any]) -> bool:
+            actual = getter(data)
+            if actual is None:
+                return if_missing
+            try:
+                return test(actual)
+            except (ValueError, TypeError):
+                return False
 
-        # Handle None values
-        if actual is None:
-            return operator in ["!=", "not_in"] if expected is not None else True
+        return evaluate_rule
 
-        # Evaluate based on operator
+    @staticmethod
+    def _compile_test(operator: str, expected: Any) -> Callable[[Any], bool]:
+        """Build value test for an operator with pre-coerced operand."""
+        if operator == "==":
+            return lambda actual: actual == expected
+        elif operator == "!=":
+            return lambda actual: actual != expected
+        elif operator in _NUMERIC_OPERATORS:
+            compare = _NUMERIC_OPERATORS[operator]
+            try:
+                threshold = float(expected)
+            except (ValueError, TypeError):
+                return _always_false
+            return lambda actual: compare(float(actual), threshold)
+        elif operator in ("in", "not_in"):
+            members = ConditionChecker._as_member_set(expected)
+            if operator == "in":
+                if members is None:
+                    return lambda actual: actual in expected
+
+                def test_in(actual: Any) -> bool:
+                    try:
+                        return actual in members
+                    except TypeError:
+                        return actual in expected
+                return test_in
+
+            if members is None:
+                return lambda actual: actual not in expected
+
+            def test_not_in(actual: Any) -> bool:
+                try:
+                    return actual not in members
+                except TypeError:
+                    return actual not in expected
+            return test_not_in
+        elif operator == "contains":
+            return lambda actual: expected in str(actual)
+        elif operator == "starts_with":
+            prefix = str(expected)
+            return lambda actual: str(actual).startswith(prefix)
+        elif operator == "ends_with":
+            suffix = str(expected)
+            return lambda actual: str(actual).endswith(suffix)
+        else:
+            return lambda actual: True
+
+    @staticmethod
+    def _as_member_set(expected: Any) -> Optional[frozenset]:
+        """Convert list operand to a frozenset for O(1) membership, if hashable."""
+        if not isinstance(expected, (list, tuple)):
+            return None
         try:
-            if operator == "==":
-                return actual == expected
-            elif operator == "!=":
-                return actual != expected
-            elif operator == ">":
-                return float(actual) > float(expected)
-            elif operator == ">=":
-                return float(actual) >= float(expected)
-            elif operator == "<":
-                return float(actual) < float(expected)
-            elif operator == "<=":
-                return float(actual) <= float(expected)
-            elif operator == "in":
-                return actual in expected
-            elif operator == "not_in":
-                return actual not in expected
-            elif operator == "contains":
-                return expected in str(actual)
-            elif operator == "starts_with":
-                return str(actual).startswith(str(expected))
-            elif operator == "ends_with":
-                return str(actual).endswith(str(expected))
-            else:
-                return True
-        except (ValueError, TypeError):
-            return False
+            return frozenset(expected)
+        except TypeError:
+            return None
 
     @staticmethod
-    def _get_nested_value(data: Dict[str, Any], field: str) -> Any:
-        """Get value from nested dictionary using dot notation."""
-        keys = field.split('.')
-        value = data
-
-        for key in keys:
-            if isinstance(value, dict):
-                value = value.get(key)
-            else:
-                return None
+    def _compile_getter(field: str) -> Callable[[Dict[str, Any]], Any]:
+        """Build accessor for a field using dot notation."""
+        keys = tuple(field.split('.'))
+
+        if len(keys) == 1:
+            key = keys[0]
+            return lambda data: data.get(key) if isinstance(data, dict) else None
+
+        def get_nested(data: Dict[str, Any]) -> Any:
+            value = data
+            for key in keys:
+                if isinstance(value, dict):
+                    value = value.get(key)
+                else:
+                    return None
+            return value
+
+        return get_nested
+
+
+class ConditionCache:
+    """
+    Cache of compiled conditions keyed by subscription id.
+
+    Entries remember the source they were compiled from, so a subscription
+    whose conditions changed behind the cache's back is recompiled instead
+    of evaluated with a stale program.
+    """
+
+    def __init__(self):
+        self._programs: Dict[int, CompiledCondition] = {}
+
+    def get(self, subscription_id: int,
+            conditions: Union[str, Dict[str, Any], None]) -> CompiledCondition:
+        """
+        Get compiled condition for a subscription, compiling on miss.
+
+        Args:
+            subscription_id: Subscription ID
+            conditions: Conditions as stored in user_subscriptions
+
+        Returns:
+            Compiled condition
+        """
+        compiled = self._programs.get(subscription_id)
+        if compiled is None or compiled.source != conditions:
+            compiled = ConditionChecker.compile(conditions)
+            self._programs[subscription_id] = compiled
+        return compiled
+
+    def invalidate(self, subscription_id: int):
+        """Drop compiled condition for a subscription."""
+        self._programs.pop(subscription_id, None)
+
+    def clear(self):
+        """Drop all compiled conditions."""
+        self._programs.clear()
 
-        return value
+    def __len__(self) -> int:
+        return len(self._programs)
 
 
 # Example usage and tests
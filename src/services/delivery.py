@@ -0,0 +1,355 @@
+"""Rate-limited delivery pipeline between NotificationService and the Bot API."""
+import asyncio
+import logging
+import time
+from typing import Dict, Any, Optional, Callable, Awaitable, Iterable, List
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramMigrateToChat,
+    TelegramNotFound,
+    TelegramRetryAfter,
+)
+
+from . import metrics
+from .lanes import LaneQueue, priority_rank, DEFAULT_PRIORITY
+from .sharding import jump_hash
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Telegram limits: ~30 messages/s per bot, ~1 message/s per chat
+DEFAULT_GLOBAL_RATE = 30.0
+DEFAULT_CHAT_INTERVAL = 1.0
+
+# Lanes sent through the whole bot pool rather than the main bot
+DEFAULT_BROADCAST_LANES = ("bulk",)
+
+# Send error classes, see classify_error()
+ERROR_TRANSIENT = "transient"
+ERROR_UNREACHABLE = "unreachable"
+ERROR_REJECTED = "rejected"
+
+# Bad Request descriptions that mean the chat itself is gone
+_UNREACHABLE_DESCRIPTIONS = (
+    "chat not found",
+    "user not found",
+    "user is deactivated",
+    "peer_id_invalid",
+    "bot was blocked",
+    "bot was kicked",
+)
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Classify a send error.
+
+    Returns:
+        ERROR_UNREACHABLE if the chat will never accept messages (bot
+        blocked, chat not found, user deactivated), ERROR_REJECTED if
+        Telegram refused this particular message (e.g. broken markup),
+        ERROR_TRANSIENT for anything worth retrying
+    """
+    if isinstance(error, (TelegramForbiddenError, TelegramMigrateToChat)):
+        return ERROR_UNREACHABLE
+    if isinstance(error, (TelegramBadRequest, TelegramNotFound)):
+        description = str(error).lower()
+        if any(text in description for text in _UNREACHABLE_DESCRIPTIONS):
+            return ERROR_UNREACHABLE
+        return ERROR_REJECTED
+    return ERROR_TRANSIENT
+
+
+class TokenBucket:
+    """
+    Async token bucket.
+
+    Waiters are served in FIFO order. With the default burst of one token
+    sends are spaced evenly at `rate`, which keeps throughput at the limit
+    instead of bursting into it.
+    """
+
+    def __init__(self, rate: float, burst: float = 1.0):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BotSlot:
+    """Bot token of the delivery pipeline with its own send budget."""
+
+    __slots__ = ("bot", "label", "bucket", "paused_until", "sent", "rate_limited")
+
+    def __init__(self, bot: Bot, label: str, rate: float):
+        self.bot = bot
+        # Position in the pool (0 is the main bot), used as metrics label
+        self.label = label
+        self.bucket = TokenBucket(rate)
+        self.paused_until = 0.0
+        self.sent = 0
+        self.rate_limited = 0
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class DeliveryBatch:
+    """Tracks completion of the jobs submitted for one event."""
+
+    def __init__(self):
+        self.total = 0
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self._done = asyncio.Event()
+        self._done.set()
+
+    def add(self):
+        self.total += 1
+        self.pending += 1
+        self._done.clear()
+
+    def complete(self, error: Optional[Exception]):
+        if error is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+        self.pending -= 1
+        if self.pending <= 0:
+            self._done.set()
+
+    async def wait(self):
+        """Wait until every submitted job has been delivered or failed."""
+        await self._done.wait()
+
+
+class DeliveryJob:
+    """Single outgoing message."""
+
+    __slots__ = ("chat_id", "text", "user_id", "event_id", "batch", "attempts", "lane")
+
+    def __init__(self, chat_id: int, text: str, user_id: int = None,
+                 event_id: int = None, batch: DeliveryBatch = None,
+                 lane: int = priority_rank(DEFAULT_PRIORITY)):
+        self.chat_id = chat_id
+        self.text = text
+        self.user_id = user_id
+        self.event_id = event_id
+        self.batch = batch
+        self.attempts = 0
+        # Priority lane rank (see lanes.py)
+        self.lane = lane
+
+
+# Called once per job with the final error (None on success)
+ResultCallback = Callable[[DeliveryJob, Optional[Exception]], Awaitable[None]]
+
+
+class DeliveryPipeline:
+    """
+    Bounded send queue drained by a pool of workers.
+
+    Jobs wait in per-priority lanes that workers drain weighted-fair
+    (see LaneQueue), so urgent messages overtake a bulk broadcast. Every
+    send waits for its chat's pacing slot and a token from its bot's
+    bucket. A RetryAfter from Telegram pauses that bot for the requested
+    time and the message is retried, up to max_retries.
+
+    Telegram's global limit is per bot, so broadcast lanes can be spread
+    over extra bot tokens: each chat is pinned to one bot of the pool by
+    jump hash of its ID, and every bot sends at global_rate, which scales
+    broadcast throughput with the number of tokens. Other lanes, retries
+    and digests always go through the main bot.
+    """
+
+    def __init__(self, bot: Bot, on_result: Optional[ResultCallback] = None,
+                 workers: int = 8, queue_size: int = 1000,
+                 global_rate: float = DEFAULT_GLOBAL_RATE,
+                 chat_interval: float = DEFAULT_CHAT_INTERVAL,
+                 max_retries: int = 3,
+                 lane_weights: Optional[Dict[str, float]] = None,
+                 broadcast_bots: Optional[List[Bot]] = None,
+                 broadcast_lanes: Iterable[str] = DEFAULT_BROADCAST_LANES):
+        self.bot = bot
+        self.on_result = on_result
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+
+        self.queue = LaneQueue(maxsize=queue_size, weights=lane_weights)
+        self.bots = [
+            BotSlot(pool_bot, str(index), global_rate)
+            for index, pool_bot in enumerate([bot, *(broadcast_bots or [])])
+        ]
+        self.broadcast_lanes = frozenset(priority_rank(lane) for lane in broadcast_lanes)
+        self._chat_ready_at: Dict[int, float] = {}
+        self._tasks: List[asyncio.Task] = []
+
+        self.stats: Dict[str, int] = {
+            "sent": 0,
+            "failed": 0,
+            "rate_limited": 0,
+        }
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Start worker tasks."""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"delivery-worker-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f"Started delivery pipeline ({self.workers} workers)")
+
+    async def stop(self, drain: bool = True):
+        """
+        Stop worker tasks.
+
+        Args:
+            drain: Deliver queued messages before stopping
+        """
+        if not self._tasks:
+            return
+        if drain:
+            await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Stopped delivery pipeline")
+
+    async def submit(self, job: DeliveryJob):
+        """
+        Enqueue message, waiting while its lane is full.
+
+        Args:
+            job: Message to deliver
+        """
+        if not self._tasks:
+            self.start()
+        if job.batch is not None:
+            job.batch.add()
+        await self.queue.put(job, job.lane)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get delivery counters, queue depth and per-bot counters."""
+        return {
+            **self.stats,
+            "queued": self.queue.qsize(),
+            "workers": len(self._tasks),
+            "bots": {
+                slot.label: {"sent": slot.sent, "rate_limited": slot.rate_limited}
+                for slot in self.bots
+            },
+        }
+
+    def bot_for(self, job: DeliveryJob) -> BotSlot:
+        """Get the bot that sends a job (the chat's pool bot in broadcast lanes)."""
+        if len(self.bots) == 1 or job.lane not in self.broadcast_lanes:
+            return self.bots[0]
+        return self.bots[jump_hash(job.chat_id, len(self.bots))]
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._deliver(job)
+            except Exception as e:
+                logger.error(f"Delivery worker error for chat {job.chat_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, job: DeliveryJob):
+        error: Optional[Exception] = None
+        slot = self.bot_for(job)
+
+        while True:
+            await self._wait_chat_slot(job.chat_id)
+            await self._wait_unpaused(slot)
+            await slot.bucket.acquire()
+
+            started = time.perf_counter()
+            try:
+                await slot.bot.send_message(job.chat_id, job.text, parse_mode="HTML")
+                error = None
+                slot.sent += 1
+                metrics.bot_messages_sent.labels(bot=slot.label).inc()
+                break
+            except TelegramRetryAfter as e:
+                job.attempts += 1
+                self.stats["rate_limited"] += 1
+                slot.rate_limited += 1
+                metrics.rate_limited.labels(bot=slot.label).inc()
+                slot.pause(e.retry_after)
+                logger.warning(f"Bot {slot.label} rate limited by Telegram, pausing {e.retry_after}s")
+                if job.attempts > self.max_retries:
+                    error = e
+                    break
+            except Exception as e:
+                if slot is not self.bots[0] and classify_error(e) == ERROR_UNREACHABLE:
+                    # The user may not have started (or only blocked) this pool
+                    # bot; only the main bot's answer marks the chat unreachable
+                    metrics.bot_fallbacks.labels(bot=slot.label).inc()
+                    slot = self.bots[0]
+                    continue
+                error = e
+                break
+            finally:
+                metrics.send_duration.observe(time.perf_counter() - started)
+
+        self.stats["sent" if error is None else "failed"] += 1
+        try:
+            if self.on_result is not None:
+                await self.on_result(job, error)
+        finally:
+            if job.batch is not None:
+                job.batch.complete(error)
+
+    async def _wait_chat_slot(self, chat_id: int):
+        """Reserve the chat's next send slot and wait for it."""
+        now = time.monotonic()
+        slot = max(now, self._chat_ready_at.get(chat_id, 0.0))
+        self._chat_ready_at[chat_id] = slot + self.chat_interval
+
+        if len(self._chat_ready_at) > 10 * self.queue.maxsize + 1000:
+            self._prune_chat_slots(now)
+
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def _prune_chat_slots(self, now: float):
+        self._chat_ready_at = {
+            chat_id: ready_at
+            for chat_id, ready_at in self._chat_ready_at.items()
+            if ready_at > now
+        }
+
+    async def _wait_unpaused(self, slot: BotSlot):
+        while True:
+            delay = slot.paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
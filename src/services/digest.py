@@ -0,0 +1,149 @@
+"""Per-user buffering of notifications delivered as periodic digests."""
+import html
+import re
+from typing import Dict, List, Tuple
+
+from .delivery import DeliveryBatch, DeliveryJob
+
+# Telegram message length limit
+MAX_MESSAGE_LENGTH = 4096
+
+_TAG_RE = re.compile(r"<[^>]*>")
+
+
+class DigestItem:
+    """Notification held back for a digest (a digest_pending row)."""
+
+    __slots__ = ("item_id", "event_id", "text")
+
+    def __init__(self, item_id: int, event_id: int, text: str):
+        self.item_id = item_id
+        self.event_id = event_id
+        self.text = text
+
+
+class DigestJob(DeliveryJob):
+    """Combined digest message; history is written per included event."""
+
+    __slots__ = ("items",)
+
+    def __init__(self, chat_id: int, text: str, items: List[DigestItem],
+                 user_id: int = None, batch: DeliveryBatch = None):
+        super().__init__(chat_id, text, user_id=user_id, batch=batch)
+        self.items = items
+
+
+class DigestBuffer:
+    """
+    In-memory digest items grouped by user.
+
+    Mirrors the digest_pending table: items are added after they are
+    persisted, and take() hands over everything buffered so far for one
+    flush. Adding an item that is already buffered is a no-op, so the
+    table can be reloaded at any time.
+    """
+
+    def __init__(self):
+        # user_id -> (telegram_id, item_id -> item), in arrival order
+        self._users: Dict[int, Tuple[int, Dict[int, DigestItem]]] = {}
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def users(self) -> int:
+        """Number of users with buffered items."""
+        return len(self._users)
+
+    def add(self, user_id: int, telegram_id: int, item: DigestItem):
+        """Buffer item for a user."""
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = self._users[user_id] = (telegram_id, {})
+        if item.item_id not in entry[1]:
+            entry[1][item.item_id] = item
+            self._size += 1
+
+    def discard_user(self, user_id: int):
+        """Drop all items of a user."""
+        entry = self._users.pop(user_id, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def take(self) -> Dict[int, Tuple[int, List[DigestItem]]]:
+        """
+        Remove and return all buffered items.
+
+        Returns:
+            user_id -> (telegram_id, items in arrival order)
+        """
+        users, self._users = self._users, {}
+        self._size = 0
+        return {
+            user_id: (telegram_id, list(items.values()))
+            for user_id, (telegram_id, items) in users.items()
+        }
+
+
+def format_digest(items: List[DigestItem],
+                  max_length: int = MAX_MESSAGE_LENGTH) -> List[Tuple[str, List[DigestItem]]]:
+    """
+    Combine items into as few messages as fit Telegram's length limit.
+
+    Items are never split, so HTML markup stays balanced. An item too
+    long for a message of its own is sent as shortened plain text.
+
+    Returns:
+        (message text, items included in it) pairs
+    """
+    chunks: List[List[DigestItem]] = [[]]
+    length = 0
+    for item in items:
+        # Leave room for the header and separators
+        size = len(item.text) + 2
+        if chunks[-1] and length + size > max_length - 100:
+            chunks.append([])
+            length = 0
+        chunks[-1].append(item)
+        length += size
+
+    messages = []
+    for chunk in chunks:
+        header = f"<b>📬 Сводка уведомлений ({len(chunk)})</b>\n\n"
+        text = header + "\n\n".join(item.text for item in chunk)
+        if len(text) > max_length:
+            # Only a chunk of one oversized item can overflow
+            text = header + shorten_html(chunk[0].text, max_length - len(header))
+        messages.append((text, chunk))
+    return messages
+
+
+def shorten_html(text: str, max_length: int) -> str:
+    """
+    Fit HTML text into max_length without cutting a tag or an entity.
+
+    Text that is too long loses its markup: the plain text is trimmed,
+    escaped again and ends with an ellipsis.
+
+    Args:
+        text: HTML message text
+        max_length: Length limit of the result
+
+    Returns:
+        Text of at most max_length characters
+    """
+    if len(text) <= max_length:
+        return text
+
+    plain = html.unescape(_TAG_RE.sub("", text))
+    parts = []
+    length = 0
+    for char in plain:
+        escaped = html.escape(char, quote=False)
+        # Leave room for the ellipsis
+        if length + len(escaped) > max_length - 1:
+            break
+        parts.append(escaped)
+        length += len(escaped)
+    return "".join(parts) + "…"
@@ -0,0 +1,96 @@
+"""In-process event bus between event producers and notification dispatchers."""
+import asyncio
+import logging
+from typing import Awaitable, Callable, List
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Processes a batch of persisted event ids
+DispatchHandler = Callable[[List[int]], Awaitable[None]]
+
+
+class EventBus:
+    """
+    Queue of new event ids consumed by dispatcher tasks.
+
+    Events are persisted before they are published, so the bus is only a
+    fast path: if the queue is full or the process dies, the ids are
+    picked up by the regular polling of pending events.
+    """
+
+    def __init__(self, handler: DispatchHandler, dispatchers: int = 2,
+                 max_batch: int = 100, queue_size: int = 10000):
+        self.handler = handler
+        self.dispatchers = dispatchers
+        self.max_batch = max_batch
+
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks: List[asyncio.Task] = []
+        self.dropped = 0
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Start dispatcher tasks."""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._dispatch(), name=f"event-dispatcher-{i}")
+            for i in range(self.dispatchers)
+        ]
+        logger.info(f"Started event bus ({self.dispatchers} dispatchers)")
+
+    async def stop(self, drain: bool = True):
+        """
+        Stop dispatcher tasks.
+
+        Args:
+            drain: Dispatch published events before stopping
+        """
+        if not self._tasks:
+            return
+        if drain:
+            await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Stopped event bus")
+
+    def publish(self, event_id: int) -> bool:
+        """
+        Publish persisted event id without waiting.
+
+        Args:
+            event_id: Event ID
+
+        Returns:
+            False if the queue was full and the event was left for polling
+        """
+        if not self._tasks:
+            self.start()
+        try:
+            self.queue.put_nowait(event_id)
+        except asyncio.QueueFull:
+            # Still pending in the database; polling will process it
+            self.dropped += 1
+            logger.warning(f"Event bus full, event {event_id} left for polling")
+            return False
+        return True
+
+    async def _dispatch(self):
+        while True:
+            event_ids = [await self.queue.get()]
+            while len(event_ids) < self.max_batch and not self.queue.empty():
+                event_ids.append(self.queue.get_nowait())
+
+            try:
+                await self.handler(event_ids)
+            except Exception as e:
+                logger.error(f"Error dispatching events {event_ids}: {e}")
+            finally:
+                for _ in event_ids:
+                    self.queue.task_done()
@@ -0,0 +1,42 @@
+"""In-memory cache of recently used event idempotency keys."""
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+class IdempotencyCache:
+    """
+    LRU of idempotency key -> event ID with a short TTL.
+
+    Sits in front of the unique index on events.idempotency_key: a
+    producer retrying create_event right after a timeout gets its event
+    ID back without a database round trip. Keys that fell out of the
+    cache are still deduplicated by the index.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[int]:
+        """Get event ID of a key seen within the TTL."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        event_id, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return event_id
+
+    def put(self, key: str, event_id: int):
+        """Remember the event created for a key, evicting the least recently used."""
+        self._entries[key] = (event_id, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
@@ -0,0 +1,103 @@
+"""Priority lanes shared by event dispatch and delivery."""
+import asyncio
+from typing import Any, Dict, Optional
+
+# Lanes by rank (event_types.priority stores the rank): under backlog,
+# lower ranks are claimed first and get a larger share of send capacity
+PRIORITIES = ("urgent", "normal", "bulk")
+DEFAULT_PRIORITY = "normal"
+
+# Relative send capacity of each lane while all of them have work
+DEFAULT_LANE_WEIGHTS: Dict[str, float] = {"urgent": 8, "normal": 4, "bulk": 1}
+
+
+def priority_rank(priority: str) -> int:
+    """
+    Get rank of a priority name.
+
+    Raises:
+        ValueError: If priority is not one of PRIORITIES
+    """
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {priority}")
+    return PRIORITIES.index(priority)
+
+
+def parse_lane_weights(spec: str) -> Dict[str, float]:
+    """
+    Parse lane weights like "urgent=8,normal=4,bulk=1" (missing lanes keep defaults).
+
+    Raises:
+        ValueError: On an unknown lane or a malformed weight
+    """
+    weights = dict(DEFAULT_LANE_WEIGHTS)
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        priority, _, weight = part.partition("=")
+        priority_rank(priority.strip())
+        weights[priority.strip()] = float(weight)
+    return weights
+
+
+class LaneQueue:
+    """
+    One bounded FIFO queue per lane, drained weighted-fair.
+
+    get() serves the non-empty lane with the lowest virtual time and moves
+    it on by 1/weight (stride scheduling): while all lanes are busy they
+    share consumers in proportion to their weights, and an urgent job
+    waits behind a few bulk jobs rather than behind the whole bulk queue.
+    A full lane only blocks its own producers.
+    """
+
+    def __init__(self, maxsize: int = 0, weights: Optional[Dict[str, float]] = None):
+        weights = {**DEFAULT_LANE_WEIGHTS, **(weights or {})}
+        if min(weights[priority] for priority in PRIORITIES) <= 0:
+            raise ValueError(f"Lane weights must be positive: {weights}")
+        self.maxsize = maxsize
+        self._queues = [asyncio.Queue(maxsize=maxsize) for _ in PRIORITIES]
+        self._strides = [1.0 / weights[priority] for priority in PRIORITIES]
+        self._passes = [0.0] * len(PRIORITIES)
+        self._clock = 0.0
+        self._items = asyncio.Semaphore(0)
+        self._unfinished = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    def qsize(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def empty(self) -> bool:
+        return not self.qsize()
+
+    def get_depths(self) -> Dict[str, int]:
+        """Get number of queued items per lane."""
+        return {priority: queue.qsize() for priority, queue in zip(PRIORITIES, self._queues)}
+
+    async def put(self, item: Any, lane: int = 1):
+        """Add item to a lane (by rank), waiting while that lane is full."""
+        await self._queues[lane].put(item)
+        self._unfinished += 1
+        self._finished.clear()
+        self._items.release()
+
+    async def get(self) -> Any:
+        """Remove and return the next item, waiting while all lanes are empty."""
+        await self._items.acquire()
+        lane = min(
+            (rank for rank, queue in enumerate(self._queues) if not queue.empty()),
+            key=lambda rank: max(self._passes[rank], self._clock)
+        )
+        # A lane that was idle starts at the current time instead of
+        # spending credit banked while it had nothing to send
+        self._clock = max(self._passes[lane], self._clock)
+        self._passes[lane] = self._clock + self._strides[lane]
+        return self._queues[lane].get_nowait()
+
+    def task_done(self):
+        self._unfinished -= 1
+        if self._unfinished <= 0:
+            self._finished.set()
+
+    async def join(self):
+        """Wait until every item put has been processed."""
+        await self._finished.wait()
@@ -0,0 +1,239 @@
+"""Prometheus metrics for the notification pipeline."""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from aiohttp import web
+from prometheus_client import Counter, Histogram, Gauge, generate_latest, CONTENT_TYPE_LATEST
+
+logger = logging.getLogger(__name__)
+
+# Sub-millisecond to minutes: sends are ~50-500ms, fan-out of a broadcast
+# to many chats at 30 msg/s takes minutes
+_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1, 2.5, 5, 10, 30, 60, 300, 900,
+)
+
+
+# ==================== METRICS ====================
+
+# Event processing
+dispatch_lag = Histogram(
+    'notification_dispatch_lag_seconds',
+    'Time from event creation to the start of its processing',
+    buckets=_LATENCY_BUCKETS
+)
+
+fanout_duration = Histogram(
+    'notification_fanout_duration_seconds',
+    'Time to match and deliver all notifications of one event',
+    buckets=_LATENCY_BUCKETS
+)
+
+condition_evaluation_duration = Histogram(
+    'notification_condition_evaluation_seconds',
+    'Time to evaluate subscription conditions for one event',
+    buckets=_LATENCY_BUCKETS
+)
+
+subscribers_evaluated = Gauge(
+    'notification_subscribers_evaluated',
+    'Subscription conditions evaluated for the last processed event',
+    ['event_type']
+)
+
+subscribers_matched = Gauge(
+    'notification_subscribers_matched',
+    'Subscribers whose conditions matched the last processed event',
+    ['event_type']
+)
+
+events_expired = Counter(
+    'notification_events_expired_total',
+    'Events dropped unsent because they outlived their event type TTL',
+    ['event_type']
+)
+
+event_wakeups = Counter(
+    'notification_event_wakeups_total',
+    'Wakeups of the event dispatcher before its fallback poll was due',
+    ['source']
+)
+
+poll_interval = Gauge(
+    'notification_poll_interval_seconds',
+    'Current wait before the next fallback poll for pending events'
+)
+
+claim_batch_size = Gauge(
+    'notification_claim_batch_size',
+    'Current number of events claimed per page'
+)
+
+# Delivery
+send_duration = Histogram(
+    'notification_send_duration_seconds',
+    'Telegram sendMessage latency',
+    buckets=_LATENCY_BUCKETS
+)
+
+notifications_sent = Counter(
+    'notifications_sent_total',
+    'Notifications delivered'
+)
+
+notifications_failed = Counter(
+    'notifications_failed_total',
+    'Notifications that failed for good',
+    ['error_class']
+)
+
+notifications_retried = Counter(
+    'notifications_retried_total',
+    'Failed sends queued for retry',
+    ['error_class']
+)
+
+rate_limited = Counter(
+    'notification_rate_limited_total',
+    'RetryAfter responses from Telegram',
+    ['bot']
+)
+
+bot_messages_sent = Counter(
+    'notification_bot_messages_sent_total',
+    'Messages accepted by Telegram, per bot of the pool (0 is the main bot)',
+    ['bot']
+)
+
+bot_fallbacks = Counter(
+    'notification_bot_fallbacks_total',
+    'Sends of a pool bot that could not reach the chat, redone by the main bot',
+    ['bot']
+)
+
+# Backlog
+pending_events = Gauge(
+    'notification_pending_events',
+    'Events not processed yet'
+)
+
+pending_retries = Gauge(
+    'notification_pending_retries',
+    'Notifications in the retry queue by status',
+    ['status']
+)
+
+duplicate_events = Counter(
+    'notification_duplicate_events_total',
+    'create_event calls answered from the idempotency key cache'
+)
+
+notifications_deduplicated = Counter(
+    'notification_deduplicated_total',
+    'Recipients skipped because another attempt at the event already notified them'
+)
+
+notifications_deferred = Counter(
+    'notification_deferred_total',
+    "Notifications held until the end of the recipient's quiet hours"
+)
+
+deferred_notifications = Gauge(
+    'notification_deferred_scheduled',
+    'Deferred notifications waiting in the release schedule of this worker'
+)
+
+pending_digest_items = Gauge(
+    'notification_pending_digest_items',
+    'Notifications buffered for digests'
+)
+
+delivery_queue_depth = Gauge(
+    'notification_delivery_queue_depth',
+    'Messages waiting in the delivery pipeline'
+)
+
+delivery_lane_depth = Gauge(
+    'notification_delivery_lane_depth',
+    'Messages waiting in the delivery pipeline per priority lane',
+    ['lane']
+)
+
+shard_queue_depth = Gauge(
+    'notification_shard_queue_depth',
+    'Events (or per-shard parts of events) waiting for a shard worker',
+    ['shard']
+)
+
+# Database
+db_write_queue_depth = Gauge(
+    'notification_db_write_queue_depth',
+    'Buffered history rows and processed marks'
+)
+
+db_flush_duration = Histogram(
+    'notification_db_flush_duration_seconds',
+    'Duration of write-behind flush transactions',
+    buckets=_LATENCY_BUCKETS
+)
+
+db_flush_rows = Histogram(
+    'notification_db_flush_rows',
+    'Rows written per write-behind flush',
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+)
+
+
+# ==================== METRICS ENDPOINT ====================
+
+def get_metrics() -> bytes:
+    """Get metrics in Prometheus text format."""
+    return generate_latest()
+
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=get_metrics(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+async def start_metrics_server(port: int, host: str = "0.0.0.0",
+                               collect: Optional[Callable[[], Awaitable[None]]] = None,
+                               collect_interval: float = 15.0) -> web.AppRunner:
+    """
+    Serve /metrics over HTTP.
+
+    Args:
+        port: Port to listen on
+        host: Interface to bind
+        collect: Coroutine refreshing gauges that need a query (backlog sizes)
+        collect_interval: Seconds between collect() calls
+
+    Returns:
+        Runner; call `await runner.cleanup()` to stop
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_handler)
+
+    if collect is not None:
+        async def collect_loop(app: web.Application):
+            async def loop():
+                while True:
+                    try:
+                        await collect()
+                    except Exception as e:
+                        logger.error(f"Failed to collect metrics: {e}")
+                    await asyncio.sleep(collect_interval)
+
+            task = asyncio.create_task(loop(), name="metrics-collector")
+            yield
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        app.cleanup_ctx.append(collect_loop)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return runner
@@ -1,12 +1,37 @@
 """Notification service for processing events and sending messages."""
 import json
 import asyncio
+import contextlib
 import logging
-from typing import Dict, Any, List
+import os
+import socket
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 from aiogram import Bot
 
 from ..database.db import Database
+from . import metrics
 from .condition_checker import ConditionChecker
+from .delivery import (
+    DeliveryPipeline, DeliveryBatch, DeliveryJob,
+    classify_error, ERROR_TRANSIENT, ERROR_UNREACHABLE,
+)
+from .digest import DigestBuffer, DigestItem, DigestJob, format_digest
+from .event_bus import EventBus
+from .idempotency import IdempotencyCache
+from .lanes import PRIORITIES, DEFAULT_PRIORITY, priority_rank
+from .pacing import AdaptiveBatchSize, AdaptiveInterval
+from .quiet_hours import DeferredSchedule
+from .retry import RetryJob, RetryPolicy
+from .sharding import (
+    ShardMap, ShardPool, owned_keys,
+    PARTITION_EVENT_TYPE, PARTITION_USER, PARTITION_KEYS,
+)
+from .subscription_index import Subscriber
+from .templates import RenderedMessage, TemplateCache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,112 +40,1066 @@ logger = logging.getLogger(__name__)
 class NotificationService:
     """Service for processing events and sending notifications."""
 
-    def __init__(self, database: Database, bot: Bot):
+    def __init__(self, database: Database, bot: Bot,
+                 delivery: Optional[DeliveryPipeline] = None,
+                 broadcast_bots: Optional[List[Bot]] = None,
+                 worker_id: Optional[str] = None,
+                 claim_batch_size: int = 100,
+                 min_claim_batch_size: int = 10,
+                 max_claim_batch_size: int = 1000,
+                 lease_seconds: float = 300,
+                 dispatchers: int = 2,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 retry_batch_size: int = 200,
+                 idempotency_cache_size: int = 10000,
+                 idempotency_ttl: float = 600,
+                 stream_threshold: int = 100000,
+                 stream_chunk_size: int = 1000,
+                 deferred_batch_size: int = 500,
+                 deferred_sweep_interval: float = 300,
+                 shards: int = 1,
+                 partition_by: str = PARTITION_EVENT_TYPE,
+                 partition_processes: bool = False,
+                 membership_ttl: float = 30):
         self.db = database
         self.bot = bot
         self.condition_checker = ConditionChecker()
+        self.templates = TemplateCache()
         self.is_running = False
 
-    async def create_event(self, event_type_name: str, data: Dict[str, Any]) -> int:
+        # Events are claimed with a lease, so several workers (processes or
+        # overlapping cron ticks) never process the same event twice
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.claim_batch_size = claim_batch_size
+        # Page size follows observed throughput, starting at claim_batch_size
+        self.batch_size = AdaptiveBatchSize(
+            claim_batch_size,
+            min_size=min(min_claim_batch_size, claim_batch_size),
+            max_size=max(max_claim_batch_size, claim_batch_size)
+        )
+        self.lease_seconds = lease_seconds
+        self._leased: set = set()
+        # Processed events whose mark may still sit in the write buffer;
+        # their leases are renewed until it is written
+        self._marked: set = set()
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._event_type_ids: Dict[str, int] = {}
+
+        # Recently used idempotency keys, so a producer retrying
+        # create_event gets its event back without a database round trip
+        self.idempotency = IdempotencyCache(idempotency_cache_size, idempotency_ttl)
+
+        # New events are handed to dispatcher tasks instead of being
+        # processed inside create_event
+        self.event_bus = EventBus(self._dispatch_events, dispatchers=dispatchers)
+
+        # Set by wake() to cut the fallback poll of start_polling() short
+        self._wakeup = asyncio.Event()
+        self._listening = False
+
+        # Matches of digest-mode subscriptions, sent by flush_digests()
+        self.digests = DigestBuffer()
+        self._digests_loaded = False
+
+        # Failed sends go to the durable retry queue, drained by process_retries()
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.retry_batch_size = retry_batch_size
+
+        # Event types with more subscribers than stream_threshold are not
+        # loaded into the roster cache: their subscribers are streamed from
+        # the database in chunks, checkpointed per event (0 disables)
+        self.stream_threshold = stream_threshold
+        self.stream_chunk_size = stream_chunk_size
+
+        # Notifications due in a user's quiet hours wait in the
+        # deferred_notifications table; the in-memory schedule wakes the
+        # release timer when the earliest of them is due
+        self.deferred = DeferredSchedule()
+        self.deferred_batch_size = deferred_batch_size
+        self.deferred_sweep_interval = deferred_sweep_interval
+        self._deferred_loaded = False
+        self._deferred_changed = asyncio.Event()
+        self._release_timer: Optional[asyncio.Task] = None
+        self._last_sweep = 0.0
+
+        # Users whose chats returned a permanent error; deactivated in bulk
+        # after each fan-out so later events skip them
+        self._unreachable: set = set()
+
+        # Events (or, partitioned by user, each event's recipients) are split
+        # by hash between shard workers. Each shard runs its work in order,
+        # so a broadcast on one shard does not hold up alerts on the others
+        if partition_by not in PARTITION_KEYS:
+            raise ValueError(f"Unknown partition key: {partition_by}")
+        self.partition_by = partition_by
+        self.shard_map = ShardMap(shards)
+        self.shard_pool = ShardPool(shards) if shards > 1 else None
+        self._routing_lock = asyncio.Lock()
+        self._in_flight: set = set()
+
+        # Without shards each priority lane gets its own worker, so urgent
+        # events are not stuck behind a bulk broadcast; within a lane
+        # events run in claim order
+        self.lane_pool = ShardPool(len(PRIORITIES))
+
+        # Event types split between all processes sharing the database,
+        # which find each other through heartbeats
+        self.partition_processes = partition_processes
+        self.membership_ttl = membership_ttl
+        self._owned_event_types: Optional[List[int]] = None
+        self._membership: Optional[asyncio.Task] = None
+
+        # All sends go through the rate-limited delivery pipeline; bulk-lane
+        # events are spread over the broadcast bots as well (see DeliveryPipeline)
+        self.delivery = delivery or DeliveryPipeline(bot, broadcast_bots=broadcast_bots)
+        self.delivery.on_result = self._on_delivery_result
+
+    async def create_event(self, event_type_name: str, data: Dict[str, Any],
+                           idempotency_key: Optional[str] = None) -> int:
         """
         Create new event that will trigger notifications.
 
+        The event is persisted and handed to the dispatchers; this returns
+        without waiting for notifications to be sent.
+
         Args:
             event_type_name: Name of the event type
             data: Event data dictionary
+            idempotency_key: Producer-chosen key (e.g. a UUID per logical
+                event); calling again with the same key creates nothing and
+                returns the first event's ID, so retries after a timeout are safe
 
         Returns:
             Event ID
         """
-        # Get or create event type
-        event_type = await self.db.get_event_type(event_type_name)
-        if not event_type:
-            event_type_id = await self.db.add_event_type(event_type_name)
-        else:
-            event_type_id = event_type['id']
+        if idempotency_key is not None:
+            event_id = self.idempotency.get(idempotency_key)
+            if event_id is not None:
+                metrics.duplicate_events.inc()
+                logger.info(f"Event with key {idempotency_key!r} already created: {event_id}")
+                return event_id
 
-        # Create event
-        event_id = await self.db.add_event(event_type_id, data)
-        logger.info(f"Created event {event_id} of type '{event_type_name}'")
+        event_type_id = await self._get_event_type_id(event_type_name)
 
-        # Process immediately
-        await self.process_events()
+        # Create event (or get the one created with this key before)
+        event_id = await self.db.add_event(event_type_id, data, idempotency_key=idempotency_key)
+        if idempotency_key is not None:
+            self.idempotency.put(idempotency_key, event_id)
+        logger.info(f"Created event {event_id} of type '{event_type_name}'")
 
+        if not self.event_bus.publish(event_id):
+            self.wake("bus_full")
         return event_id
 
-    async def process_events(self):
-        """Process all unprocessed events and send notifications."""
-        events = await self.db.get_unprocessed_events()
+    async def create_events(self, events: List[tuple]) -> List[int]:
+        """
+        Create many events in one transaction.
+
+        Args:
+            events: (event type name, event data) pairs or
+                (event type name, event data, idempotency key) tuples
+
+        Returns:
+            Event IDs in input order (see create_event for keys)
+        """
+        rows = [
+            (await self._get_event_type_id(event_type_name), data, *key)
+            for event_type_name, data, *key in events
+        ]
+        event_ids = await self.db.add_events(rows)
+        for row, event_id in zip(rows, event_ids):
+            if len(row) > 2 and row[2] is not None:
+                self.idempotency.put(row[2], event_id)
+        logger.info(f"Created {len(event_ids)} events")
+
+        if not all([self.event_bus.publish(event_id) for event_id in event_ids]):
+            self.wake("bus_full")
+        return event_ids
+
+    async def _get_event_type_id(self, event_type_name: str) -> int:
+        """Get or create event type, cached by name."""
+        event_type_id = self._event_type_ids.get(event_type_name)
+        if event_type_id is None:
+            event_type = await self.db.get_event_type(event_type_name)
+            if not event_type:
+                event_type_id = await self.db.add_event_type(event_type_name)
+            else:
+                event_type_id = event_type['id']
+            self._event_type_ids[event_type_name] = event_type_id
+        return event_type_id
+
+    async def process_events(self) -> int:
+        """
+        Claim and process pending events until none are left.
+
+        Events are streamed in pages sized by observed throughput (see
+        AdaptiveBatchSize); the next page is fetched while the current one
+        is being sent, and its leases are renewed from the moment it is
+        claimed. A page counts as processed once every event of it is,
+        not once its events are queued to the lane workers.
 
+        Returns:
+            Number of events claimed
+        """
+        if self.partition_processes:
+            await self._refresh_ownership()
+
+        pages = self.db.iter_pending_events(
+            self.worker_id,
+            batch_size=self.batch_size,
+            lease_seconds=self.lease_seconds,
+            event_type_ids=self._owned_event_types
+        )
+        next_page = asyncio.ensure_future(self._claim_page(pages))
+        claimed = 0
+
+        try:
+            while True:
+                try:
+                    events = await next_page
+                except StopAsyncIteration:
+                    break
+
+                next_page = asyncio.ensure_future(self._claim_page(pages))
+                started = time.perf_counter()
+                async with self._routing():
+                    completions = await self._process_claimed(events)
+                await asyncio.gather(*completions, return_exceptions=True)
+                self.batch_size.observe(len(events), time.perf_counter() - started)
+                claimed += len(events)
+        finally:
+            await self._discard_prefetched(next_page)
+            await pages.aclose()
+        await self._drain_shards()
+        return claimed
+
+    async def _dispatch_events(self, event_ids: List[int]):
+        """Claim and process events published on the event bus."""
+        if self.partition_processes and self._owned_event_types is None:
+            await self._refresh_ownership()
+
+        # With shards, dispatchers claim and route one batch at a time, so
+        # shards get events in publish order
+        async with self._routing():
+            # Events of types owned by other processes are left to their polling
+            events = await self.db.claim_events_by_id(
+                self.worker_id, event_ids, lease_seconds=self.lease_seconds,
+                event_type_ids=self._owned_event_types
+            )
+            self._hold_leases(events)
+            await self._process_claimed(events)
+
+    async def _process_claimed(self, events: List[Dict[str, Any]]) -> List[asyncio.Future]:
+        """
+        Hand claimed events to lane workers, or to shard workers.
+
+        Returns:
+            Futures completing when each event is processed
+        """
+        completions = []
         for event in events:
+            if self.shard_pool is None:
+                completion = await self.lane_pool.submit(
+                    self._lane_of(event), self._process_event, event
+                )
+            elif self.partition_by == PARTITION_USER:
+                completion = await self._route_event(event)
+            else:
+                completion = await self.shard_pool.submit(
+                    self.shard_map.shard_of(event['event_type_id']),
+                    self._process_event, event
+                )
+            if completion is not None:
+                self._in_flight.add(completion)
+                completion.add_done_callback(self._in_flight.discard)
+                completions.append(completion)
+        return completions
+
+    def _routing(self):
+        """Lock held while handing events to shards (no lock without shards)."""
+        return self._routing_lock if self.shard_pool is not None else contextlib.nullcontext()
+
+    @staticmethod
+    def _lane_of(event: Dict[str, Any]) -> int:
+        """Priority lane rank of an event."""
+        priority = event.get('priority')
+        return priority_rank(DEFAULT_PRIORITY) if priority is None else priority
+
+    async def _drop_if_expired(self, event: Dict[str, Any]) -> bool:
+        """
+        Mark an event past its TTL processed without sending it.
+
+        Returns:
+            Whether the event was dropped
+        """
+        expires_at = event.get('expires_at')
+        if expires_at is None or expires_at > time.time():
+            return False
+        metrics.events_expired.labels(event_type=event['event_name']).inc()
+        logger.info(
+            f"Dropped event {event['id']} ({event['event_name']}):"
+            f" expired {time.time() - expires_at:.1f}s ago"
+        )
+        await self.db.mark_event_processed(event['id'])
+        self._marked.add(event['id'])
+        self._leased.discard(event['id'])
+        return True
+
+    async def _process_event(self, event: Dict[str, Any]):
+        """Process claimed event and mark it processed."""
+        if self._lease_lost(event):
+            return
+        try:
+            if await self._drop_if_expired(event):
+                return
+            await self._process_single_event(event)
+            await self.db.mark_event_processed(event['id'])
+            self._marked.add(event['id'])
+        except Exception as e:
+            # Lease is kept: the event is retried once it expires
+            logger.error(f"Error processing event {event['id']}: {e}")
+        self._leased.discard(event['id'])
+
+    async def _route_event(self, event: Dict[str, Any]) -> Optional[asyncio.Future]:
+        """
+        Match event and queue each user shard its part of the recipients.
+
+        A user always maps to the same shard and a shard delivers its parts
+        one after another, so every user gets events in order.
+
+        Returns:
+            Task marking the event processed once all parts are delivered,
+            or None if the event failed
+        """
+        started = time.perf_counter()
+        if self._lease_lost(event):
+            return None
+        try:
+            if await self._drop_if_expired(event):
+                return None
+            if await self._should_stream(event['event_type_id']):
+                # Chunks are split between shards as they stream; routing
+                # waits for the broadcast so later events stay behind it
+                await self._process_event(event)
+                return None
+
+            matched, message = await self._match_event(event)
+            matched = await self._skip_notified(event, matched)
+            lane = self._lane_of(event)
+            deliveries = await self._submit_parts(
+                await self._hold_back(matched, event['id'], message, lane), event['id'], message, lane
+            )
+        except Exception as e:
+            # Lease is kept: the event is retried once it expires
+            logger.error(f"Error processing event {event['id']}: {e}")
+            self._leased.discard(event['id'])
+            return None
+        return asyncio.ensure_future(self._complete_event(event, deliveries, started))
+
+    async def _submit_parts(self, subscribers: List[Subscriber], event_id: int,
+                            message: RenderedMessage, lane: int) -> List[asyncio.Future]:
+        """
+        Queue notifications, split between user shards when partitioned by user.
+
+        Returns:
+            Futures of the DeliveryBatch of each part
+        """
+        if self.shard_pool is None or self.partition_by != PARTITION_USER:
+            batch = DeliveryBatch()
+            for subscriber in subscribers:
+                await self._send_notification(subscriber, event_id, message, batch, lane)
+            return [asyncio.ensure_future(self._wait_for(batch))]
+
+        parts: Dict[int, List[Subscriber]] = defaultdict(list)
+        for subscriber in subscribers:
+            parts[self.shard_map.shard_of(subscriber.user_id)].append(subscriber)
+        return [
+            await self.shard_pool.submit(shard, self._deliver_part, part, event_id, message, lane)
+            for shard, part in parts.items()
+        ]
+
+    @staticmethod
+    async def _wait_for(batch: DeliveryBatch) -> DeliveryBatch:
+        await batch.wait()
+        return batch
+
+    async def _deliver_part(self, subscribers: List[Subscriber], event_id: int,
+                            message: RenderedMessage, lane: int) -> DeliveryBatch:
+        """Deliver an event to one shard's recipients and wait for the sends."""
+        batch = DeliveryBatch()
+        for subscriber in subscribers:
+            await self._send_notification(subscriber, event_id, message, batch, lane)
+        await batch.wait()
+        return batch
+
+    async def _complete_event(self, event: Dict[str, Any], deliveries: List[asyncio.Future],
+                              started: float):
+        """Mark event processed once every shard delivered its part."""
+        event_id = event['id']
+        try:
+            batches = await asyncio.gather(*deliveries)
+            metrics.fanout_duration.observe(time.perf_counter() - started)
+            if batches:
+                logger.info(
+                    f"Sent {sum(batch.sent for batch in batches)} notifications for event"
+                    f" {event_id} ({sum(batch.failed for batch in batches)} failed)"
+                )
+                await self._deactivate_unreachable()
+            await self.db.mark_event_processed(event_id)
+            self._marked.add(event_id)
+        except Exception as e:
+            logger.error(f"Error processing event {event_id}: {e}")
+        self._leased.discard(event_id)
+
+    async def _drain_shards(self):
+        """Wait until events handed to shard workers are done."""
+        while self._in_flight:
+            await asyncio.gather(*list(self._in_flight), return_exceptions=True)
+
+    async def resize_shards(self, shards: int):
+        """
+        Change the number of shard workers.
+
+        Routing pauses and work already handed out finishes first, so
+        per-key order holds across the change.
+
+        Args:
+            shards: New number of shard workers
+        """
+        async with self._routing_lock:
+            await self._drain_shards()
+            if self.shard_pool is not None:
+                await self.shard_pool.stop()
+            self.shard_map.resize(shards)
+            self.shard_pool = ShardPool(shards) if shards > 1 else None
+        logger.info(f"Resized to {shards} shard workers")
+
+    async def _refresh_ownership(self):
+        """Send heartbeat and recompute the event types this process handles."""
+        members = await self.db.heartbeat_worker(self.worker_id, self.membership_ttl)
+        event_type_ids = [event_type['id'] for event_type in await self.db.get_all_event_types()]
+        owned = owned_keys(event_type_ids, members, self.worker_id) or []
+
+        if owned != self._owned_event_types:
+            # Rosters of event types that moved to other processes are dropped
+            for event_type_id in set(self._owned_event_types or event_type_ids) - set(owned):
+                self.db.subscription_index.discard(event_type_id)
+            self._owned_event_types = owned
+            logger.info(
+                f"Worker {self.worker_id} handles {len(owned)} of {len(event_type_ids)}"
+                f" event types ({len(members)} live workers)"
+            )
+
+        if self._membership is None or self._membership.done():
+            self._membership = asyncio.create_task(self._keep_membership())
+
+    async def _keep_membership(self):
+        """Heartbeat periodically so ownership follows workers joining and leaving."""
+        while True:
+            await asyncio.sleep(self.membership_ttl / 3)
+            try:
+                await self._refresh_ownership()
+            except Exception as e:
+                logger.error(f"Failed to refresh worker membership: {e}")
+
+    async def _claim_page(self, pages: AsyncIterator[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Claim the next page and renew its leases while it waits to be processed."""
+        events = await anext(pages)
+        self._hold_leases(events)
+        return events
+
+    def _hold_leases(self, events: List[Dict[str, Any]]):
+        """Track claimed events so their leases are renewed until processed."""
+        self._leased.update(event['id'] for event in events)
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._renew_leases())
+
+    async def _discard_prefetched(self, next_page: asyncio.Future):
+        """Release events of a prefetched page that will not be processed."""
+        if not next_page.done():
+            next_page.cancel()
+            await asyncio.gather(next_page, return_exceptions=True)
+            return
+        if next_page.cancelled() or next_page.exception() is not None:
+            return
+        event_ids = [event['id'] for event in next_page.result()]
+        self._leased.difference_update(event_ids)
+        await self.db.release_events(event_ids, self.worker_id)
+
+    def _lease_lost(self, event: Dict[str, Any]) -> bool:
+        """Whether the lease of a claimed event ran out and another worker may own it."""
+        if event['id'] in self._leased:
+            return False
+        logger.warning(f"Lease of event {event['id']} was lost, leaving it to its new owner")
+        return True
+
+    async def _renew_leases(self):
+        """Keep leases of claimed events alive while they are being processed."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not self._leased and not self._marked:
+                continue
+            event_ids = list(self._leased | self._marked)
             try:
-                await self._process_single_event(event)
-                await self.db.mark_event_processed(event['id'])
+                held = await self.db.extend_leases(event_ids, self.worker_id, self.lease_seconds)
             except Exception as e:
-                logger.error(f"Error processing event {event['id']}: {e}")
+                logger.error(f"Failed to renew event leases: {e}")
+                continue
+            # Events processed meanwhile are no longer tracked; the rest
+            # were re-claimed by another worker and must not be sent here
+            lost = self._leased.intersection(event_ids).difference(held)
+            if lost:
+                logger.warning(f"Lost leases of {len(lost)} events to other workers")
+                self._leased.difference_update(lost)
+            self._marked.intersection_update(held)
 
     async def _process_single_event(self, event: Dict[str, Any]):
         """Process single event and send notifications to subscribers."""
+        with metrics.fanout_duration.time():
+            await self._fan_out(event)
+
+    async def _fan_out(self, event: Dict[str, Any]):
+        """Match subscribers of an event and deliver their notifications."""
+        if await self._should_stream(event['event_type_id']):
+            await self._stream_fan_out(event)
+            return
+
+        event_id = event['id']
+        matched, message = await self._match_event(event)
+        matched = await self._skip_notified(event, matched)
+
+        # Queue notifications for matching subscribers; the pipeline paces sends
+        batch = DeliveryBatch()
+        lane = self._lane_of(event)
+        for subscriber in await self._hold_back(matched, event_id, message, lane):
+            await self._send_notification(subscriber, event_id, message, batch, lane)
+
+        if batch.total:
+            await batch.wait()
+            logger.info(
+                f"Sent {batch.sent} notifications for event {event_id}"
+                f" ({batch.failed} failed)"
+            )
+            await self._deactivate_unreachable()
+
+    async def _should_stream(self, event_type_id: int) -> bool:
+        """Whether an event type's audience is too large to load as a roster."""
+        if not self.stream_threshold or self.db.subscription_index.is_loaded(event_type_id):
+            return False
+        return await self.db.count_subscribers(event_type_id) > self.stream_threshold
+
+    async def _stream_fan_out(self, event: Dict[str, Any]):
+        """
+        Deliver an event to a large audience chunk by chunk.
+
+        Subscribers are read with a keyset cursor and matches go straight
+        to the delivery queue, whose bound blocks the walk when sends fall
+        behind; at most two chunks are in memory. Once a chunk is
+        delivered its last subscription ID is checkpointed, so a worker
+        that re-claims the event after a crash resumes from there; only
+        the (at most two) chunks in flight are sent twice.
+        """
+        event_id = event['id']
+        event_data = json.loads(event['data'])
+        self._observe_dispatch_lag(event)
+        message = self._render_message(event, event_data)
+        lane = self._lane_of(event)
+
+        after_id = await self.db.get_fanout_checkpoint(event_id)
+        logger.info(
+            f"Streaming event {event_id} ({event['event_name']})"
+            + (f", resuming after subscription {after_id}" if after_id else "")
+        )
+
+        evaluated = matched_count = sent = failed = 0
+        in_flight = None  # (last subscription ID, delivery futures) of the previous chunk
+        async for chunk in self.db.iter_subscribers(
+            event['event_type_id'], after_id=after_id, chunk_size=self.stream_chunk_size
+        ):
+            with metrics.condition_evaluation_duration.time():
+                matched = [
+                    subscriber for subscriber in chunk
+                    if subscriber.condition.evaluate(event_data)
+                ]
+            matched = await self._skip_notified(event, matched)
+            evaluated += len(chunk)
+            matched_count += len(matched)
+
+            deliveries = await self._submit_parts(
+                await self._hold_back(matched, event_id, message, lane), event_id, message, lane
+            )
+            if in_flight is not None:
+                chunk_sent, chunk_failed = await self._finish_chunk(event_id, *in_flight)
+                sent += chunk_sent
+                failed += chunk_failed
+            in_flight = (chunk[-1].subscription_id, deliveries)
+
+        if in_flight is not None:
+            chunk_sent, chunk_failed = await self._finish_chunk(event_id, *in_flight)
+            sent += chunk_sent
+            failed += chunk_failed
+
+        metrics.subscribers_evaluated.labels(event_type=event['event_name']).set(evaluated)
+        metrics.subscribers_matched.labels(event_type=event['event_name']).set(matched_count)
+        logger.info(f"Sent {sent} notifications for event {event_id} ({failed} failed)")
+
+    async def _finish_chunk(self, event_id: int, last_subscription_id: int,
+                            deliveries: List[asyncio.Future]) -> Tuple[int, int]:
+        """
+        Wait for a streamed chunk to be delivered and checkpoint past it.
+
+        Returns:
+            Sent and failed notifications of the chunk
+        """
+        batches = await asyncio.gather(*deliveries)
+        await self._deactivate_unreachable()
+        await self.db.save_fanout_checkpoint(event_id, last_subscription_id)
+        return sum(batch.sent for batch in batches), sum(batch.failed for batch in batches)
+
+    async def _match_event(self, event: Dict[str, Any]
+                           ) -> Tuple[List[Subscriber], Optional[RenderedMessage]]:
+        """
+        Find subscribers whose conditions match an event and render its message.
+
+        Returns:
+            Matched subscribers and the message (None without subscribers)
+        """
         event_id = event['id']
-        event_type_id = event['event_type_id']
         event_data = json.loads(event['data'])
 
         logger.info(f"Processing event {event_id} ({event['event_name']})")
+        self._observe_dispatch_lag(event)
 
-        # Get all subscribers for this event type
-        subscribers = await self.db.get_subscribers_for_event(event_type_id)
+        # Get subscribers whose conditions can match, via the predicate index
+        index = await self.db.get_subscription_index(event['event_type_id'])
 
-        if not subscribers:
+        if not index:
             logger.info(f"No subscribers for event {event_id}")
+            return [], None
+
+        with metrics.condition_evaluation_duration.time():
+            matched, evaluated = index.match_with_count(event_data)
+        metrics.subscribers_evaluated.labels(event_type=event['event_name']).set(evaluated)
+        metrics.subscribers_matched.labels(event_type=event['event_name']).set(len(matched))
+
+        # Render once per event; recipients share the text (or its segments)
+        return matched, self._render_message(event, event_data)
+
+    async def _skip_notified(self, event: Dict[str, Any],
+                             subscribers: List[Subscriber]) -> List[Subscriber]:
+        """
+        Drop recipients an event already reached and reserve the rest.
+
+        Every recipient gets a 'pending' history row before anything is
+        sent (see Database.reserve_notifications); a recipient whose row
+        another attempt at the event already reserved is skipped, even if
+        that attempt is still in flight or its outcome not yet flushed.
+        Events claimed again (their previous worker crashed or its lease
+        ran out) are also checked against digest items, deferred
+        notifications and retries left by the earlier attempt.
+
+        Returns:
+            Subscribers still to notify
+        """
+        if not subscribers:
+            return subscribers
+        notified = set()
+        if event.get('attempts', 1) > 1:
+            notified = await self.db.get_notified_users(
+                event['id'], [subscriber.user_id for subscriber in subscribers]
+            )
+        reserved = await self.db.reserve_notifications(event['id'], [
+            subscriber.user_id for subscriber in subscribers
+            if subscriber.user_id not in notified
+        ])
+        skipped = len(subscribers) - len(reserved)
+        if not skipped:
+            return subscribers
+        metrics.notifications_deduplicated.inc(skipped)
+        logger.info(f"Skipping {skipped} users already notified of event {event['id']}")
+        return [subscriber for subscriber in subscribers if subscriber.user_id in reserved]
+
+    async def _hold_back(self, subscribers: List[Subscriber], event_id: int,
+                         message: RenderedMessage, lane: int) -> List[Subscriber]:
+        """
+        Buffer notifications of digest-mode subscribers and defer those
+        falling into the recipient's quiet hours (urgent events are sent
+        regardless).
+
+        Returns:
+            Subscribers to notify right away
+        """
+        instant = [subscriber for subscriber in subscribers if not subscriber.digest]
+        if len(instant) < len(subscribers):
+            await self._buffer_digest(
+                [subscriber for subscriber in subscribers if subscriber.digest],
+                event_id, message
+            )
+        if lane == priority_rank("urgent"):
+            return instant
+
+        now = time.time()
+        send_now, deferred = [], []
+        for subscriber in instant:
+            release_at = subscriber.window.release_at(now) if subscriber.window else None
+            if release_at is None:
+                send_now.append(subscriber)
+            else:
+                deferred.append((subscriber, release_at))
+        if deferred:
+            await self._defer(deferred, event_id, message)
+        return send_now
+
+    async def _defer(self, deferred: List[Tuple[Subscriber, float]], event_id: int,
+                     message: RenderedMessage):
+        """Persist notifications until quiet hours end and schedule their release."""
+        item_ids = await self.db.add_deferred_notifications([
+            (
+                subscriber.user_id, event_id, subscriber.telegram_id,
+                message.personalize(subscriber) if message.is_personalized else message.text,
+                release_at
+            )
+            for subscriber, release_at in deferred
+        ])
+        earliest = self.deferred.next_at
+        for (_, release_at), item_id in zip(deferred, item_ids):
+            self.deferred.push(release_at, item_id)
+        metrics.notifications_deferred.inc(len(item_ids))
+
+        self.start_deferred_release()
+        if earliest is None or self.deferred.next_at < earliest:
+            self._deferred_changed.set()
+
+    def start_deferred_release(self):
+        """Start the timer releasing deferred notifications (no-op if running)."""
+        if self._release_timer is None or self._release_timer.done():
+            self._release_timer = asyncio.create_task(self._run_release_timer())
+
+    async def _run_release_timer(self):
+        """Sleep until the earliest deferred notification is due, then release."""
+        if not self._deferred_loaded:
+            # Items deferred before a restart
+            for item_id, release_at in await self.db.get_deferred_schedule():
+                self.deferred.push(release_at, item_id)
+            self._deferred_loaded = True
+            logger.info(f"Loaded {len(self.deferred)} deferred notifications")
+
+        while True:
+            next_at = self.deferred.next_at
+            timeout = self.deferred_sweep_interval
+            if next_at is not None:
+                timeout = min(max(0.0, next_at - time.time()), timeout)
+            self._deferred_changed.clear()
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._deferred_changed.wait(), timeout)
+            try:
+                await self.release_deferred()
+            except Exception as e:
+                logger.error(f"Failed to release deferred notifications: {e}")
+
+    async def release_deferred(self) -> int:
+        """
+        Send deferred notifications whose quiet hours are over.
+
+        Due items come off the in-memory schedule and are claimed by id in
+        batches of deferred_batch_size, so workers sharing the database
+        never send an item twice. Every deferred_sweep_interval the table
+        is also checked for due items scheduled by workers that are gone.
+
+        Returns:
+            Number of notifications released
+        """
+        released = 0
+        while True:
+            item_ids = self.deferred.pop_due(time.time(), self.deferred_batch_size)
+            if not item_ids:
+                break
+            released += await self._release(await self.db.claim_deferred_notifications(item_ids))
+
+        if time.monotonic() - self._last_sweep >= self.deferred_sweep_interval:
+            self._last_sweep = time.monotonic()
+            while True:
+                rows = await self.db.claim_due_deferred_notifications(self.deferred_batch_size)
+                released += await self._release(rows)
+                if len(rows) < self.deferred_batch_size:
+                    break
+        return released
+
+    async def _release(self, rows: List[Dict[str, Any]]) -> int:
+        """Deliver claimed deferred notifications and wait for the sends."""
+        if not rows:
+            return 0
+        batch = DeliveryBatch()
+        for row in rows:
+            await self.delivery.submit(DeliveryJob(
+                row['chat_id'],
+                row['message'],
+                user_id=row['user_id'],
+                event_id=row['event_id'],
+                batch=batch
+            ))
+        await batch.wait()
+        logger.info(f"Released {batch.total} deferred notifications ({batch.failed} failed)")
+        await self._deactivate_unreachable()
+        return len(rows)
+
+    def _render_message(self, event: Dict[str, Any], event_data: Dict[str, Any]) -> RenderedMessage:
+        """
+        Render event message for all recipients.
+
+        Uses the event type's template if it has one, otherwise _format_message().
+        """
+        template = self.templates.get(event['event_type_id'], event.get('event_template'))
+        if template is not None:
+            return template.render(event['event_name'], event_data)
+        return RenderedMessage(self._format_message(event['event_name'], event_data))
+
+    async def _send_notification(self, subscriber: Subscriber, event_id: int,
+                                  message: RenderedMessage,
+                                  batch: Optional[DeliveryBatch] = None,
+                                  lane: int = priority_rank(DEFAULT_PRIORITY)):
+        """Queue notification to a single subscriber in its event's priority lane."""
+        if subscriber.user_id in self._unreachable:
             return
+        text = message.personalize(subscriber) if message.is_personalized else message.text
 
-        # Send notifications to matching subscribers
-        tasks = []
-        for subscriber in subscribers:
-            # Check if conditions match
-            if self.condition_checker.check(event_data, subscriber['conditions']):
-                task = self._send_notification(
-                    subscriber,
-                    event_id,
-                    event['event_name'],
-                    event_data
+        await self.delivery.submit(DeliveryJob(
+            subscriber.telegram_id,
+            text,
+            user_id=subscriber.user_id,
+            event_id=event_id,
+            batch=batch,
+            lane=lane
+        ))
+
+    def _observe_dispatch_lag(self, event: Dict[str, Any]):
+        """Record time since the event was created (created_at is UTC)."""
+        created_at = event.get('created_at')
+        if not isinstance(created_at, datetime):
+            # SQLite returns timestamps as text
+            try:
+                created_at = datetime.fromisoformat(created_at)
+            except (TypeError, ValueError):
+                return
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        metrics.dispatch_lag.observe(max(0.0, (now - created_at).total_seconds()))
+
+    async def collect_metrics(self):
+        """Refresh backlog gauges (called periodically by the metrics server)."""
+        metrics.pending_events.set(await self.db.count_pending_events())
+        retry_counts = await self.db.get_retry_counts()
+        for status in ("pending", "dead"):
+            metrics.pending_retries.labels(status=status).set(retry_counts.get(status, 0))
+        metrics.pending_digest_items.set(len(self.digests))
+        metrics.deferred_notifications.set(len(self.deferred))
+        metrics.delivery_queue_depth.set(self.delivery.queue.qsize())
+        for lane, depth in self.delivery.queue.get_depths().items():
+            metrics.delivery_lane_depth.labels(lane=lane).set(depth)
+        metrics.claim_batch_size.set(self.batch_size.size)
+        if self.shard_pool is not None:
+            for shard, depth in enumerate(self.shard_pool.get_depths()):
+                metrics.shard_queue_depth.labels(shard=str(shard)).set(depth)
+        metrics.db_write_queue_depth.set(self.db.write_batcher.depth)
+
+    async def _buffer_digest(self, subscribers: List[Subscriber], event_id: int,
+                             message: RenderedMessage):
+        """Hold notifications back for the next digest."""
+        texts = [
+            message.personalize(subscriber) if message.is_personalized else message.text
+            for subscriber in subscribers
+        ]
+        # Persisted before the event is marked processed, so nothing is lost on restart
+        item_ids = await self.db.add_digest_items([
+            (subscriber.user_id, event_id, text)
+            for subscriber, text in zip(subscribers, texts)
+        ])
+        for subscriber, item_id, text in zip(subscribers, item_ids, texts):
+            self.digests.add(
+                subscriber.user_id,
+                subscriber.telegram_id,
+                DigestItem(item_id, event_id, text)
+            )
+
+    async def flush_digests(self):
+        """
+        Send buffered digest items, one combined message per user.
+
+        Items left in the database by a previous run are picked up on the
+        first flush. Each item is claimed before sending, so workers sharing
+        the database never send it twice.
+        """
+        if not self._digests_loaded:
+            for row in await self.db.get_digest_items():
+                self.digests.add(
+                    row['user_id'],
+                    row['telegram_id'],
+                    DigestItem(row['id'], row['event_id'], row['message'])
                 )
-                tasks.append(task)
+            self._digests_loaded = True
 
-        # Send all notifications concurrently
-        if tasks:
-            await asyncio.gather(*tasks, return_exceptions=True)
-            logger.info(f"Sent {len(tasks)} notifications for event {event_id}")
+        pending = self.digests.take()
+        if not pending:
+            return
 
-    async def _send_notification(self, subscriber: Dict[str, Any], event_id: int,
-                                  event_name: str, event_data: Dict[str, Any]):
-        """Send notification to a single subscriber."""
-        user_id = subscriber['user_id']
-        telegram_id = subscriber['telegram_id']
+        claimed = set(await self.db.claim_digest_items([
+            item.item_id for _, items in pending.values() for item in items
+        ]))
 
-        # Format message
-        message = self._format_message(event_name, event_data)
+        batch = DeliveryBatch()
+        for user_id, (telegram_id, items) in pending.items():
+            items = [item for item in items if item.item_id in claimed]
+            if not items:
+                continue
+            for text, chunk in format_digest(items):
+                await self.delivery.submit(
+                    DigestJob(telegram_id, text, chunk, user_id=user_id, batch=batch)
+                )
 
-        try:
-            # Send message via Telegram
-            await self.bot.send_message(telegram_id, message, parse_mode="HTML")
+        if batch.total:
+            await batch.wait()
+            logger.info(
+                f"Sent {batch.sent} digests with {len(claimed)} notifications"
+                f" ({batch.failed} failed)"
+            )
+            await self._deactivate_unreachable()
+
+    async def process_retries(self):
+        """
+        Re-send due notifications from the retry queue.
+
+        Retries are claimed in pages of retry_batch_size and each page is
+        delivered before the next is claimed, so fresh notifications keep
+        getting queue slots while a backlog drains.
+        """
+        while True:
+            retries = await self.db.claim_retries(
+                limit=self.retry_batch_size, lease_seconds=self.lease_seconds
+            )
+            if not retries:
+                return
 
-            # Log to database
-            await self.db.add_notification(user_id, event_id, message, status='sent')
-            logger.info(f"Sent notification to user {telegram_id}")
+            batch = DeliveryBatch()
+            for retry in retries:
+                await self.delivery.submit(RetryJob(
+                    retry['id'],
+                    retry['chat_id'],
+                    retry['message'],
+                    retry['attempts'],
+                    user_id=retry['user_id'],
+                    event_id=retry['event_id'],
+                    batch=batch
+                ))
+            await batch.wait()
+            logger.info(f"Retried {batch.total} notifications ({batch.failed} failed again)")
+            await self._deactivate_unreachable()
 
+            if len(retries) < self.retry_batch_size:
+                return
+
+    async def _deactivate_unreachable(self):
+        """Deactivate users collected from permanent send errors in one write."""
+        if not self._unreachable:
+            return
+        user_ids = list(self._unreachable)
+        try:
+            deactivated = await self.db.deactivate_users(user_ids)
         except Exception as e:
-            # Log error to database
-            await self.db.add_notification(
-                user_id, event_id, message,
-                status='failed', error_message=str(e)
+            logger.error(f"Failed to deactivate unreachable users: {e}")
+            return
+        self._unreachable.difference_update(user_ids)
+        if deactivated:
+            logger.info(f"Deactivated {len(deactivated)} unreachable users")
+
+    def _mark_unreachable(self, user_id: int):
+        """Stop sending to a user until they are deactivated."""
+        self._unreachable.add(user_id)
+        self.digests.discard_user(user_id)
+
+    async def _schedule_retry(self, job: DeliveryJob, error: Exception, retry: bool = True):
+        """Queue failed notification for retry, or log it as failed for good."""
+        failures = job.failures + 1 if isinstance(job, RetryJob) else 1
+        next_attempt_at = None
+        if retry and self.retry_policy.should_retry(failures):
+            delay = self.retry_policy.next_delay(failures, getattr(error, "retry_after", None))
+            next_attempt_at = time.time() + delay
+
+        if isinstance(job, RetryJob):
+            await self.db.reschedule_retry(job.retry_id, failures, next_attempt_at, str(error))
+        elif next_attempt_at is not None:
+            await self.db.add_retry(
+                job.user_id, job.event_id, job.chat_id, job.text,
+                next_attempt_at, str(error)
+            )
+
+        error_class = classify_error(error)
+        if next_attempt_at is None:
+            metrics.notifications_failed.labels(error_class=error_class).inc()
+            # Dead-lettered: kept in notification_retries with status 'dead'
+            await self.db.queue_notification(
+                job.user_id, job.event_id, job.text,
+                status='failed', error_message=str(error)
+            )
+            logger.error(
+                f"Failed to send notification to user {job.chat_id}"
+                f" after {failures} attempts: {error}"
+            )
+        else:
+            metrics.notifications_retried.labels(error_class=error_class).inc()
+            logger.warning(
+                f"Failed to send notification to user {job.chat_id}, retry"
+                f" #{failures} in {next_attempt_at - time.time():.0f}s: {error}"
             )
-            logger.error(f"Failed to send notification to user {telegram_id}: {e}")
+
+    async def _on_delivery_result(self, job: DeliveryJob, error: Optional[Exception]):
+        """
+        Log delivery outcome to history.
+
+        Transient failures are retried; chats that are gone for good
+        (blocked bot, deleted account) get their user deactivated.
+        """
+        error_class = ERROR_TRANSIENT if error is None else classify_error(error)
+        if error_class == ERROR_UNREACHABLE:
+            self._mark_unreachable(job.user_id)
+        if error is None:
+            metrics.notifications_sent.inc(len(job.items) if isinstance(job, DigestJob) else 1)
+
+        if isinstance(job, DigestJob):
+            if error is None or error_class != ERROR_TRANSIENT:
+                status = 'sent' if error is None else 'failed'
+                error_message = None if error is None else str(error)
+                for item in job.items:
+                    await self.db.queue_notification(
+                        job.user_id, item.event_id, item.text,
+                        status=status, error_message=error_message
+                    )
+                if error is not None:
+                    metrics.notifications_failed.labels(error_class=error_class).inc(len(job.items))
+                    logger.error(f"Failed to send digest to user {job.chat_id}: {error}")
+            else:
+                metrics.notifications_retried.labels(error_class=error_class).inc(len(job.items))
+                # Put the items back into the next digest
+                item_ids = await self.db.add_digest_items([
+                    (job.user_id, item.event_id, item.text) for item in job.items
+                ])
+                for item, item_id in zip(job.items, item_ids):
+                    self.digests.add(
+                        job.user_id, job.chat_id, DigestItem(item_id, item.event_id, item.text)
+                    )
+                logger.warning(f"Failed to send digest to user {job.chat_id}, requeued: {error}")
+            return
+
+        if error is None:
+            if isinstance(job, RetryJob):
+                await self.db.complete_retry(job.retry_id)
+            await self.db.queue_notification(job.user_id, job.event_id, job.text, status='sent')
+            logger.info(f"Sent notification to user {job.chat_id}")
+        else:
+            await self._schedule_retry(job, error, retry=error_class == ERROR_TRANSIENT)
 
     def _format_message(self, event_name: str, event_data: Dict[str, Any]) -> str:
         """
         Format event data into readable message.
-        Override this method for custom formatting.
+        Used for event types without a template; override for custom formatting.
         """
         message = f"<b>🔔 {event_name}</b>\n\n"
 
@@ -134,25 +1113,88 @@ class NotificationService:
 
         return message
 
-    async def start_polling(self, interval: int = 5):
+    async def start_polling(self, interval: float = 5, min_interval: float = 0.1):
         """
-        Start polling for unprocessed events.
+        Process events as they are signalled, with an adaptive fallback poll.
+
+        Wakes right away on wake() and, with PostgreSQL, on inserts by any
+        process. Otherwise polls after min_interval while events keep
+        coming and backs off to `interval` when idle; idle polls are a
+        single cheap read.
 
         Args:
-            interval: Polling interval in seconds
+            interval: Longest wait between polls in seconds
+            min_interval: Wait between polls while there is a backlog
         """
         self.is_running = True
-        logger.info(f"Started event polling (interval: {interval}s)")
+        if not self._listening:
+            self._listening = await self.db.listen_events(lambda: self.wake("database"))
+        pacing = AdaptiveInterval(min_interval, interval)
+        logger.info(
+            f"Started event polling (interval: {min_interval}-{interval}s,"
+            f" database notifications: {'on' if self._listening else 'off'})"
+        )
 
+        delay = 0.0
         while self.is_running:
             try:
-                await self.process_events()
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self.is_running:
+                break
+
+            claimed = 0
+            try:
+                if await self.db.has_pending_events(self._owned_event_types):
+                    claimed = await self.process_events()
             except Exception as e:
                 logger.error(f"Error in polling loop: {e}")
 
-            await asyncio.sleep(interval)
+            delay = pacing.update(claimed)
+            metrics.poll_interval.set(delay)
+
+    def wake(self, source: str = "signal"):
+        """
+        Process pending events now instead of at the next poll.
+
+        Call after writing events to the database without create_event().
+
+        Args:
+            source: What signalled new events (metrics label)
+        """
+        metrics.event_wakeups.labels(source=source).inc()
+        self._wakeup.set()
 
     def stop_polling(self):
         """Stop polling for events."""
         self.is_running = False
+        self._wakeup.set()
         logger.info("Stopped event polling")
+
+    async def close(self):
+        """Dispatch published events, deliver queued messages and stop workers."""
+        await self.event_bus.stop()
+        await self._drain_shards()
+        if self.shard_pool is not None:
+            await self.shard_pool.stop()
+        await self.lane_pool.stop()
+        if self._release_timer is not None:
+            self._release_timer.cancel()
+            await asyncio.gather(self._release_timer, return_exceptions=True)
+            self._release_timer = None
+        await self.delivery.stop()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            await asyncio.gather(self._heartbeat, return_exceptions=True)
+            self._heartbeat = None
+        if self._membership is not None:
+            self._membership.cancel()
+            await asyncio.gather(self._membership, return_exceptions=True)
+            self._membership = None
+            try:
+                # Other processes take over our event types right away
+                await self.db.remove_worker(self.worker_id)
+            except Exception as e:
+                logger.error(f"Failed to unregister worker {self.worker_id}: {e}")
@@ -0,0 +1,75 @@
+"""Adaptive pacing of event polling and claim batch sizes."""
+from typing import Optional
+
+
+class AdaptiveInterval:
+    """
+    Fallback poll interval that follows the backlog.
+
+    While polls find events the next poll comes after min_interval; each
+    idle poll doubles the wait up to max_interval, so an idle worker
+    costs one cheap query every max_interval.
+    """
+
+    def __init__(self, min_interval: float = 0.1, max_interval: float = 5.0,
+                 backoff: float = 2.0):
+        self.min_interval = min(min_interval, max_interval)
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.current = self.min_interval
+
+    def update(self, backlog: int) -> float:
+        """
+        Get the wait before the next poll.
+
+        Args:
+            backlog: Events found by the last poll
+
+        Returns:
+            Seconds to wait
+        """
+        if backlog:
+            self.current = self.min_interval
+        else:
+            self.current = min(self.current * self.backoff, self.max_interval)
+        return self.current
+
+
+class AdaptiveBatchSize:
+    """
+    Claim page size tuned to observed throughput.
+
+    Pages are sized to take about target_seconds to process: cheap events
+    are claimed in large pages (fewer claim transactions), large
+    broadcasts in small ones (short leases in flight, fast hand-over to
+    other workers). Throughput is smoothed with an exponential average.
+    """
+
+    def __init__(self, initial: int = 100, min_size: int = 10, max_size: int = 1000,
+                 target_seconds: float = 1.0, smoothing: float = 0.3):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.target_seconds = target_seconds
+        self.smoothing = smoothing
+        self.size = max(min_size, min(initial, max_size))
+        self.throughput: Optional[float] = None
+
+    def __call__(self) -> int:
+        return self.size
+
+    def observe(self, events: int, seconds: float):
+        """
+        Record processing of a page and resize the next one.
+
+        Args:
+            events: Events in the page
+            seconds: Time it took to process them
+        """
+        if not events:
+            return
+        rate = events / max(seconds, 1e-6)
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            self.throughput += self.smoothing * (rate - self.throughput)
+        self.size = max(self.min_size, min(int(self.throughput * self.target_seconds), self.max_size))
@@ -0,0 +1,163 @@
+"""Per-user quiet hours and the schedule of notifications deferred past them."""
+import heapq
+import logging
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEZONE = "UTC"
+
+
+def parse_quiet_hours(spec: str) -> Tuple[int, int]:
+    """
+    Parse quiet hours like "22:00-08:00".
+
+    Returns:
+        Start and end as minutes after local midnight
+
+    Raises:
+        ValueError: If spec is malformed
+    """
+    try:
+        start, end = (
+            datetime.strptime(part.strip(), "%H:%M") for part in spec.split("-")
+        )
+    except ValueError:
+        raise ValueError(f"Quiet hours must look like 22:00-08:00, got: {spec}")
+    return start.hour * 60 + start.minute, end.hour * 60 + end.minute
+
+
+def format_quiet_hours(quiet_start: int, quiet_end: int) -> str:
+    """Format quiet hours as "22:00-08:00"."""
+    return f"{quiet_start // 60:02d}:{quiet_start % 60:02d}-{quiet_end // 60:02d}:{quiet_end % 60:02d}"
+
+
+def validate_timezone(timezone: str) -> str:
+    """
+    Check an IANA timezone name (e.g. Europe/Moscow).
+
+    Raises:
+        ValueError: If the timezone is unknown
+    """
+    try:
+        ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {timezone}")
+    return timezone
+
+
+class DeliveryWindow:
+    """
+    Quiet hours of a user in their local time.
+
+    The window may wrap midnight (22:00-08:00). Local times are resolved
+    through the timezone's rules, so the end of the night follows DST.
+    """
+
+    __slots__ = ("timezone", "quiet_start", "quiet_end", "_zone")
+
+    def __init__(self, timezone: Optional[str], quiet_start: int, quiet_end: int):
+        self.timezone = timezone or DEFAULT_TIMEZONE
+        self.quiet_start = quiet_start
+        self.quiet_end = quiet_end
+        try:
+            self._zone = ZoneInfo(self.timezone)
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning(f"Unknown timezone {self.timezone}, using {DEFAULT_TIMEZONE}")
+            self._zone = ZoneInfo(DEFAULT_TIMEZONE)
+
+    def is_quiet(self, minute: int) -> bool:
+        """Whether a local minute of the day falls into quiet hours."""
+        if self.quiet_start <= self.quiet_end:
+            return self.quiet_start <= minute < self.quiet_end
+        return minute >= self.quiet_start or minute < self.quiet_end
+
+    def release_at(self, now: float) -> Optional[float]:
+        """
+        Get when a notification due now may be sent.
+
+        Args:
+            now: Unix time
+
+        Returns:
+            Unix time at which quiet hours end, or None outside quiet hours
+        """
+        local = datetime.fromtimestamp(now, self._zone)
+        if not self.is_quiet(local.hour * 60 + local.minute):
+            return None
+        end = local.replace(
+            hour=self.quiet_end // 60, minute=self.quiet_end % 60, second=0, microsecond=0
+        )
+        if end <= local:
+            end += timedelta(days=1)
+        return end.timestamp()
+
+
+@lru_cache(maxsize=4096)
+def get_window(timezone: Optional[str], quiet_start: Optional[int],
+               quiet_end: Optional[int]) -> Optional[DeliveryWindow]:
+    """
+    Get the shared window of a (timezone, quiet hours) setting.
+
+    Users with the same setting share one object, so rosters of millions
+    of users hold a handful of windows.
+
+    Returns:
+        Window, or None if the user has no quiet hours
+    """
+    if quiet_start is None or quiet_end is None or quiet_start == quiet_end:
+        return None
+    return DeliveryWindow(timezone, quiet_start, quiet_end)
+
+
+class DeferredSchedule:
+    """
+    Min-heap of release times of deferred notifications.
+
+    Mirrors the deferred_notifications table, which holds the messages:
+    pushing costs O(log n) and the next release time is read in O(1), so
+    the release timer sleeps until the earliest window opens instead of
+    querying the table on every tick. Pushing an item that is already
+    scheduled is a no-op, so the table can be reloaded at any time.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int]] = []
+        self._ids: set = set()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    @property
+    def next_at(self) -> Optional[float]:
+        """Release time of the earliest item (None when empty)."""
+        return self._heap[0][0] if self._heap else None
+
+    def push(self, release_at: float, item_id: int):
+        """Schedule an item."""
+        if item_id in self._ids:
+            return
+        self._ids.add(item_id)
+        heapq.heappush(self._heap, (release_at, item_id))
+
+    def pop_due(self, now: float, limit: Optional[int] = None) -> List[int]:
+        """
+        Remove items whose release time has come, earliest first.
+
+        Args:
+            now: Unix time
+            limit: Maximum number of items (all due if None)
+
+        Returns:
+            Item IDs
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+            _, item_id = heapq.heappop(self._heap)
+            self._ids.discard(item_id)
+            due.append(item_id)
+        return due
@@ -0,0 +1,81 @@
+"""Retention job for notification history."""
+import asyncio
+import logging
+import time
+from typing import Any, Dict
+
+from ..database.db import Database
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class HistoryRetention:
+    """
+    Keep keep_days of detailed notification history.
+
+    Older rows are rolled up into per-user, per-event-type daily counts
+    and deleted in small batches, each its own short write transaction,
+    with a pause in between so deliveries and bot commands are not held
+    up. Freed pages are then returned with incremental VACUUM.
+    """
+
+    def __init__(self, database: Database, keep_days: int = 30,
+                 batch_size: int = 500, pause: float = 0.05,
+                 vacuum_pages: int = 2000):
+        self.db = database
+        self.keep_days = keep_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self._lock = asyncio.Lock()
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Roll up old history, prune dead retries and fan-out checkpoints and compact the file.
+
+        Returns:
+            Counters of the run
+        """
+        if self._lock.locked():
+            logger.info("History retention already running, skipping")
+            return {}
+
+        async with self._lock:
+            started = time.perf_counter()
+            rolled_up = await self._drain(self.db.rollup_history)
+            retries_pruned = await self._drain(self.db.prune_dead_retries)
+            checkpoints_pruned = await self._drain(self.db.prune_fanout_checkpoints)
+
+            free_pages = previous = None
+            while True:
+                free_pages = await self.db.incremental_vacuum(self.vacuum_pages)
+                if not free_pages or free_pages == previous:
+                    break
+                previous = free_pages
+                await asyncio.sleep(self.pause)
+
+            stats = {
+                "rolled_up": rolled_up,
+                "retries_pruned": retries_pruned,
+                "checkpoints_pruned": checkpoints_pruned,
+                "free_pages": free_pages,
+                "duration_s": round(time.perf_counter() - started, 3),
+            }
+            if free_pages is None:
+                logger.warning(
+                    "Database is not in auto_vacuum=INCREMENTAL mode; freed space is "
+                    "only reused, run Database.enable_incremental_vacuum() once to shrink it"
+                )
+            logger.info(f"History retention finished: {stats}")
+            return stats
+
+    async def _drain(self, step) -> int:
+        """Call a batch step until it has nothing left, pausing between batches."""
+        total = 0
+        while True:
+            count = await step(self.keep_days, self.batch_size)
+            total += count
+            if count < self.batch_size:
+                return total
+            await asyncio.sleep(self.pause)
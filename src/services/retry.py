@@ -0,0 +1,59 @@
+"""Backoff policy and jobs for the durable notification retry queue."""
+import random
+from typing import Optional
+
+from .delivery import DeliveryBatch, DeliveryJob
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with jitter.
+
+    The n-th retry waits base_delay * factor ** (n - 1), capped at
+    max_delay; half of that is randomized so failures from one outage
+    don't come back as a thundering herd. Telegram's retry_after is a
+    lower bound. After max_attempts failed sends the notification is
+    dead-lettered.
+    """
+
+    def __init__(self, base_delay: float = 30.0, factor: float = 2.0,
+                 max_delay: float = 3600.0, max_attempts: int = 6):
+        self.base_delay = base_delay
+        self.factor = factor
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+
+    def should_retry(self, attempts: int) -> bool:
+        """Whether a notification that failed `attempts` times gets another try."""
+        return attempts < self.max_attempts
+
+    def next_delay(self, attempts: int, retry_after: Optional[float] = None) -> float:
+        """
+        Get delay before the next attempt.
+
+        Args:
+            attempts: Failed sends so far (1 after the first failure)
+            retry_after: Delay requested by Telegram, if any
+
+        Returns:
+            Delay in seconds
+        """
+        delay = min(self.max_delay, self.base_delay * self.factor ** (attempts - 1))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
+
+
+class RetryJob(DeliveryJob):
+    """Re-send of a notification from the retry queue."""
+
+    __slots__ = ("retry_id", "failures")
+
+    def __init__(self, retry_id: int, chat_id: int, text: str, failures: int,
+                 user_id: int = None, event_id: int = None,
+                 batch: DeliveryBatch = None):
+        super().__init__(chat_id, text, user_id=user_id, event_id=event_id, batch=batch)
+        self.retry_id = retry_id
+        # Failed sends before this one
+        self.failures = failures
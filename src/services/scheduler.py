@@ -96,7 +96,8 @@ class ScheduledNotificationService:
 
     Supports multiple scheduling strategies:
     - Cron-based scheduling
-    - Interval-based polling
+    - Interval-based polling (NotificationService.start_polling() for
+      wakeups and an adaptive interval)
     - Immediate processing
     """
 
@@ -129,18 +130,65 @@ class ScheduledNotificationService:
         Example:
             service.schedule_interval(300)  # Every 5 minutes
         """
-        # Convert to cron: every N minutes
-        minutes = max(1, interval_seconds // 60)
-        if minutes == 1:
-            cron_expr = "* * * * *"  # Every minute
+        if interval_seconds < 60:
+            # Sub-minute: aiocron takes seconds as a sixth field
+            seconds = max(1, int(interval_seconds))
+            cron_expr = f"* * * * * */{seconds}"
+            period = f"{seconds} second(s)"
         else:
-            cron_expr = f"*/{minutes} * * * *"
+            # Convert to cron: every N minutes
+            minutes = interval_seconds // 60
+            cron_expr = "* * * * *" if minutes == 1 else f"*/{minutes} * * * *"
+            period = f"{minutes} minute(s)"
 
         self.scheduler.add_job(
             cron_expr,
             self.notification_service.process_events
         )
-        logger.info(f"Scheduled processing every {minutes} minute(s)")
+        logger.info(f"Scheduled processing every {period}")
+
+    def schedule_digests(self, cron_expression: str):
+        """
+        Schedule sending of digests for digest-mode subscriptions.
+
+        Args:
+            cron_expression: Digest window as cron expression
+
+        Example:
+            service.schedule_digests('0 * * * *')  # Hourly digests
+        """
+        self.scheduler.add_job(
+            cron_expression,
+            self.notification_service.flush_digests
+        )
+
+    def schedule_retries(self, cron_expression: str = "* * * * *"):
+        """
+        Schedule draining of the notification retry queue.
+
+        Args:
+            cron_expression: How often to look for due retries
+
+        Example:
+            service.schedule_retries('* * * * *')  # Every minute
+        """
+        self.scheduler.add_job(
+            cron_expression,
+            self.notification_service.process_retries
+        )
+
+    def schedule_retention(self, cron_expression: str, retention):
+        """
+        Schedule notification history retention.
+
+        Args:
+            cron_expression: When to run retention
+            retention: HistoryRetention instance
+
+        Example:
+            service.schedule_retention('30 3 * * *', HistoryRetention(db))  # Daily at 3:30 AM
+        """
+        self.scheduler.add_job(cron_expression, retention.run)
 
     def schedule_multiple(self, schedules: List[str]):
         """
@@ -0,0 +1,148 @@
+"""Partitioning of event processing across shard workers."""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Partition keys: all events of an event type go to one shard, or every
+# event is split by recipient so each user's messages go to one shard
+PARTITION_EVENT_TYPE = "event_type"
+PARTITION_USER = "user"
+PARTITION_KEYS = (PARTITION_EVENT_TYPE, PARTITION_USER)
+
+_MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash of an integer key into range(buckets).
+
+    Going from n to n + 1 buckets moves only 1/(n + 1) of the keys, all
+    into the new bucket, so a resize keeps most assignments in place.
+    Unlike hash() it is the same in every process.
+    """
+    key &= _MASK_64
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & _MASK_64
+        jump = int((bucket + 1) * (2147483648.0 / ((key >> 33) + 1)))
+    return bucket
+
+
+class ShardMap:
+    """Key to shard assignment, cached until the number of shards changes."""
+
+    def __init__(self, shards: int):
+        self.shards = shards
+        self._assignments: Dict[int, int] = {}
+
+    def shard_of(self, key: int) -> int:
+        shard = self._assignments.get(key)
+        if shard is None:
+            shard = self._assignments[key] = jump_hash(key, self.shards)
+        return shard
+
+    def resize(self, shards: int):
+        self.shards = shards
+        self._assignments.clear()
+
+
+class ShardPool:
+    """
+    One worker task per shard, each draining its own FIFO queue.
+
+    Work submitted to a shard runs strictly in submission order, so
+    everything keyed to one shard (an event type's events, a user's
+    messages) keeps its order while other shards proceed independently.
+    A full queue makes submit() wait, which throttles the producer.
+    """
+
+    def __init__(self, shards: int, queue_size: int = 100):
+        self.shards = shards
+        self.queue_size = queue_size
+        self.queues: List[asyncio.Queue] = []
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self):
+        """Start one worker task per shard."""
+        if self._tasks:
+            return
+        self.queues = [asyncio.Queue(maxsize=self.queue_size) for _ in range(self.shards)]
+        self._tasks = [
+            asyncio.create_task(self._worker(queue), name=f"shard-worker-{shard}")
+            for shard, queue in enumerate(self.queues)
+        ]
+        logger.info(f"Started {self.shards} shard workers")
+
+    async def stop(self):
+        """Finish submitted work and stop worker tasks."""
+        if not self._tasks:
+            return
+        await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info("Stopped shard workers")
+
+    async def submit(self, shard: int, func: Callable[..., Awaitable[Any]],
+                     *args) -> asyncio.Future:
+        """
+        Queue `func(*args)` on a shard.
+
+        Returns:
+            Future with the result of the call
+        """
+        if not self._tasks:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queues[shard].put((func, args, future))
+        return future
+
+    async def join(self):
+        """Wait until all submitted work is done."""
+        for queue in self.queues:
+            await queue.join()
+
+    def get_depths(self) -> List[int]:
+        """Get number of queued work items per shard."""
+        return [queue.qsize() for queue in self.queues]
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            func, args, future = await queue.get()
+            try:
+                result = await func(*args)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                queue.task_done()
+
+
+def owned_keys(keys: List[int], members: List[str], member: str) -> Optional[List[int]]:
+    """
+    Get keys a member owns when keys are split between live members.
+
+    Args:
+        keys: All keys (e.g. event type IDs)
+        members: Live member IDs
+        member: Member to get the keys of
+
+    Returns:
+        Keys owned by member, or None if it is not a live member
+    """
+    members = sorted(members)
+    if member not in members:
+        return None
+    return [key for key in keys if members[jump_hash(key, len(members))] == member]
@@ -0,0 +1,360 @@
+"""In-memory subscriber roster with a predicate index over subscription conditions."""
+from bisect import bisect_left, bisect_right
+from typing import Dict, Any, List, Optional, Set, Tuple, Callable
+
+from .condition_checker import ConditionChecker, CompiledCondition
+from .quiet_hours import DeliveryWindow
+
+# Operators answered from hash buckets / sorted threshold arrays
+EQUALITY_OPERATORS = ("==", "in")
+THRESHOLD_OPERATORS = (">", ">=", "<", "<=")
+
+# Anchor kinds
+_UNCONDITIONAL = "unconditional"
+_FALLBACK = "fallback"
+_EQUALITY = "equality"
+_THRESHOLD = "threshold"
+
+
+class Subscriber:
+    """Compact roster record of one active subscription."""
+
+    __slots__ = ("subscription_id", "user_id", "telegram_id", "condition",
+                 "first_name", "last_name", "username", "digest", "window")
+
+    def __init__(self, subscription_id: int, user_id: int, telegram_id: int,
+                 condition: CompiledCondition, first_name: str = None,
+                 last_name: str = None, username: str = None,
+                 digest: bool = False, window: Optional[DeliveryWindow] = None):
+        self.subscription_id = subscription_id
+        self.user_id = user_id
+        self.telegram_id = telegram_id
+        self.condition = condition
+        # Matches are buffered and sent as a periodic digest
+        self.digest = digest
+        # Quiet hours of the user (shared between users, see get_window)
+        self.window = window
+        # Used by {user.*} template placeholders
+        self.first_name = first_name
+        self.last_name = last_name
+        self.username = username
+
+
+class ThresholdList:
+    """Sorted thresholds of one (field, operator) pair with parallel subscription ids."""
+
+    __slots__ = ("values", "ids")
+
+    def __init__(self):
+        self.values: List[float] = []
+        self.ids: List[int] = []
+
+    def add(self, threshold: float, subscription_id: int):
+        """Insert threshold keeping arrays sorted."""
+        position = bisect_right(self.values, threshold)
+        self.values.insert(position, threshold)
+        self.ids.insert(position, subscription_id)
+
+    def remove(self, threshold: float, subscription_id: int):
+        """Remove threshold entry of a subscription."""
+        position = bisect_left(self.values, threshold)
+        end = bisect_right(self.values, threshold)
+        while position < end:
+            if self.ids[position] == subscription_id:
+                del self.values[position]
+                del self.ids[position]
+                return
+            position += 1
+
+    def matching(self, operator: str, actual: float) -> List[int]:
+        """Get ids whose rule `actual <operator> threshold` holds."""
+        if operator == ">":
+            return self.ids[:bisect_left(self.values, actual)]
+        elif operator == ">=":
+            return self.ids[:bisect_right(self.values, actual)]
+        elif operator == "<":
+            return self.ids[bisect_right(self.values, actual):]
+        else:
+            return self.ids[bisect_left(self.values, actual):]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+
+class EventTypeIndex:
+    """
+    Subscription index for a single event type.
+
+    Every subscription is anchored on at most one top-level rule of an
+    "and" group: equality/`in` rules go to hash buckets keyed by field
+    value, numeric comparisons go to sorted threshold arrays. An event
+    only visits subscriptions whose anchor can match; the rest of their
+    rules are then checked with the compiled condition. Subscriptions
+    without an indexable rule (`contains`, `ends_with`, "or" groups...)
+    are evaluated on every event as before.
+    """
+
+    def __init__(self, event_type_id: int):
+        self.event_type_id = event_type_id
+        self.subscribers: Dict[int, Subscriber] = {}
+        self._by_user: Dict[int, int] = {}
+        self._anchors: Dict[int, Tuple] = {}
+        self._unconditional: Set[int] = set()
+        self._fallback: Set[int] = set()
+        self._equality: Dict[str, Dict[Any, Set[int]]] = {}
+        self._thresholds: Dict[Tuple[str, str], ThresholdList] = {}
+        self._getters: Dict[str, Callable[[Dict[str, Any]], Any]] = {}
+
+    def add(self, subscriber: Subscriber):
+        """Add or replace subscriber."""
+        subscription_id = subscriber.subscription_id
+        if subscription_id in self.subscribers:
+            self.remove(subscription_id)
+
+        self.subscribers[subscription_id] = subscriber
+        self._by_user[subscriber.user_id] = subscription_id
+
+        anchor = self._choose_anchor(subscriber.condition)
+        self._anchors[subscription_id] = anchor
+        kind = anchor[0]
+
+        if kind == _UNCONDITIONAL:
+            self._unconditional.add(subscription_id)
+        elif kind == _FALLBACK:
+            self._fallback.add(subscription_id)
+        elif kind == _EQUALITY:
+            _, field, values = anchor
+            self._register_field(field)
+            buckets = self._equality.setdefault(field, {})
+            for value in values:
+                buckets.setdefault(value, set()).add(subscription_id)
+        else:
+            _, field, operator, threshold = anchor
+            self._register_field(field)
+            self._thresholds.setdefault((field, operator), ThresholdList()).add(
+                threshold, subscription_id
+            )
+
+    def remove(self, subscription_id: int):
+        """Remove subscriber if indexed."""
+        subscriber = self.subscribers.pop(subscription_id, None)
+        if subscriber is None:
+            return
+        if self._by_user.get(subscriber.user_id) == subscription_id:
+            del self._by_user[subscriber.user_id]
+        anchor = self._anchors.pop(subscription_id)
+        kind = anchor[0]
+
+        if kind == _UNCONDITIONAL:
+            self._unconditional.discard(subscription_id)
+        elif kind == _FALLBACK:
+            self._fallback.discard(subscription_id)
+        elif kind == _EQUALITY:
+            _, field, values = anchor
+            buckets = self._equality.get(field, {})
+            for value in values:
+                bucket = buckets.get(value)
+                if bucket is not None:
+                    bucket.discard(subscription_id)
+                    if not bucket:
+                        del buckets[value]
+        else:
+            _, field, operator, threshold = anchor
+            thresholds = self._thresholds.get((field, operator))
+            if thresholds is not None:
+                thresholds.remove(threshold, subscription_id)
+
+    def remove_user(self, user_id: int):
+        """Remove subscription of a user if indexed."""
+        subscription_id = self._by_user.get(user_id)
+        if subscription_id is not None:
+            self.remove(subscription_id)
+
+    def match(self, event_data: Dict[str, Any]) -> List[Subscriber]:
+        """
+        Get subscribers whose conditions match event data.
+
+        Args:
+            event_data: Event data dictionary
+
+        Returns:
+            Matching subscribers
+        """
+        return self.match_with_count(event_data)[0]
+
+    def match_with_count(self, event_data: Dict[str, Any]) -> Tuple[List[Subscriber], int]:
+        """
+        Get subscribers whose conditions match event data.
+
+        Args:
+            event_data: Event data dictionary
+
+        Returns:
+            Matching subscribers and the number of conditions evaluated
+            (candidates the index did not rule out; subscriptions without
+            conditions match without evaluation)
+        """
+        subscribers = self.subscribers
+
+        matched = [subscribers[subscription_id] for subscription_id in self._unconditional]
+        evaluated = 0
+
+        for subscription_id in self._candidates(event_data):
+            subscriber = subscribers[subscription_id]
+            evaluated += 1
+            if subscriber.condition.evaluate(event_data):
+                matched.append(subscriber)
+
+        return matched, evaluated
+
+    def _candidates(self, event_data: Dict[str, Any]):
+        """Yield ids of subscriptions whose anchor rule can match."""
+        yield from self._fallback
+
+        values: Dict[str, Any] = {
+            field: getter(event_data) for field, getter in self._getters.items()
+        }
+
+        for field, buckets in self._equality.items():
+            actual = values[field]
+            if actual is None:
+                continue
+            try:
+                bucket = buckets.get(actual)
+            except TypeError:
+                continue
+            if bucket:
+                yield from bucket
+
+        for (field, operator), thresholds in self._thresholds.items():
+            actual = values[field]
+            if actual is None or not thresholds:
+                continue
+            try:
+                actual = float(actual)
+            except (ValueError, TypeError):
+                continue
+            if actual != actual:
+                continue
+            yield from thresholds.matching(operator, actual)
+
+    def _register_field(self, field: str):
+        if field not in self._getters:
+            self._getters[field] = ConditionChecker._compile_getter(field)
+
+    @staticmethod
+    def _choose_anchor(condition: CompiledCondition) -> Tuple:
+        """Pick the most selective indexable top-level rule of a condition."""
+        tree = condition.tree
+        if not tree:
+            return (_UNCONDITIONAL,)
+
+        operator = tree.get("operator", "and")
+        rules = tree.get("rules", [])
+        if not rules or operator not in ("and", "or"):
+            return (_UNCONDITIONAL,)
+        if operator == "or" and len(rules) != 1:
+            return (_FALLBACK,)
+
+        threshold_anchor = None
+        for rule in rules:
+            if not isinstance(rule, dict) or "rules" in rule:
+                continue
+            field = rule.get("field")
+            rule_operator = rule.get("operator")
+            expected = rule.get("value")
+            if not field or expected is None:
+                continue
+
+            if rule_operator in EQUALITY_OPERATORS:
+                values = EventTypeIndex._equality_values(rule_operator, expected)
+                if values is not None:
+                    return (_EQUALITY, field, values)
+            elif rule_operator in THRESHOLD_OPERATORS and threshold_anchor is None:
+                threshold = EventTypeIndex._threshold_value(expected)
+                if threshold is not None:
+                    threshold_anchor = (_THRESHOLD, field, rule_operator, threshold)
+
+        return threshold_anchor or (_FALLBACK,)
+
+    @staticmethod
+    def _equality_values(operator: str, expected: Any) -> Optional[Tuple]:
+        """Get hashable bucket keys for an equality/in rule."""
+        if operator == "==":
+            candidates = (expected,)
+        elif isinstance(expected, (list, tuple)):
+            candidates = tuple(expected)
+        else:
+            return None
+
+        try:
+            return tuple(set(candidates))
+        except TypeError:
+            return None
+
+    @staticmethod
+    def _threshold_value(expected: Any) -> Optional[float]:
+        try:
+            threshold = float(expected)
+        except (ValueError, TypeError):
+            return None
+        return threshold if threshold == threshold else None
+
+    def __len__(self) -> int:
+        return len(self.subscribers)
+
+
+class SubscriptionIndex:
+    """Roster of active subscribers per event type, each with its predicate index."""
+
+    def __init__(self):
+        self._indexes: Dict[int, EventTypeIndex] = {}
+
+    def get(self, event_type_id: int) -> Optional[EventTypeIndex]:
+        """Get loaded index for event type."""
+        return self._indexes.get(event_type_id)
+
+    def build(self, event_type_id: int, subscribers: List[Subscriber]) -> EventTypeIndex:
+        """
+        Build index for event type.
+
+        Args:
+            event_type_id: Event type ID
+            subscribers: Active subscribers of the event type
+
+        Returns:
+            Built index
+        """
+        index = EventTypeIndex(event_type_id)
+        for subscriber in subscribers:
+            index.add(subscriber)
+        self._indexes[event_type_id] = index
+        return index
+
+    def upsert(self, event_type_id: int, subscriber: Subscriber):
+        """Add or replace subscriber in a loaded index."""
+        index = self._indexes.get(event_type_id)
+        if index is not None:
+            index.add(subscriber)
+
+    def remove(self, event_type_id: int, subscription_id: int):
+        """Remove subscription from a loaded index."""
+        index = self._indexes.get(event_type_id)
+        if index is not None:
+            index.remove(subscription_id)
+
+    def remove_user(self, user_id: int):
+        """Evict a user from every loaded index."""
+        for index in self._indexes.values():
+            index.remove_user(user_id)
+
+    def discard(self, event_type_id: int):
+        """Drop index of an event type (e.g. no longer handled by this worker)."""
+        self._indexes.pop(event_type_id, None)
+
+    def is_loaded(self, event_type_id: int) -> bool:
+        return event_type_id in self._indexes
+
+    def clear(self):
+        """Drop all indexes; they are rebuilt lazily."""
+        self._indexes.clear()
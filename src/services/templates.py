@@ -0,0 +1,167 @@
+"""Message templates for notifications."""
+import html
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .condition_checker import ConditionChecker
+
+# {price}, {user.first_name}, {event_name}; {{ and }} are literal braces
+_TOKEN = re.compile(r"\{\{|\}\}|\{([A-Za-z_][\w.]*)\}")
+
+# Per-recipient fields available as {user.<field>}
+USER_FIELDS = ("first_name", "last_name", "username", "telegram_id")
+
+
+class RenderedMessage:
+    """
+    Message rendered once per event.
+
+    Event fields are already substituted. If the template has no
+    {user.*} placeholders, `text` is shared by every recipient; otherwise
+    personalize() only joins precomputed segments with the user's fields.
+    """
+
+    __slots__ = ("text", "_segments")
+
+    def __init__(self, text: str, segments: Optional[List[Tuple[str, Optional[str]]]] = None):
+        self.text = text
+        self._segments = segments
+
+    @property
+    def is_personalized(self) -> bool:
+        return self._segments is not None
+
+    def personalize(self, user: Any) -> str:
+        """
+        Get text for a recipient.
+
+        Args:
+            user: Object with USER_FIELDS attributes (e.g. roster Subscriber)
+        """
+        if self._segments is None:
+            return self.text
+
+        parts = []
+        for literal, field in self._segments:
+            parts.append(literal)
+            if field is not None:
+                value = getattr(user, field, None)
+                if value is not None:
+                    parts.append(html.escape(str(value)))
+        return "".join(parts)
+
+
+class MessageTemplate:
+    """
+    Notification template compiled once.
+
+    Syntax (HTML parse mode):
+        <b>{event_name}</b>: {product} now costs {price} {currency}
+        Hi {user.first_name}, order {order.id} is {order.status}
+
+    Event values are HTML-escaped; missing fields render as empty strings.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        # (literal, getter, user_field); getter/user_field are None for the tail
+        self._parts: List[Tuple[str, Optional[Callable], Optional[str]]] = []
+        self.has_user_fields = False
+        self._compile(source)
+
+    def _compile(self, source: str):
+        literal: List[str] = []
+        position = 0
+        for match in _TOKEN.finditer(source):
+            literal.append(source[position:match.start()])
+            position = match.end()
+
+            token = match.group(0)
+            if token == "{{":
+                literal.append("{")
+                continue
+            if token == "}}":
+                literal.append("}")
+                continue
+
+            name = match.group(1)
+            if name.startswith("user.") and name[5:] in USER_FIELDS:
+                self._parts.append(("".join(literal), None, name[5:]))
+                self.has_user_fields = True
+            elif name == "event_name":
+                self._parts.append(("".join(literal), _event_name_getter, None))
+            else:
+                self._parts.append(("".join(literal), _data_getter(name), None))
+            literal = []
+
+        literal.append(source[position:])
+        self._parts.append(("".join(literal), None, None))
+
+    def render(self, event_name: str, event_data: Dict[str, Any]) -> RenderedMessage:
+        """
+        Render event fields once for all recipients.
+
+        Args:
+            event_name: Event type name
+            event_data: Event data dictionary
+
+        Returns:
+            Rendered message
+        """
+        context = (event_name, event_data)
+
+        if not self.has_user_fields:
+            parts = []
+            for literal, getter, _ in self._parts:
+                parts.append(literal)
+                if getter is not None:
+                    parts.append(_escape(getter(context)))
+            return RenderedMessage("".join(parts))
+
+        segments: List[Tuple[str, Optional[str]]] = []
+        pending: List[str] = []
+        for literal, getter, user_field in self._parts:
+            pending.append(literal)
+            if getter is not None:
+                pending.append(_escape(getter(context)))
+            elif user_field is not None:
+                segments.append(("".join(pending), user_field))
+                pending = []
+        segments.append(("".join(pending), None))
+        return RenderedMessage("", segments)
+
+
+class TemplateCache:
+    """Compiled templates keyed by event type id."""
+
+    def __init__(self):
+        self._templates: Dict[int, MessageTemplate] = {}
+
+    def get(self, event_type_id: int, source: Optional[str]) -> Optional[MessageTemplate]:
+        """
+        Get compiled template, compiling on miss or when the source changed.
+
+        Returns:
+            Compiled template, or None if the event type has no template
+        """
+        if not source:
+            self._templates.pop(event_type_id, None)
+            return None
+        template = self._templates.get(event_type_id)
+        if template is None or template.source != source:
+            template = MessageTemplate(source)
+            self._templates[event_type_id] = template
+        return template
+
+
+def _escape(value: Any) -> str:
+    return "" if value is None else html.escape(str(value))
+
+
+def _event_name_getter(context: Tuple[str, Dict[str, Any]]) -> Any:
+    return context[0]
+
+
+def _data_getter(field: str) -> Callable[[Tuple[str, Dict[str, Any]]], Any]:
+    getter = ConditionChecker._compile_getter(field)
+    return lambda context: getter(context[1])
@@ -0,0 +1,49 @@
+"""
+Pytest fixtures для тестов системы уведомлений.
+
+Асинхронный код запускается через asyncio.run() внутри обычных тестов,
+без плагинов pytest.
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+# Добавить корневую папку в PYTHONPATH
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """Путь к файлу SQLite для одного теста."""
+    return str(tmp_path / "notifications.db")
+
+
+async def _reset_postgres(url: str):
+    import asyncpg
+
+    conn = await asyncpg.connect(url)
+    try:
+        await conn.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public")
+    finally:
+        await conn.close()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def database_url(request, db_path):
+    """
+    Адрес базы для тестов, общих для обоих бэкендов.
+
+    PostgreSQL проверяется, только если задан TEST_DATABASE_URL; схема
+    public этой базы пересоздаётся перед каждым тестом, поэтому нужна
+    отдельная тестовая база.
+    """
+    if request.param == "sqlite":
+        return db_path
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL is not set")
+    asyncio.run(_reset_postgres(url))
+    return url
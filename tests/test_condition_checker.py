@@ -0,0 +1,206 @@
+"""
+Unit tests для скомпилированных условий подписок.
+
+Скомпилированные условия должны давать тот же результат, что и
+интерпретатор условий, который был до компиляции (_baseline_check ниже).
+"""
+
+import json
+import random
+from typing import Any, Dict
+
+import pytest
+
+from src.services.condition_checker import ConditionCache, ConditionChecker
+
+
+def _baseline_check(event_data: Dict[str, Any], conditions) -> bool:
+    """Исходный интерпретатор ConditionChecker.check, без изменений."""
+    if not conditions:
+        return True
+    try:
+        condition = json.loads(conditions) if isinstance(conditions, str) else conditions
+    except (json.JSONDecodeError, TypeError):
+        return True
+    return _baseline_condition(event_data, condition)
+
+
+def _baseline_condition(data, condition) -> bool:
+    operator = condition.get("operator", "and")
+    rules = condition.get("rules", [])
+    if not rules:
+        return True
+    results = []
+    for rule in rules:
+        if "rules" in rule:
+            results.append(_baseline_condition(data, rule))
+        else:
+            results.append(_baseline_rule(data, rule))
+    if operator == "and":
+        return all(results)
+    elif operator == "or":
+        return any(results)
+    return True
+
+
+def _baseline_rule(data, rule) -> bool:
+    field = rule.get("field")
+    operator = rule.get("operator")
+    expected = rule.get("value")
+    if not field or not operator:
+        return True
+
+    actual = data
+    for key in field.split('.'):
+        if isinstance(actual, dict):
+            actual = actual.get(key)
+        else:
+            actual = None
+            break
+
+    if actual is None:
+        return operator in ["!=", "not_in"] if expected is not None else True
+
+    try:
+        if operator == "==":
+            return actual == expected
+        elif operator == "!=":
+            return actual != expected
+        elif operator == ">":
+            return float(actual) > float(expected)
+        elif operator == ">=":
+            return float(actual) >= float(expected)
+        elif operator == "<":
+            return float(actual) < float(expected)
+        elif operator == "<=":
+            return float(actual) <= float(expected)
+        elif operator == "in":
+            return actual in expected
+        elif operator == "not_in":
+            return actual not in expected
+        elif operator == "contains":
+            return expected in str(actual)
+        elif operator == "starts_with":
+            return str(actual).startswith(str(expected))
+        elif operator == "ends_with":
+            return str(actual).endswith(str(expected))
+        return True
+    except (ValueError, TypeError):
+        return False
+
+
+FIELDS = ["price", "category", "title", "product.rating", "product.tags", "missing"]
+OPERATORS = ["==", "!=", ">", ">=", "<", "<=", "in", "not_in",
+             "contains", "starts_with", "ends_with", "unknown"]
+VALUES = [0, 1, 99.5, 100, "100", "abc", "books", "", None, True,
+          ["books", "toys"], [1, 100], [["nested"]], "sale"]
+
+
+def random_rule(rng: random.Random, depth: int = 0) -> Dict[str, Any]:
+    if depth < 2 and rng.random() < 0.25:
+        return random_condition(rng, depth + 1)
+    return {
+        "field": rng.choice(FIELDS),
+        "operator": rng.choice(OPERATORS),
+        "value": rng.choice(VALUES),
+    }
+
+
+def random_condition(rng: random.Random, depth: int = 0) -> Dict[str, Any]:
+    return {
+        "operator": rng.choice(["and", "and", "or", "xor"]),
+        "rules": [random_rule(rng, depth) for _ in range(rng.randint(0, 4))],
+    }
+
+
+def random_event(rng: random.Random) -> Dict[str, Any]:
+    event = {
+        "price": rng.choice([0, 50, 99.5, 100, 150, "100", "cheap", None]),
+        "category": rng.choice(["books", "toys", "food", 1, ["books"]]),
+        "title": rng.choice(["big sale", "new arrival", "", 42]),
+        "product": rng.choice([
+            {"rating": rng.randint(0, 5), "tags": ["a", "b"]},
+            {"rating": "high"},
+            "not a dict",
+        ]),
+    }
+    return {key: value for key, value in event.items() if rng.random() < 0.9}
+
+
+class TestCompiledCondition:
+    """Тесты компиляции условий."""
+
+    def test_matches_baseline_on_random_conditions(self):
+        """Тест совпадения с исходным интерпретатором на случайных условиях."""
+        rng = random.Random(1)
+        events = [random_event(rng) for _ in range(50)]
+
+        for _ in range(500):
+            condition = random_condition(rng)
+            source = json.dumps(condition)
+            compiled = ConditionChecker.compile(source)
+            for event in events:
+                assert compiled(event) == _baseline_check(event, source), (condition, event)
+
+    @pytest.mark.parametrize("conditions", [None, "", "{not json", "{}", '{"rules": []}'])
+    def test_empty_or_invalid_conditions_match(self, conditions):
+        """Тест: пустые и некорректные условия пропускают любое событие."""
+        assert ConditionChecker.check({"price": 1}, conditions) is True
+
+    def test_nested_fields_and_groups(self):
+        """Тест вложенных полей и вложенных групп правил."""
+        condition = {
+            "operator": "and",
+            "rules": [
+                {"field": "user.age", "operator": ">=", "value": 18},
+                {"operator": "or", "rules": [
+                    {"field": "user.country", "operator": "==", "value": "US"},
+                    {"field": "tags", "operator": "in", "value": ["vip"]},
+                ]},
+            ],
+        }
+        compiled = ConditionChecker.compile(condition)
+
+        assert compiled({"user": {"age": 25, "country": "US"}})
+        assert compiled({"user": {"age": 25, "country": "DE"}, "tags": "vip"})
+        assert not compiled({"user": {"age": 17, "country": "US"}})
+        assert not compiled({"user": "flat", "tags": "vip"})
+
+    def test_unhashable_value_in_list(self):
+        """Тест оператора in для нехешируемого значения поля."""
+        compiled = ConditionChecker.compile(
+            {"rules": [{"field": "tags", "operator": "in", "value": [["a"], "b"]}]}
+        )
+        assert compiled({"tags": ["a"]})
+        assert not compiled({"tags": ["c"]})
+
+
+class TestConditionCache:
+    """Тесты кэша скомпилированных условий."""
+
+    def test_reuses_compiled_condition(self):
+        """Тест: одна подписка компилируется один раз."""
+        cache = ConditionCache()
+        conditions = '{"rules": [{"field": "price", "operator": "<", "value": 10}]}'
+
+        first = cache.get(1, conditions)
+        assert cache.get(1, conditions) is first
+        assert len(cache) == 1
+
+    def test_recompiles_changed_conditions(self):
+        """Тест: изменённые условия компилируются заново."""
+        cache = ConditionCache()
+        cache.get(1, '{"rules": [{"field": "price", "operator": "<", "value": 10}]}')
+        compiled = cache.get(1, '{"rules": [{"field": "price", "operator": ">", "value": 10}]}')
+
+        assert compiled({"price": 20})
+        assert not compiled({"price": 5})
+
+    def test_invalidate(self):
+        """Тест сброса условия подписки."""
+        cache = ConditionCache()
+        first = cache.get(1, None)
+        cache.invalidate(1)
+
+        assert len(cache) == 0
+        assert cache.get(1, None) is not first
@@ -0,0 +1,158 @@
+"""
+Tests для конвейера доставки с пулом ботов рассылки (фейковые боты).
+"""
+
+import asyncio
+from typing import List, Optional, Tuple
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.methods import SendMessage
+from prometheus_client import REGISTRY
+
+from src.services.delivery import DeliveryJob, DeliveryPipeline
+from src.services.lanes import priority_rank
+from src.services.sharding import jump_hash
+
+BULK = priority_rank("bulk")
+
+
+class PoolBot:
+    """Бот, запоминающий отправленные сообщения; в чаты из failing отвечает ошибкой error."""
+
+    def __init__(self, failing=(), error: str = "forbidden"):
+        self.sent: List[Tuple[int, str]] = []
+        self.failing = set(failing)
+        self.error = error
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        if chat_id in self.failing:
+            method = SendMessage(chat_id=chat_id, text=text)
+            if self.error == "forbidden":
+                raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+            raise TelegramBadRequest(method, "Bad Request: message is too long")
+        self.sent.append((chat_id, text))
+
+
+def make_pipeline(bots: List[PoolBot], results: Optional[list] = None) -> DeliveryPipeline:
+    async def on_result(job: DeliveryJob, error: Optional[Exception]):
+        results.append((job.chat_id, error))
+
+    return DeliveryPipeline(
+        bots[0], on_result=on_result if results is not None else None,
+        global_rate=100000, chat_interval=0, broadcast_bots=bots[1:]
+    )
+
+
+def fallbacks(label: str) -> float:
+    return REGISTRY.get_sample_value('notification_bot_fallbacks_total', {'bot': label}) or 0.0
+
+
+async def deliver(pipeline: DeliveryPipeline, jobs: List[DeliveryJob]):
+    for job in jobs:
+        await pipeline.submit(job)
+    await pipeline.stop()
+
+
+class TestBotPinning:
+    """Тесты закрепления чатов за ботами пула."""
+
+    def test_broadcast_lane_pins_chat_by_jump_hash(self):
+        """Тест: в bulk чат всегда обслуживает бот jump_hash(chat_id), остальные лейны — главный бот."""
+        bots = [PoolBot() for _ in range(3)]
+        pipeline = make_pipeline(bots)
+
+        chats = range(1, 301)
+        pinned = {chat_id: pipeline.bot_for(DeliveryJob(chat_id, "", lane=BULK)) for chat_id in chats}
+        for chat_id, slot in pinned.items():
+            assert slot is pipeline.bots[jump_hash(chat_id, 3)]
+            assert pipeline.bot_for(DeliveryJob(chat_id, "again", lane=BULK)) is slot
+            for lane in ("urgent", "normal"):
+                assert pipeline.bot_for(DeliveryJob(chat_id, "", lane=priority_rank(lane))) is pipeline.bots[0]
+        assert {slot.label for slot in pinned.values()} == {"0", "1", "2"}
+
+    def test_new_bot_takes_chats_only_for_itself(self):
+        """Тест: при добавлении бота в пул чаты переезжают только на новый бот."""
+        smaller = make_pipeline([PoolBot() for _ in range(3)])
+        larger = make_pipeline([PoolBot() for _ in range(4)])
+
+        moved = 0
+        for chat_id in range(1, 1001):
+            before = smaller.bot_for(DeliveryJob(chat_id, "", lane=BULK)).label
+            after = larger.bot_for(DeliveryJob(chat_id, "", lane=BULK)).label
+            if before != after:
+                assert after == "3"
+                moved += 1
+        # About a quarter of the chats
+        assert 150 < moved < 350
+
+    def test_single_bot_sends_everything(self):
+        """Тест: без пула рассылки все сообщения уходят через главный бот."""
+        pipeline = make_pipeline([PoolBot()])
+
+        assert pipeline.bot_for(DeliveryJob(7, "", lane=BULK)) is pipeline.bots[0]
+
+    def test_messages_go_through_pinned_bots(self):
+        """Тест: сообщения bulk отправляет закреплённый бот, срочные — главный."""
+        bots = [PoolBot() for _ in range(3)]
+        pipeline = make_pipeline(bots)
+        chats = list(range(1, 31))
+        jobs = [DeliveryJob(chat_id, "bulk", lane=BULK) for chat_id in chats]
+        jobs += [DeliveryJob(chat_id, "urgent", lane=priority_rank("urgent")) for chat_id in chats]
+
+        asyncio.run(deliver(pipeline, jobs))
+
+        for index, bot in enumerate(bots):
+            bulk_chats = sorted(chat_id for chat_id, text in bot.sent if text == "bulk")
+            assert bulk_chats == [chat_id for chat_id in chats if jump_hash(chat_id, 3) == index]
+        assert sorted(chat_id for chat_id, text in bots[0].sent if text == "urgent") == chats
+        assert pipeline.get_stats()["sent"] == 60
+
+
+class TestMainBotFallback:
+    """Тесты повторной отправки через главный бот."""
+
+    def test_unreachable_pool_bot_falls_back_to_main_bot(self):
+        """Тест: если бот пула не может писать в чат, сообщение отправляет главный бот."""
+        chat_id = next(chat for chat in range(1, 100) if jump_hash(chat, 2) == 1)
+        bots = [PoolBot(), PoolBot(failing=[chat_id])]
+        results = []
+        pipeline = make_pipeline(bots, results)
+        before = fallbacks("1")
+
+        asyncio.run(deliver(pipeline, [DeliveryJob(chat_id, "hello", lane=BULK)]))
+
+        assert bots[0].sent == [(chat_id, "hello")]
+        assert bots[1].sent == []
+        # The chat is not reported unreachable
+        assert results == [(chat_id, None)]
+        assert fallbacks("1") - before == 1
+
+    def test_main_bot_error_is_final(self):
+        """Тест: ошибка главного бота после отката возвращается как итог отправки."""
+        chat_id = next(chat for chat in range(1, 100) if jump_hash(chat, 2) == 1)
+        bots = [PoolBot(failing=[chat_id]), PoolBot(failing=[chat_id])]
+        results = []
+        pipeline = make_pipeline(bots, results)
+
+        asyncio.run(deliver(pipeline, [DeliveryJob(chat_id, "hello", lane=BULK)]))
+
+        assert [type(error) for _, error in results] == [TelegramForbiddenError]
+        assert pipeline.get_stats()["failed"] == 1
+
+    @pytest.mark.parametrize("lane", ["bulk", "normal"])
+    def test_rejected_message_is_not_resent(self, lane):
+        """Тест: сообщение, отклонённое Telegram, не отправляется повторно главным ботом."""
+        chat_id = next(chat for chat in range(1, 100) if jump_hash(chat, 2) == 1)
+        failing = 1 if lane == "bulk" else 0
+        bots = [PoolBot(), PoolBot()]
+        bots[failing] = PoolBot(failing=[chat_id], error="bad_request")
+        results = []
+        pipeline = make_pipeline(bots, results)
+        before = fallbacks("1")
+
+        asyncio.run(deliver(pipeline, [DeliveryJob(chat_id, "x" * 5000, lane=priority_rank(lane))]))
+
+        assert bots[0].sent == bots[1].sent == []
+        assert [type(error) for _, error in results] == [TelegramBadRequest]
+        assert fallbacks("1") == before
@@ -0,0 +1,88 @@
+"""
+Unit tests для сборки сводок уведомлений.
+"""
+
+import html
+import re
+
+import pytest
+
+from src.services.digest import DigestItem, format_digest, shorten_html
+
+TAG_RE = re.compile(r"<[^>]*>")
+
+
+def is_balanced(text: str) -> bool:
+    """Все теги закрыты и ни одна сущность не обрезана."""
+    stack = []
+    for tag in re.findall(r"<(/?)(\w+)[^>]*>", text):
+        closing, name = tag
+        if closing:
+            if not stack or stack.pop() != name:
+                return False
+        else:
+            stack.append(name)
+    plain = TAG_RE.sub("", text)
+    return not stack and "<" not in plain and ">" not in plain and \
+        re.search(r"&(?!(amp|lt|gt|quot|#\d+);)", plain) is None
+
+
+def make_items(texts):
+    return [DigestItem(n, n, text) for n, text in enumerate(texts, start=1)]
+
+
+class TestFormatDigest:
+    """Тесты разбиения сводки на сообщения."""
+
+    def test_items_fit_into_one_message(self):
+        """Тест: короткие уведомления собираются в одно сообщение."""
+        items = make_items(["<b>one</b>", "<i>two</i>"])
+        messages = format_digest(items)
+
+        assert len(messages) == 1
+        text, chunk = messages[0]
+        assert chunk == items
+        assert text.endswith("<b>one</b>\n\n<i>two</i>")
+
+    def test_items_are_spread_over_messages(self):
+        """Тест: уведомления не разрываются между сообщениями."""
+        items = make_items([f"<b>{n}</b> " + "x" * 300 for n in range(40)])
+        messages = format_digest(items, max_length=1000)
+
+        assert [item for _, chunk in messages for item in chunk] == items
+        for text, chunk in messages:
+            assert len(text) <= 1000
+            assert all(item.text in text for item in chunk)
+
+    @pytest.mark.parametrize("body", [
+        "<b>" + "x" * 2000 + "</b>",
+        "<a href=\"https://example.com\">" + "link " * 400 + "</a>",
+        "&amp;" * 500,
+        "<i>" + "Цена &lt; 100 &amp; скидка " * 100 + "</i>",
+    ], ids=["tag", "link", "entities", "mixed"])
+    def test_oversized_item_keeps_markup_valid(self, body):
+        """Тест: слишком длинное уведомление укорачивается без обрезанных тегов и сущностей."""
+        text, chunk = format_digest(make_items(["<b>short</b>", body]), max_length=1000)[-1]
+
+        assert len(text) <= 1000
+        assert is_balanced(text)
+        assert text.endswith("…")
+        assert len(chunk) == 1
+
+
+class TestShortenHtml:
+    """Тесты укорачивания HTML-текста."""
+
+    def test_short_text_is_unchanged(self):
+        """Тест: текст в пределах лимита не меняется."""
+        assert shorten_html("<b>a &amp; b</b>", 100) == "<b>a &amp; b</b>"
+
+    @pytest.mark.parametrize("max_length", range(1, 30))
+    def test_never_cuts_an_entity(self, max_length):
+        """Тест: на любой границе сущности остаются целыми."""
+        text = "<b>" + "a&amp;b&lt;c " * 10 + "</b>"
+        shortened = shorten_html(text, max_length)
+
+        assert len(shortened) <= max_length
+        assert is_balanced(shortened)
+        assert html.unescape(shortened[:-1]) in html.unescape(TAG_RE.sub("", text))
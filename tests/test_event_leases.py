@@ -0,0 +1,144 @@
+"""
+Tests для захвата событий с арендой (lease).
+
+Несколько воркеров на одной базе не должны получить одно и то же событие,
+пока аренда его владельца не истекла.
+"""
+
+import asyncio
+from typing import List
+
+from src.database.db import create_database
+
+
+async def open_database(url: str):
+    db = create_database(url)
+    await db.connect()
+    return db
+
+
+async def add_events(db, count: int) -> List[int]:
+    event_type_id = await db.add_event_type("lease_test")
+    return await db.add_events([(event_type_id, {"n": n}) for n in range(count)])
+
+
+class TestClaimEvents:
+    """Тесты атомарного захвата событий."""
+
+    def test_concurrent_workers_claim_disjoint_events(self, database_url):
+        """Тест: параллельные воркеры делят события без пересечений."""
+        async def scenario():
+            setup = await open_database(database_url)
+            event_ids = await add_events(setup, 200)
+            workers = [await open_database(database_url) for _ in range(4)]
+
+            async def drain(db, owner: str) -> List[int]:
+                claimed = []
+                while True:
+                    events = await db.claim_events(owner, limit=7)
+                    if not events:
+                        return claimed
+                    claimed.extend(event['id'] for event in events)
+
+            claims = await asyncio.gather(*(
+                drain(db, f"worker-{n}") for n, db in enumerate(workers)
+            ))
+            for db in (setup, *workers):
+                await db.close()
+            return event_ids, claims
+
+        event_ids, claims = asyncio.run(scenario())
+        claimed = [event_id for worker_claims in claims for event_id in worker_claims]
+
+        assert sorted(claimed) == sorted(event_ids)
+        assert len(set(claimed)) == len(claimed)
+
+    def test_leased_event_is_reclaimed_only_after_expiry(self, database_url):
+        """Тест: событие в аренде недоступно другим до её истечения."""
+        async def scenario():
+            db = await open_database(database_url)
+            await add_events(db, 3)
+
+            first = await db.claim_events("a", lease_seconds=0.2)
+            while_leased = await db.claim_events("b")
+            await asyncio.sleep(0.3)
+            after_expiry = await db.claim_events("b")
+            await db.close()
+            return first, while_leased, after_expiry
+
+        first, while_leased, after_expiry = asyncio.run(scenario())
+
+        assert len(first) == 3
+        assert all(event['attempts'] == 1 for event in first)
+        assert while_leased == []
+        assert [event['id'] for event in after_expiry] == [event['id'] for event in first]
+        assert all(event['claimed_by'] == "b" and event['attempts'] == 2 for event in after_expiry)
+
+    def test_only_owner_extends_lease(self, database_url):
+        """Тест: продлить аренду может только её владелец."""
+        async def scenario():
+            db = await open_database(database_url)
+            event_ids = await add_events(db, 2)
+
+            await db.claim_events("a", lease_seconds=0.2)
+            await db.extend_leases([event_ids[0]], "a", lease_seconds=300)
+            await db.extend_leases([event_ids[1]], "b", lease_seconds=300)
+            await asyncio.sleep(0.3)
+            reclaimed = await db.claim_events("c")
+            await db.close()
+            return event_ids, reclaimed
+
+        event_ids, reclaimed = asyncio.run(scenario())
+
+        assert [event['id'] for event in reclaimed] == [event_ids[1]]
+
+    def test_released_events_are_claimable_at_once(self, database_url):
+        """Тест: освобождённые события сразу доступны другим воркерам."""
+        async def scenario():
+            db = await open_database(database_url)
+            event_ids = await add_events(db, 2)
+
+            await db.claim_events("a")
+            await db.release_events(event_ids, "a")
+            reclaimed = await db.claim_events("b")
+            await db.close()
+            return event_ids, reclaimed
+
+        event_ids, reclaimed = asyncio.run(scenario())
+
+        assert [event['id'] for event in reclaimed] == event_ids
+        # Released claims do not count as attempts
+        assert all(event['attempts'] == 1 for event in reclaimed)
+
+    def test_processed_events_are_not_claimed(self, database_url):
+        """Тест: обработанные события не захватываются повторно."""
+        async def scenario():
+            db = await open_database(database_url)
+            event_ids = await add_events(db, 2)
+
+            await db.claim_events("a", lease_seconds=0.1)
+            await db.mark_event_processed(event_ids[0])
+            await db.flush()
+            await asyncio.sleep(0.2)
+            reclaimed = await db.claim_events("b")
+            await db.close()
+            return event_ids, reclaimed
+
+        event_ids, reclaimed = asyncio.run(scenario())
+
+        assert [event['id'] for event in reclaimed] == [event_ids[1]]
+
+    def test_claim_by_id_skips_leased_events(self, database_url):
+        """Тест: захват по id пропускает события в чужой аренде."""
+        async def scenario():
+            db = await open_database(database_url)
+            event_ids = await add_events(db, 3)
+
+            await db.claim_events_by_id("a", event_ids[:1])
+            claimed = await db.claim_events_by_id("b", event_ids)
+            await db.close()
+            return event_ids, claimed
+
+        event_ids, claimed = asyncio.run(scenario())
+
+        assert [event['id'] for event in claimed] == event_ids[1:]
@@ -0,0 +1,107 @@
+"""
+Tests для обработчиков бота, через настоящий Dispatcher.
+"""
+
+import asyncio
+from datetime import datetime
+from typing import Any, Dict
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from src.bot.handlers import router
+from src.database.db import create_database
+
+MAIN_BOT_ID = 1001
+POOL_BOT_ID = 1002
+
+# A router can only be attached to one dispatcher
+dispatcher = Dispatcher()
+dispatcher.include_router(router)
+
+
+class DataBot(Bot):
+    """Bot с данными для обработчиков (bot["db"])."""
+
+    def __init__(self, bot_id: int):
+        super().__init__(token=f"{bot_id}:TEST")
+        self._data: Dict[str, Any] = {}
+
+    def __setitem__(self, key: str, value: Any):
+        self._data[key] = value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._data.get(key, default)
+
+
+def chat_member_update(update_id: int, telegram_id: int, bot_id: int, status: str) -> Update:
+    """Обновление my_chat_member: пользователь сменил статус бота."""
+    user = {"id": telegram_id, "is_bot": False, "first_name": "User"}
+    bot_user = {"id": bot_id, "is_bot": True, "first_name": "Bot"}
+    old_status, new_status = ("member", "kicked") if status == "kicked" else ("kicked", "member")
+    member = {
+        "member": {"status": "member", "user": bot_user},
+        "kicked": {"status": "kicked", "user": bot_user, "until_date": 0},
+    }
+    return Update.model_validate({
+        "update_id": update_id,
+        "my_chat_member": {
+            "chat": {"id": telegram_id, "type": "private"},
+            "from": user,
+            "date": int(datetime.now().timestamp()),
+            "old_chat_member": member[old_status],
+            "new_chat_member": member[new_status],
+        },
+    })
+
+
+class TestBotBlocked:
+    """Тесты отключения уведомлений при блокировке бота."""
+
+    @pytest.mark.parametrize("bot_id, active_after_block", [
+        (MAIN_BOT_ID, False),
+        (POOL_BOT_ID, True),
+    ])
+    def test_only_main_bot_block_deactivates(self, db_path, bot_id, active_after_block):
+        """Тест: блокировка бота из пула рассылки не отключает уведомления."""
+        async def feed_updates(db, user_id, bots):
+            await dispatcher.feed_update(
+                bots[bot_id], chat_member_update(1, 501, bot_id, "kicked"), main_bot_id=MAIN_BOT_ID
+            )
+            after_block = (await db.get_user(501))['is_active']
+
+            # Unblocking a pool bot does not resume a user who blocked the main bot
+            await db.set_user_active(user_id, False)
+            await dispatcher.feed_update(
+                bots[POOL_BOT_ID], chat_member_update(2, 501, POOL_BOT_ID, "member"),
+                main_bot_id=MAIN_BOT_ID
+            )
+            after_pool_unblock = (await db.get_user(501))['is_active']
+            await dispatcher.feed_update(
+                bots[MAIN_BOT_ID], chat_member_update(3, 501, MAIN_BOT_ID, "member"),
+                main_bot_id=MAIN_BOT_ID
+            )
+            after_main_unblock = (await db.get_user(501))['is_active']
+            return after_block, after_pool_unblock, after_main_unblock
+
+        async def scenario():
+            db = create_database(db_path)
+            await db.connect()
+            user_id = await db.add_user(501)
+
+            bots = {MAIN_BOT_ID: DataBot(MAIN_BOT_ID), POOL_BOT_ID: DataBot(POOL_BOT_ID)}
+            for handler_bot in bots.values():
+                handler_bot["db"] = db
+            try:
+                return await feed_updates(db, user_id, bots)
+            finally:
+                for handler_bot in bots.values():
+                    await handler_bot.session.close()
+                await db.close()
+
+        after_block, after_pool_unblock, after_main_unblock = asyncio.run(scenario())
+
+        assert bool(after_block) is active_after_block
+        assert not after_pool_unblock
+        assert after_main_unblock
@@ -0,0 +1,315 @@
+"""
+Tests для подавления дубликатов: ключи идемпотентности событий и
+повторная обработка события после потери аренды.
+"""
+
+import asyncio
+import logging
+
+from src.database.db import create_database
+from src.services import idempotency
+from src.services.idempotency import IdempotencyCache
+
+from .test_notification_service import FakeBot, add_subscribers, make_service, stop_service
+
+
+async def open_database(url: str):
+    db = create_database(url)
+    await db.connect()
+    return db
+
+
+async def execute_raw(db, sql: str):
+    """Выполнить SQL в обход методов Database (SQLite или PostgreSQL)."""
+    if hasattr(db, "connections"):
+        async with db.connections.write() as conn:
+            await conn.execute(sql)
+    else:
+        await db.connection.execute(sql)
+        await db.connection.commit()
+
+
+class TestIdempotencyCache:
+    """Тесты LRU-кэша ключей идемпотентности."""
+
+    def test_get_and_put(self):
+        """Тест: кэш возвращает событие, созданное для ключа."""
+        cache = IdempotencyCache()
+        cache.put("a", 1)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+
+    def test_entries_expire(self, monkeypatch):
+        """Тест: ключ забывается по истечении TTL."""
+        now = [1000.0]
+        monkeypatch.setattr(idempotency.time, "monotonic", lambda: now[0])
+        cache = IdempotencyCache(ttl=10)
+        cache.put("a", 1)
+
+        now[0] += 9
+        assert cache.get("a") == 1
+        now[0] += 2
+        assert cache.get("a") is None
+        assert len(cache) == 0
+
+    def test_evicts_least_recently_used(self):
+        """Тест: при переполнении вытесняется давно не использованный ключ."""
+        cache = IdempotencyCache(max_size=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+
+
+class TestEventIdempotencyKeys:
+    """Тесты уникального индекса по ключу идемпотентности событий."""
+
+    def test_reused_key_returns_existing_event(self, database_url):
+        """Тест: событие с уже использованным ключом не создаётся повторно."""
+        async def scenario():
+            db = await open_database(database_url)
+            event_type_id = await db.add_event_type("idempotency_test")
+
+            first = await db.add_event(event_type_id, {"n": 1}, idempotency_key="order-1")
+            again = await db.add_event(event_type_id, {"n": 2}, idempotency_key="order-1")
+            unkeyed = [
+                await db.add_event(event_type_id, {"n": 3}),
+                await db.add_event(event_type_id, {"n": 3}),
+            ]
+            pending = await db.count_pending_events()
+            await db.close()
+            return first, again, unkeyed, pending
+
+        first, again, unkeyed, pending = asyncio.run(scenario())
+
+        assert again == first
+        assert unkeyed[0] != unkeyed[1]
+        assert pending == 3
+
+    def test_batch_with_repeated_keys(self, database_url):
+        """Тест: пачка событий с повторяющимися и уже занятыми ключами."""
+        async def scenario():
+            db = await open_database(database_url)
+            event_type_id = await db.add_event_type("idempotency_test")
+
+            existing = await db.add_event(event_type_id, {"n": 0}, idempotency_key="k0")
+            event_ids = await db.add_events([
+                (event_type_id, {"n": 1}, "k1"),
+                (event_type_id, {"n": 2}, "k0"),
+                (event_type_id, {"n": 3}),
+                (event_type_id, {"n": 4}, "k1"),
+                (event_type_id, {"n": 5}, None),
+            ])
+            pending = await db.count_pending_events()
+            await db.close()
+            return existing, event_ids, pending
+
+        existing, event_ids, pending = asyncio.run(scenario())
+
+        assert len(event_ids) == 5
+        assert event_ids[1] == existing
+        assert event_ids[3] == event_ids[0]
+        assert len({existing, *event_ids}) == 4
+        assert pending == 4
+
+    def test_service_deduplicates_without_cache(self, database_url):
+        """Тест: повтор create_event после перезапуска отсекается индексом, а не кэшем."""
+        async def scenario():
+            db = await open_database(database_url)
+            bot = FakeBot()
+
+            service = make_service(db, bot)
+            first = await service.create_event("order_paid", {"n": 1}, idempotency_key="pay-1")
+            cached = await service.create_event("order_paid", {"n": 1}, idempotency_key="pay-1")
+            await stop_service(service)
+
+            restarted = make_service(db, bot)
+            again = await restarted.create_event("order_paid", {"n": 1}, idempotency_key="pay-1")
+            batch = await restarted.create_events([
+                ("order_paid", {"n": 2}, "pay-2"),
+                ("order_paid", {"n": 1}, "pay-1"),
+            ])
+            await stop_service(restarted)
+            pending = await db.count_pending_events()
+            await db.close()
+            return first, cached, again, batch, pending
+
+        first, cached, again, batch, pending = asyncio.run(scenario())
+
+        assert cached == first
+        assert again == first
+        assert batch[1] == first
+        assert pending == 2
+
+
+class TestDuplicateDeliveries:
+    """Тесты подавления повторной отправки одному получателю."""
+
+    def test_history_is_unique_per_event_and_user(self, database_url):
+        """Тест: запись истории для пары (событие, пользователь) создаётся один раз."""
+        async def scenario():
+            db = await open_database(database_url)
+            event_type_id = await db.add_event_type("history_test")
+            user_id = await db.add_user(201)
+            event_id = await db.add_event(event_type_id, {})
+
+            first = await db.add_notification(user_id, event_id, "first")
+            again = await db.add_notification(user_id, event_id, "again")
+            await db.queue_notification(user_id, event_id, "queued")
+            await db.flush()
+            history = await db.get_user_notifications(user_id)
+            await db.close()
+            return first, again, history
+
+        first, again, history = asyncio.run(scenario())
+
+        assert again == first
+        assert [row['message'] for row in history] == ["first"]
+
+    def test_old_duplicates_are_moved_aside(self, database_url, caplog):
+        """Тест: дубликаты истории старых версий переносятся, остаётся самая ранняя запись."""
+        async def scenario():
+            db = await open_database(database_url)
+            event_type_id = await db.add_event_type("migration_test")
+            user_id = await db.add_user(221)
+            event_id = await db.add_event(event_type_id, {})
+
+            # History logged before the unique index existed
+            await execute_raw(db, "DROP INDEX idx_notification_history_event_user")
+            for message, sent_at in (("late", "2026-01-01 12:00:00"),
+                                     ("early", "2026-01-01 09:00:00"),
+                                     ("latest", "2026-01-01 15:00:00")):
+                await execute_raw(db, f"""
+                    INSERT INTO notification_history (user_id, event_id, message, sent_at, status)
+                    VALUES ({user_id}, {event_id}, '{message}', '{sent_at}', 'sent')
+                """)
+            await db.close()
+
+            with caplog.at_level(logging.WARNING, logger="src.database.db"):
+                db = await open_database(database_url)
+                history = await db.get_user_notifications(user_id)
+                await db.close()
+                # The index now exists, so nothing is moved again
+                db = await open_database(database_url)
+                await db.close()
+            return history
+
+        history = asyncio.run(scenario())
+
+        assert [row['message'] for row in history] == ["early"]
+        moved = [record.getMessage() for record in caplog.records if "duplicate" in record.getMessage()]
+        assert len(moved) == 1
+        assert moved[0].startswith("Moved 2 duplicate")
+
+    def test_reservation_is_taken_once(self, database_url):
+        """Тест: строку истории резервирует только первая попытка, итог её заполняет."""
+        async def scenario():
+            db = await open_database(database_url)
+            event_type_id = await db.add_event_type("reservation_test")
+            users = [await db.add_user(telegram_id) for telegram_id in (211, 212, 213)]
+            event_id = await db.add_event(event_type_id, {})
+
+            first = await db.reserve_notifications(event_id, users[:2])
+            second = await db.reserve_notifications(event_id, users)
+            await db.queue_notification(users[0], event_id, "sent", status='sent')
+            await db.flush()
+            # The outcome of a logged pair is not overwritten
+            await db.queue_notification(users[0], event_id, "again", status='failed')
+            await db.flush()
+            history = {
+                user_id: await db.get_user_notifications(user_id) for user_id in users
+            }
+            await db.close()
+            return users, first, second, history
+
+        users, first, second, history = asyncio.run(scenario())
+
+        assert first == set(users[:2])
+        assert second == {users[2]}
+        assert [(row['message'], row['status']) for row in history[users[0]]] == [("sent", "sent")]
+        assert [row['status'] for row in history[users[1]]] == ["pending"]
+
+    def test_overlapping_attempts_send_once(self, database_url):
+        """Тест: повторная попытка не дублирует отправку, которая ещё не записана в историю."""
+        async def scenario():
+            first_db = await open_database(database_url)
+            second_db = await open_database(database_url)
+            event_type_id = await first_db.add_event_type("overlap_test")
+            await add_subscribers(first_db, event_type_id, [311, 312])
+            await first_db.add_event(event_type_id, {"n": 1})
+
+            # The first worker's sends outlast its lease and are not flushed yet
+            first_bot = FakeBot(slow_chats=[311, 312], delay=0.5)
+            first = make_service(first_db, first_bot)
+            events = await first_db.claim_events("first", lease_seconds=0.1)
+            sending = asyncio.create_task(first._fan_out(events[0]))
+            await asyncio.sleep(0.2)
+
+            second_bot = FakeBot()
+            second = make_service(second_db, second_bot)
+            claimed = await second.process_events()
+            await sending
+            for service in (first, second):
+                await stop_service(service)
+            for db in (first_db, second_db):
+                await db.close()
+            return claimed, first_bot.sent + second_bot.sent
+
+        claimed, sent = asyncio.run(scenario())
+
+        assert claimed == 1
+        assert sorted(chat_id for chat_id, _ in sent) == [311, 312]
+
+    def test_reclaimed_event_skips_reached_users(self, database_url):
+        """Тест: событие, захваченное повторно, не отправляется уже получившим его."""
+        async def scenario():
+            db = await open_database(database_url)
+            event_type_id = await db.add_event_type("reclaim_test")
+            users = await add_subscribers(db, event_type_id, [301, 302, 303])
+            event_id = await db.add_event(event_type_id, {"n": 1})
+
+            # A crashed worker claimed the event, sent it to 301 and queued
+            # a retry for 302 before its lease ran out
+            await db.claim_events("crashed", lease_seconds=0.1)
+            await db.add_notification(users[301], event_id, "sent")
+            await db.add_retry(users[302], event_id, 302, "failed", next_attempt_at=0)
+            await asyncio.sleep(0.2)
+
+            bot = FakeBot()
+            service = make_service(db, bot)
+            claimed = await service.process_events()
+            await stop_service(service)
+            history = await db.get_user_notifications(users[301])
+            await db.close()
+            return claimed, bot.sent, history
+
+        claimed, sent, history = asyncio.run(scenario())
+
+        assert claimed == 1
+        assert [chat_id for chat_id, _ in sent] == [303]
+        assert len(history) == 1
+
+    def test_first_attempt_sends_to_everyone(self, database_url):
+        """Тест: при первой попытке событие уходит всем подписчикам."""
+        async def scenario():
+            db = await open_database(database_url)
+            event_type_id = await db.add_event_type("first_attempt_test")
+            await add_subscribers(db, event_type_id, [401, 402])
+            await db.add_event(event_type_id, {"n": 1})
+
+            bot = FakeBot()
+            service = make_service(db, bot)
+            claimed = await service.process_events()
+            await stop_service(service)
+            await db.close()
+            return claimed, bot.sent
+
+        claimed, sent = asyncio.run(scenario())
+
+        assert claimed == 1
+        assert sorted(chat_id for chat_id, _ in sent) == [401, 402]
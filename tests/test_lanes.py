@@ -0,0 +1,146 @@
+"""
+Unit tests для приоритетных очередей (urgent, normal, bulk).
+"""
+
+import asyncio
+from collections import Counter
+from typing import Any, List
+
+import pytest
+
+from src.services.lanes import DEFAULT_LANE_WEIGHTS, LaneQueue, parse_lane_weights, priority_rank
+
+URGENT, NORMAL, BULK = (priority_rank(priority) for priority in ("urgent", "normal", "bulk"))
+
+
+async def take(queue: LaneQueue, count: int) -> List[Any]:
+    items = []
+    for _ in range(count):
+        items.append(await queue.get())
+        queue.task_done()
+    return items
+
+
+class TestLaneQueue:
+    """Тесты взвешенно-справедливой выборки из очередей."""
+
+    def test_busy_lanes_share_by_weight(self):
+        """Тест: пока все очереди заняты, они обслуживаются пропорционально весам."""
+        async def scenario():
+            queue = LaneQueue()
+            for lane in (URGENT, NORMAL, BULK):
+                for n in range(50):
+                    await queue.put((lane, n), lane)
+            return await take(queue, 26)
+
+        items = asyncio.run(scenario())
+
+        served = Counter(lane for lane, _ in items)
+        assert served == {URGENT: 16, NORMAL: 8, BULK: 2}
+        # Each lane stays FIFO
+        for lane in (URGENT, NORMAL, BULK):
+            assert [n for item_lane, n in items if item_lane == lane] == list(range(served[lane]))
+
+    def test_custom_weights(self):
+        """Тест: веса из настроек меняют доли очередей."""
+        async def scenario():
+            queue = LaneQueue(weights={"urgent": 1, "normal": 1, "bulk": 2})
+            for lane in (URGENT, NORMAL, BULK):
+                for n in range(20):
+                    await queue.put((lane, n), lane)
+            return await take(queue, 12)
+
+        items = asyncio.run(scenario())
+
+        assert Counter(lane for lane, _ in items) == {URGENT: 3, NORMAL: 3, BULK: 6}
+
+    def test_urgent_does_not_wait_behind_bulk_backlog(self):
+        """Тест: срочное сообщение ждёт не всю очередь bulk, а не больше одного её элемента."""
+        async def scenario():
+            queue = LaneQueue()
+            for n in range(100):
+                await queue.put((BULK, n), BULK)
+            # Bulk alone gets every consumer
+            drained = await take(queue, 30)
+            await queue.put((URGENT, 0), URGENT)
+            return drained, await take(queue, 2)
+
+        drained, items = asyncio.run(scenario())
+
+        assert [n for _, n in drained] == list(range(30))
+        assert (URGENT, 0) in items
+
+    def test_idle_lane_does_not_bank_credit(self):
+        """Тест: очередь, долго стоявшая пустой, не забирает всю пропускную способность."""
+        async def scenario():
+            queue = LaneQueue()
+            for n in range(40):
+                await queue.put((NORMAL, n), NORMAL)
+            await take(queue, 30)
+            for n in range(40):
+                await queue.put((URGENT, n), URGENT)
+            return await take(queue, 12)
+
+        items = asyncio.run(scenario())
+
+        # Without the reset urgent would take the next 60 items alone
+        assert Counter(lane for lane, _ in items)[NORMAL] >= 3
+
+    def test_full_lane_blocks_only_its_producers(self):
+        """Тест: заполненная очередь bulk не мешает добавлять в urgent."""
+        async def scenario():
+            queue = LaneQueue(maxsize=2)
+            for n in range(2):
+                await queue.put((BULK, n), BULK)
+            blocked = asyncio.create_task(queue.put((BULK, 2), BULK))
+            await asyncio.wait_for(queue.put((URGENT, 0), URGENT), timeout=1)
+            await asyncio.sleep(0)
+            was_blocked = not blocked.done()
+
+            # The urgent item is served first, then bulk frees a slot
+            await take(queue, 2)
+            await asyncio.wait_for(blocked, timeout=1)
+            return was_blocked, queue.get_depths()
+
+        was_blocked, depths = asyncio.run(scenario())
+
+        assert was_blocked
+        assert depths == {"urgent": 0, "normal": 0, "bulk": 2}
+
+    def test_join_waits_for_task_done(self):
+        """Тест: join() ждёт, пока каждый элемент не будет обработан."""
+        async def scenario():
+            queue = LaneQueue()
+            await queue.put("job", NORMAL)
+            await queue.get()
+            waiting = asyncio.create_task(queue.join())
+            await asyncio.sleep(0)
+            pending = not waiting.done()
+            queue.task_done()
+            await asyncio.wait_for(waiting, timeout=1)
+            return pending
+
+        assert asyncio.run(scenario())
+
+    @pytest.mark.parametrize("weights", [{"bulk": 0}, {"urgent": -1}])
+    def test_weights_must_be_positive(self, weights):
+        """Тест: нулевой или отрицательный вес отклоняется."""
+        with pytest.raises(ValueError):
+            LaneQueue(weights=weights)
+
+
+class TestParseLaneWeights:
+    """Тесты разбора весов очередей из настроек."""
+
+    def test_missing_lanes_keep_defaults(self):
+        """Тест: не указанные очереди сохраняют веса по умолчанию."""
+        assert parse_lane_weights(" urgent = 10 , bulk=0.5,") == {
+            **DEFAULT_LANE_WEIGHTS, "urgent": 10.0, "bulk": 0.5
+        }
+        assert parse_lane_weights("") == DEFAULT_LANE_WEIGHTS
+
+    @pytest.mark.parametrize("spec", ["critical=5", "urgent=fast", "urgent", "=3"])
+    def test_invalid_spec(self, spec):
+        """Тест: неизвестная очередь или некорректный вес — ошибка."""
+        with pytest.raises(ValueError):
+            parse_lane_weights(spec)
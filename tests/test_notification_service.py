@@ -0,0 +1,238 @@
+"""
+Tests для NotificationService на настоящей базе и фейковом боте.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, List, Tuple
+
+from src.database.db import create_database
+from src.services.delivery import DeliveryPipeline
+from src.services.lanes import PRIORITIES
+from src.services.notification_service import NotificationService
+from src.services.sharding import ShardPool
+
+logging.disable(logging.INFO)
+
+
+class FakeBot:
+    """Бот, запоминающий отправленные сообщения; отправка в chat_id из slow_chats занимает delay."""
+
+    def __init__(self, slow_chats=(), delay: float = 0.0):
+        self.sent: List[Tuple[int, str]] = []
+        self.slow_chats = set(slow_chats)
+        self.delay = delay
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        if chat_id in self.slow_chats:
+            await asyncio.sleep(self.delay)
+        self.sent.append((chat_id, text))
+
+
+def make_service(db, bot: FakeBot, **kwargs) -> NotificationService:
+    delivery = DeliveryPipeline(bot, global_rate=100000, chat_interval=0)
+    return NotificationService(db, bot, delivery=delivery, **kwargs)
+
+
+async def add_subscribers(db, event_type_id: int, telegram_ids: List[int]) -> Dict[int, int]:
+    """Подписать пользователей на тип события; возвращает telegram_id -> user_id."""
+    user_ids = {}
+    for telegram_id in telegram_ids:
+        user_id = await db.add_user(telegram_id)
+        await db.add_subscription(user_id, event_type_id, None)
+        user_ids[telegram_id] = user_id
+    return user_ids
+
+
+def quiet_hours_now() -> Tuple[int, int]:
+    """Тихие часы (по UTC), в которые попадает текущий момент."""
+    minute = int(time.time() // 60) % (24 * 60)
+    return (minute - 60) % (24 * 60), (minute + 60) % (24 * 60)
+
+
+async def stop_service(service: NotificationService):
+    await service._drain_shards()
+    await service.close()
+
+
+class TestPrefetchedLeases:
+    """Тесты аренды событий страницы, выбранной заранее."""
+
+    def test_prefetched_page_keeps_its_lease(self, database_url):
+        """Тест: аренда страницы в слоте предвыборки не истекает, пока идёт текущая страница."""
+        async def scenario():
+            db = create_database(database_url)
+            await db.connect()
+            rival = create_database(database_url)
+            await rival.connect()
+
+            event_type_id = await db.add_event_type("prefetch_test")
+            await add_subscribers(db, event_type_id, [101])
+            # Every send outlasts the lease
+            bot = FakeBot(slow_chats=[101], delay=0.5)
+            await db.add_events([(event_type_id, {"n": n}) for n in range(4)])
+
+            service = make_service(
+                db, bot, lease_seconds=0.3, claim_batch_size=3, min_claim_batch_size=1
+            )
+            # A one-slot lane queue keeps the first page's submits waiting, so
+            # the prefetched page sits in its slot for several lease periods
+            service.lane_pool = ShardPool(len(PRIORITIES), queue_size=1)
+            claims = []
+            claim_events = db.claim_events
+
+            async def counting_claim_events(*args, **kwargs):
+                events = await claim_events(*args, **kwargs)
+                claims.extend(events)
+                return events
+
+            db.claim_events = counting_claim_events
+            processing = asyncio.create_task(service.process_events())
+            # Wait for the first page and the prefetched one to be claimed
+            while len(claims) < 4:
+                await asyncio.sleep(0.01)
+
+            # Another worker polls for events with expired leases meanwhile
+            stolen = []
+            while not processing.done():
+                stolen.extend(await rival.claim_events("rival", lease_seconds=300))
+                await asyncio.sleep(0.05)
+
+            claimed = await processing
+            await stop_service(service)
+            await db.flush()
+            await rival.close()
+            await db.close()
+            return claimed, stolen, bot.sent
+
+        claimed, stolen, sent = asyncio.run(scenario())
+
+        assert claimed == 4
+        assert stolen == []
+        assert len(sent) == 4
+
+
+class TestAdaptiveBatchSize:
+    """Тесты подстройки размера страницы событий."""
+
+    def test_page_time_includes_sending(self, database_url):
+        """Тест: время страницы измеряется до конца отправки, а не до постановки в очередь."""
+        async def scenario():
+            db = create_database(database_url)
+            await db.connect()
+            event_type_id = await db.add_event_type("page_time_test")
+            await add_subscribers(db, event_type_id, [101])
+            await db.add_events([(event_type_id, {"n": n}) for n in range(3)])
+
+            bot = FakeBot(slow_chats=[101], delay=0.2)
+            service = make_service(db, bot)
+            observed = []
+            observe = service.batch_size.observe
+
+            def recording_observe(events, seconds):
+                observed.append((events, seconds))
+                observe(events, seconds)
+
+            service.batch_size.observe = recording_observe
+            claimed = await service.process_events()
+            await stop_service(service)
+            await db.close()
+            return claimed, observed, service.batch_size()
+
+        claimed, observed, size = asyncio.run(scenario())
+
+        assert claimed == 3
+        assert [events for events, _ in observed] == [3]
+        # One lane sends the three events one after another
+        assert observed[0][1] >= 0.6
+        assert size == 10
+
+
+class TestEventLanes:
+    """Тесты срока жизни и приоритета событий при обработке."""
+
+    def test_expired_event_is_dropped(self, database_url):
+        """Тест: событие старше TTL своего типа помечается обработанным без отправки."""
+        async def scenario():
+            db = create_database(database_url)
+            await db.connect()
+            short_lived = await db.add_event_type("expiring_test", ttl_seconds=0.1)
+            lasting = await db.add_event_type("lasting_test")
+            for event_type_id in (short_lived, lasting):
+                await add_subscribers(db, event_type_id, [701])
+            await db.add_events([(short_lived, {"n": 1}), (lasting, {"n": 2})])
+            await asyncio.sleep(0.2)
+
+            bot = FakeBot()
+            service = make_service(db, bot)
+            claimed = await service.process_events()
+            await stop_service(service)
+            await db.flush()
+            pending = await db.count_pending_events()
+            await db.close()
+            return claimed, bot.sent, pending
+
+        claimed, sent, pending = asyncio.run(scenario())
+
+        assert claimed == 2
+        assert len(sent) == 1
+        assert "lasting_test" in sent[0][1]
+        assert pending == 0
+
+    def test_urgent_event_ignores_quiet_hours(self, database_url):
+        """Тест: срочное событие отправляется в тихие часы, обычное откладывается."""
+        async def scenario():
+            db = create_database(database_url)
+            await db.connect()
+            urgent = await db.add_event_type("urgent_test", priority="urgent")
+            normal = await db.add_event_type("normal_test")
+            for event_type_id in (urgent, normal):
+                user_ids = await add_subscribers(db, event_type_id, [702])
+            await db.set_user_quiet_hours(user_ids[702], *quiet_hours_now())
+            await db.add_events([(urgent, {"n": 1}), (normal, {"n": 2})])
+
+            bot = FakeBot()
+            service = make_service(db, bot)
+            await service.process_events()
+            await stop_service(service)
+            deferred = await db.get_deferred_schedule()
+            await db.close()
+            return bot.sent, deferred
+
+        sent, deferred = asyncio.run(scenario())
+
+        assert len(sent) == 1
+        assert "urgent_test" in sent[0][1]
+        assert len(deferred) == 1
+        assert deferred[0][1] > time.time()
+
+
+class TestResizeShards:
+    """Тесты смены числа шардов на ходу."""
+
+    def test_events_are_delivered_across_resizes(self, database_url):
+        """Тест: после каждой смены числа шардов события доставляются всем подписчикам."""
+        async def scenario():
+            db = create_database(database_url)
+            await db.connect()
+            event_type_id = await db.add_event_type("resize_test")
+            await add_subscribers(db, event_type_id, [901, 902, 903])
+
+            bot = FakeBot()
+            service = make_service(db, bot, shards=3, partition_by="user")
+            pools = []
+            for n, shards in enumerate((3, 1, 2)):
+                await service.resize_shards(shards)
+                pools.append(service.shard_pool and service.shard_pool.shards)
+                await db.add_event(event_type_id, {"n": n})
+                await service.process_events()
+                await service._drain_shards()
+            await stop_service(service)
+            await db.close()
+            return pools, bot.sent
+
+        pools, sent = asyncio.run(scenario())
+
+        assert pools == [3, None, 2]
+        assert sorted(chat_id for chat_id, _ in sent) == [901] * 3 + [902] * 3 + [903] * 3
@@ -0,0 +1,147 @@
+"""
+Tests для тихих часов: окно доставки в местном времени пользователя и
+отложенные уведомления, переживающие перезапуск.
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from src.database.db import create_database
+from src.services.quiet_hours import DeferredSchedule, DeliveryWindow, get_window, parse_quiet_hours
+
+from .test_idempotency import execute_raw
+from .test_notification_service import FakeBot, add_subscribers, make_service, quiet_hours_now, stop_service
+
+NIGHT = parse_quiet_hours("22:00-07:00")
+
+
+def at(timezone: str, *local) -> float:
+    """Unix time местного момента в часовом поясе."""
+    return datetime(*local, tzinfo=ZoneInfo(timezone)).timestamp()
+
+
+class TestDeliveryWindow:
+    """Тесты вычисления конца тихих часов."""
+
+    @pytest.mark.parametrize("local, release", [
+        ((2026, 6, 10, 23, 30), (2026, 6, 11, 7, 0)),
+        ((2026, 6, 10, 22, 0), (2026, 6, 11, 7, 0)),
+        ((2026, 6, 11, 0, 0), (2026, 6, 11, 7, 0)),
+        ((2026, 6, 11, 6, 59), (2026, 6, 11, 7, 0)),
+        ((2026, 6, 11, 7, 0), None),
+        ((2026, 6, 11, 12, 0), None),
+        ((2026, 6, 11, 21, 59), None),
+    ])
+    def test_window_wrapping_midnight(self, local, release):
+        """Тест: окно 22:00-07:00 заканчивается в 07:00 того же или следующего дня."""
+        window = DeliveryWindow("Europe/Moscow", *NIGHT)
+        expected = at("Europe/Moscow", *release) if release else None
+
+        assert window.release_at(at("Europe/Moscow", *local)) == expected
+
+    def test_window_within_day(self):
+        """Тест: окно, не переходящее через полночь."""
+        window = DeliveryWindow(None, *parse_quiet_hours("13:00-15:30"))
+
+        assert window.release_at(at("UTC", 2026, 6, 10, 14, 0)) == at("UTC", 2026, 6, 10, 15, 30)
+        assert window.release_at(at("UTC", 2026, 6, 10, 15, 30)) is None
+        assert window.release_at(at("UTC", 2026, 6, 10, 12, 59)) is None
+
+    @pytest.mark.parametrize("local, hours", [
+        # Clocks go forward on 29 March: the night is an hour shorter
+        ((2026, 3, 28, 23, 0), 7),
+        # Clocks go back on 25 October: the night is an hour longer
+        ((2026, 10, 24, 23, 0), 9),
+    ], ids=["spring", "autumn"])
+    def test_night_across_dst_change(self, local, hours):
+        """Тест: конец ночи — 07:00 по местным часам и после перевода времени."""
+        window = DeliveryWindow("Europe/Berlin", *NIGHT)
+        now = at("Europe/Berlin", *local)
+        release = window.release_at(now)
+
+        assert datetime.fromtimestamp(release, ZoneInfo("Europe/Berlin")).strftime("%H:%M") == "07:00"
+        assert release - now == hours * 3600
+
+    def test_unknown_timezone_falls_back_to_utc(self):
+        """Тест: неизвестный часовой пояс считается как UTC."""
+        window = DeliveryWindow("Mars/Olympus", *NIGHT)
+
+        assert window.release_at(at("UTC", 2026, 6, 10, 23, 0)) == at("UTC", 2026, 6, 11, 7, 0)
+
+    def test_empty_window(self):
+        """Тест: без тихих часов или с пустым окном окна нет."""
+        assert get_window("UTC", None, None) is None
+        assert get_window("UTC", 600, 600) is None
+        assert get_window("UTC", *NIGHT) is get_window("UTC", *NIGHT)
+
+    @pytest.mark.parametrize("spec", ["22:00", "22-07", "25:00-07:00", ""])
+    def test_invalid_spec(self, spec):
+        """Тест: некорректная запись тихих часов — ошибка."""
+        with pytest.raises(ValueError):
+            parse_quiet_hours(spec)
+
+
+class TestDeferredSchedule:
+    """Тесты расписания отложенных уведомлений."""
+
+    def test_pop_due_earliest_first(self):
+        """Тест: наступившие элементы выдаются по времени, не больше limit за раз."""
+        schedule = DeferredSchedule()
+        for release_at, item_id in [(30, 3), (10, 1), (20, 2), (40, 4)]:
+            schedule.push(release_at, item_id)
+        schedule.push(5, 1)
+
+        assert schedule.next_at == 10
+        assert schedule.pop_due(35, limit=2) == [1, 2]
+        assert schedule.pop_due(35) == [3]
+        assert len(schedule) == 1
+        assert schedule.next_at == 40
+
+
+class TestDeferredRelease:
+    """Тесты отправки уведомлений, отложенных до конца тихих часов."""
+
+    def test_redelivered_after_restart(self, database_url):
+        """Тест: уведомление, отложенное до перезапуска, уходит по расписанию из базы."""
+        async def scenario():
+            db = create_database(database_url)
+            await db.connect()
+            event_type_id = await db.add_event_type("quiet_test")
+            user_ids = await add_subscribers(db, event_type_id, [801])
+            await db.set_user_quiet_hours(user_ids[801], *quiet_hours_now())
+            await db.add_event(event_type_id, {"n": 1})
+
+            first_bot = FakeBot()
+            first = make_service(db, first_bot)
+            await first.process_events()
+            await stop_service(first)
+            deferred = await db.get_deferred_schedule()
+
+            # Quiet hours end shortly after the restart
+            await execute_raw(
+                db, f"UPDATE deferred_notifications SET release_at = {time.time() + 0.3}"
+            )
+            bot = FakeBot()
+            # The periodic table sweep is too rare to release it in time
+            restarted = make_service(db, bot, deferred_sweep_interval=60)
+            restarted.start_deferred_release()
+            for _ in range(50):
+                if bot.sent:
+                    break
+                await asyncio.sleep(0.05)
+            await stop_service(restarted)
+            left = await db.get_deferred_schedule()
+            await db.close()
+            return first_bot.sent, deferred, bot.sent, left
+
+        sent_before, deferred, sent, left = asyncio.run(scenario())
+
+        assert sent_before == []
+        assert len(deferred) == 1
+        assert [chat_id for chat_id, _ in sent] == [801]
+        assert "quiet_test" in sent[0][1]
+        assert left == []
@@ -0,0 +1,180 @@
+"""
+Unit tests для предикатного индекса подписок.
+
+Индекс должен находить ровно тех подписчиков, чьи условия выполняются,
+то есть совпадать с полным перебором по скомпилированным условиям.
+"""
+
+import operator as op
+import random
+from typing import Any, Dict, List
+
+import pytest
+
+from src.services.condition_checker import ConditionChecker
+from src.services.subscription_index import EventTypeIndex, Subscriber, ThresholdList
+
+from .test_condition_checker import random_condition, random_event
+
+
+def make_subscriber(subscription_id: int, condition: Any, user_id: int = None) -> Subscriber:
+    return Subscriber(
+        subscription_id,
+        user_id if user_id is not None else subscription_id,
+        1000 + subscription_id,
+        ConditionChecker.compile(condition)
+    )
+
+
+def rule(field: str, operator: str, value: Any) -> Dict[str, Any]:
+    return {"operator": "and", "rules": [{"field": field, "operator": operator, "value": value}]}
+
+
+def matched_ids(index: EventTypeIndex, event: Dict[str, Any]) -> List[int]:
+    return sorted(subscriber.subscription_id for subscriber in index.match(event))
+
+
+def brute_force_ids(index: EventTypeIndex, event: Dict[str, Any]) -> List[int]:
+    return sorted(
+        subscription_id for subscription_id, subscriber in index.subscribers.items()
+        if subscriber.condition.evaluate(event)
+    )
+
+
+class TestEventTypeIndex:
+    """Тесты сопоставления событий через индекс."""
+
+    def test_matches_brute_force_on_random_conditions(self):
+        """Тест совпадения индекса с полным перебором на случайных условиях."""
+        rng = random.Random(2)
+        index = EventTypeIndex(1)
+        for subscription_id in range(1, 401):
+            index.add(make_subscriber(subscription_id, random_condition(rng)))
+
+        for _ in range(200):
+            event = random_event(rng)
+            assert matched_ids(index, event) == brute_force_ids(index, event), event
+
+    def test_equality_buckets(self):
+        """Тест хеш-корзин для операторов == и in."""
+        index = EventTypeIndex(1)
+        index.add(make_subscriber(1, rule("category", "==", "books")))
+        index.add(make_subscriber(2, rule("category", "in", ["books", "toys"])))
+        index.add(make_subscriber(3, rule("category", "in", ["food"])))
+        index.add(make_subscriber(4, rule("category", "==", 1)))
+
+        assert matched_ids(index, {"category": "books"}) == [1, 2]
+        assert matched_ids(index, {"category": "toys"}) == [2]
+        assert matched_ids(index, {"category": "auto"}) == []
+        assert matched_ids(index, {"category": 1.0}) == [4]
+        assert matched_ids(index, {"category": ["books"]}) == []
+        assert matched_ids(index, {}) == []
+
+    @pytest.mark.parametrize("operator", [">", ">=", "<", "<="])
+    @pytest.mark.parametrize("actual", [9.99, 10, 10.01, 20, "10", 0, -1, 100, float("nan")])
+    def test_threshold_edges(self, operator, actual):
+        """Тест границ бинарного поиска по порогам, включая равные пороги."""
+        index = EventTypeIndex(1)
+        for subscription_id, threshold in enumerate([10, 10, 20, 5, 10.01], start=1):
+            index.add(make_subscriber(subscription_id, rule("price", operator, threshold)))
+
+        event = {"price": actual}
+        assert matched_ids(index, event) == brute_force_ids(index, event)
+
+    def test_non_numeric_value_skips_thresholds(self):
+        """Тест: нечисловое значение поля не совпадает с числовыми правилами."""
+        index = EventTypeIndex(1)
+        index.add(make_subscriber(1, rule("price", "<", 100)))
+
+        assert matched_ids(index, {"price": "cheap"}) == []
+        assert matched_ids(index, {"price": 50}) == [1]
+
+    def test_anchor_rule_and_remaining_rules(self):
+        """Тест: кроме якорного правила проверяются остальные правила условия."""
+        index = EventTypeIndex(1)
+        index.add(make_subscriber(1, {"operator": "and", "rules": [
+            {"field": "category", "operator": "==", "value": "books"},
+            {"field": "price", "operator": "<", "value": 100},
+            {"field": "title", "operator": "contains", "value": "sale"},
+        ]}))
+
+        assert matched_ids(index, {"category": "books", "price": 50, "title": "big sale"}) == [1]
+        assert matched_ids(index, {"category": "books", "price": 150, "title": "big sale"}) == []
+        assert matched_ids(index, {"category": "books", "price": 50, "title": "new"}) == []
+
+    def test_unconditional_and_fallback(self):
+        """Тест подписок без условий и без индексируемого правила."""
+        index = EventTypeIndex(1)
+        index.add(make_subscriber(1, None))
+        index.add(make_subscriber(2, {"operator": "or", "rules": [
+            {"field": "price", "operator": "<", "value": 10},
+            {"field": "category", "operator": "==", "value": "books"},
+        ]}))
+        index.add(make_subscriber(3, rule("title", "ends_with", "sale")))
+
+        assert matched_ids(index, {"price": 5, "title": "big sale"}) == [1, 2, 3]
+        assert matched_ids(index, {"price": 50}) == [1]
+
+    def test_counts_evaluated_candidates(self):
+        """Тест: считаются только условия кандидатов, которых индекс не отсёк."""
+        index = EventTypeIndex(1)
+        index.add(make_subscriber(1, None))
+        index.add(make_subscriber(2, rule("title", "contains", "sale")))
+        index.add(make_subscriber(3, rule("category", "==", "books")))
+        index.add(make_subscriber(4, rule("category", "==", "toys")))
+        for subscription_id, threshold in enumerate([10, 20, 30], start=5):
+            index.add(make_subscriber(subscription_id, rule("price", "<", threshold)))
+
+        matched, evaluated = index.match_with_count({"category": "books", "price": 15})
+        assert sorted(subscriber.subscription_id for subscriber in matched) == [1, 3, 6, 7]
+        # Fallback 2, bucket "books" 3 and thresholds 20 and 30
+        assert evaluated == 4
+
+        assert index.match_with_count({}) == ([index.subscribers[1]], 1)
+
+    def test_replace_and_remove(self):
+        """Тест замены и удаления подписок из индекса."""
+        index = EventTypeIndex(1)
+        index.add(make_subscriber(1, rule("price", "<", 100), user_id=7))
+        index.add(make_subscriber(2, rule("category", "==", "books"), user_id=8))
+        index.add(make_subscriber(1, rule("price", ">", 100), user_id=7))
+
+        assert matched_ids(index, {"price": 50}) == []
+        assert matched_ids(index, {"price": 150}) == [1]
+
+        index.remove(2)
+        assert matched_ids(index, {"category": "books"}) == []
+        index.remove_user(7)
+        assert matched_ids(index, {"price": 150}) == []
+        assert len(index) == 0
+
+
+class TestThresholdList:
+    """Тесты отсортированного списка порогов."""
+
+    @pytest.mark.parametrize("operator", [">", ">=", "<", "<="])
+    @pytest.mark.parametrize("actual", [4.99, 5, 9.99, 10, 10.01, 20, 20.5])
+    def test_matching_is_exact(self, operator, actual):
+        """Тест: бинарный поиск возвращает ровно подходящие пороги, без лишних."""
+        compare = {">": op.gt, ">=": op.ge, "<": op.lt, "<=": op.le}[operator]
+        thresholds = ThresholdList()
+        entries = [(10.0, 1), (10.0, 2), (20.0, 3), (5.0, 4), (10.01, 5)]
+        for threshold, subscription_id in entries:
+            thresholds.add(threshold, subscription_id)
+
+        expected = sorted(
+            subscription_id for threshold, subscription_id in entries
+            if compare(actual, threshold)
+        )
+        assert sorted(thresholds.matching(operator, actual)) == expected
+
+    def test_remove_one_of_equal_thresholds(self):
+        """Тест удаления одного из одинаковых порогов."""
+        thresholds = ThresholdList()
+        for subscription_id in (1, 2, 3):
+            thresholds.add(10.0, subscription_id)
+        thresholds.remove(10.0, 2)
+
+        assert thresholds.ids == [1, 3]
+        assert thresholds.matching(">=", 10.0) == [1, 3]
+        assert thresholds.matching(">", 10.0) == []